@@ -0,0 +1,59 @@
+"""
+Micro-benchmark: HTML-to-text conversion of large newsletter-style HTML.
+
+Compares the old two-pass approach (``strip_html_tags`` followed by ``clean_text``) with the
+single-pass ``html_to_text`` converter.
+
+Usage: python benchmarks/bench_html.py [--repeat N] [--articles N]
+"""
+import argparse
+import timeit
+
+from email2md.email_processor import clean_text
+from email2md.html_utils import html_to_text, strip_html_tags
+
+
+def newsletter_html(articles: int = 2000) -> str:
+    """Build a newsletter-like HTML document with inline CSS, tables and tracking scripts."""
+    style = "\n".join(f".c{i} {{ color: #{i:06x}; margin: 0 {i % 7}px; }}" for i in range(300))
+    rows = []
+    for i in range(articles):
+        rows.append(
+            f'<tr><td class="c{i % 300}" style="padding:8px;font-family:Arial">'
+            f'<h2 style="font-size:18px">Article {i} &ndash; News &amp; Updates</h2>'
+            f"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.&nbsp;Sed do "
+            f"eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim "
+            f'veniam, <a href="https://example.com/track?id={i}">read more&hellip;</a></p>'
+            f'<img src="https://example.com/px/{i}.gif" width="1" height="1" alt="">'
+            f"</td></tr>\n"
+        )
+    return (
+        f"<!DOCTYPE html><html><head><title>Weekly</title><style>{style}</style>"
+        f"<script>window.dataLayer = [];</script></head><body>"
+        f'<table width="100%" cellpadding="0">{"".join(rows)}</table>'
+        f"<div>Unsubscribe<br>Imprint</div></body></html>"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs")
+    parser.add_argument("--articles", type=int, default=2000, help="Articles per document")
+    args = parser.parse_args()
+
+    html = newsletter_html(args.articles)
+    size_mb = len(html.encode()) / 1e6
+    print(f"Document size: {size_mb:.2f} MB")
+
+    candidates = {
+        "strip_html_tags + clean_text": lambda: clean_text(strip_html_tags(html)),
+        "html_to_text": lambda: html_to_text(html),
+    }
+    for label, func in candidates.items():
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f"{label:30s} {best * 1000:8.1f} ms  {size_mb / best:6.1f} MB/s  "
+              f"{len(func())} chars of text")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Startup benchmark for email2md.
+
+Times `email2md --help` and a run on a small corpus in fresh interpreters, checks them against
+target times and lists the slowest imports reported by `python -X importtime`.
+
+Usage:
+  python benchmarks/bench_startup.py [--repeat N] [--top N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from corpus import CorpusSpec, generate_corpus
+
+# Median wall time targets in seconds, including the interpreter's own startup
+HELP_TARGET = 0.15
+SMALL_RUN_TARGET = 0.5
+SMALL_RUN_MESSAGES = 10
+
+
+def median_time(command: List[str], repeat: int) -> float:
+    """Run ``command`` ``repeat`` times and return the median wall time."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def slowest_imports(command: List[str], top: int) -> List[Tuple[int, int, str]]:
+    """
+    Return the ``top`` modules with the highest own import time as (self, cumulative, name).
+
+    Times are in microseconds, as printed by ``python -X importtime``.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *command], check=True, capture_output=True, text=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(own), int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per command")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports listed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = Path(tmp) / "corpus"
+        generate_corpus(corpus_dir, CorpusSpec(count=SMALL_RUN_MESSAGES, attachment_kb=20))
+        email2md = ["-m", "email2md"]
+        run_args = ["-i", str(corpus_dir), "-o", str(Path(tmp) / "out" / "out.md"), "--no-cache"]
+        benchmarks = [
+            ("--help", [*email2md, "--help"], HELP_TARGET),
+            (f"{SMALL_RUN_MESSAGES} messages", [*email2md, *run_args], SMALL_RUN_TARGET),
+        ]
+
+        missed = 0
+        print(f"{'command':15s} {'median':>10s} {'target':>10s}")
+        for name, command, target in benchmarks:
+            seconds = median_time([sys.executable, *command], args.repeat)
+            flag = "" if seconds <= target else "  MISSED"
+            missed += bool(flag)
+            print(f"{name:15s} {seconds * 1000:8.1f}ms {target * 1000:8.1f}ms{flag}")
+
+        for name, command, _ in benchmarks:
+            print(f"\nSlowest imports of {name} (self and cumulative):")
+            for own, cumulative, module in slowest_imports(command, args.top):
+                print(f"  {own / 1000:7.1f}ms {cumulative / 1000:7.1f}ms  {module}")
+
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
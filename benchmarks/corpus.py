@@ -0,0 +1,112 @@
+"""
+Generate a reproducible synthetic corpus of .eml files for benchmarks.
+
+Usage: python benchmarks/corpus.py OUTPUT_DIR [--count N] [--seed N] [...]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt "
+    "ut labore et dolore magna aliqua today we went to the park and the baby laughed at ducks"
+).split()
+
+
+class CorpusSpec(NamedTuple):
+    """Knobs of a synthetic corpus."""
+
+    count: int = 200
+    seed: int = 0
+    # Relative weights of plain text, HTML only and multipart/alternative messages
+    plain: float = 0.4
+    html: float = 0.3
+    alternative: float = 0.3
+    # Share of messages with image attachments, and their number and size
+    attachment_ratio: float = 0.3
+    attachments: int = 3
+    attachment_kb: int = 200
+    # Average number of messages sent on the same day
+    per_day: float = 1.5
+
+
+def _paragraphs(rnd: random.Random, count: int) -> list:
+    return [
+        " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(20, 80))).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+def _html(paragraphs: list) -> str:
+    body = "".join(f'<p style="margin:0 0 8px">{p}</p>' for p in paragraphs)
+    return (
+        "<html><head><style>p { font-family: Arial; }</style></head>"
+        f'<body><table><tr><td>{body}</td></tr></table><div>Sent from my phone</div></body></html>'
+    )
+
+
+def generate_message(rnd: random.Random, spec: CorpusSpec, index: int, date: datetime) -> bytes:
+    """Build one message according to the spec."""
+    msg = EmailMessage()
+    msg["Subject"] = f"Message {index}: " + " ".join(rnd.choice(WORDS) for _ in range(4))
+    msg["From"] = "parent@example.com"
+    msg["To"] = "diary@example.com"
+    msg["Date"] = format_datetime(date)
+    msg["Message-ID"] = make_msgid(idstring=str(index), domain="example.com")
+
+    paragraphs = _paragraphs(rnd, rnd.randint(1, 6))
+    kind = rnd.choices(
+        ("plain", "html", "alternative"), weights=(spec.plain, spec.html, spec.alternative)
+    )[0]
+    if kind == "plain":
+        msg.set_content("\n\n".join(paragraphs))
+    elif kind == "html":
+        msg.set_content(_html(paragraphs), subtype="html")
+    else:
+        msg.set_content("\n\n".join(paragraphs))
+        msg.add_alternative(_html(paragraphs), subtype="html")
+
+    if spec.attachments and rnd.random() < spec.attachment_ratio:
+        for n in range(rnd.randint(1, spec.attachments)):
+            size = max(1, int(spec.attachment_kb * 1024 * rnd.uniform(0.5, 1.5)))
+            data = rnd.getrandbits(size * 8).to_bytes(size, "little")
+            msg.add_attachment(data, maintype="image", subtype="jpeg", filename=f"IMG_{n:04d}.jpg")
+
+    return bytes(msg)
+
+
+def generate_corpus(output_dir: Path, spec: Optional[CorpusSpec] = None) -> int:
+    """Write ``spec.count`` messages to ``output_dir``. Returns the total number of bytes."""
+    if spec is None:
+        spec = CorpusSpec()
+    rnd = random.Random(spec.seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    days = max(1, round(spec.count / spec.per_day))
+    total = 0
+    for index in range(spec.count):
+        date = start + timedelta(days=rnd.randrange(days), minutes=rnd.randrange(24 * 60))
+        data = generate_message(rnd, spec, index, date)
+        (output_dir / f"{index:06d}.eml").write_bytes(data)
+        total += len(data)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir", type=Path)
+    for field, default in CorpusSpec._field_defaults.items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    spec = CorpusSpec(**{field: getattr(args, field) for field in CorpusSpec._fields})
+    total = generate_corpus(args.output_dir, spec)
+    print(f"Wrote {spec.count} messages ({total / 1e6:.1f} MB) to '{args.output_dir}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark harness for email2md.
+
+Times the main pipeline stages on a synthetic corpus and writes throughput and peak memory to
+a JSON file, which can be compared against a baseline from another commit.
+
+Usage:
+  python benchmarks/run.py [--count N] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import logging
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict
+
+from bench_html import newsletter_html
+from corpus import CorpusSpec, generate_corpus
+
+from email2md.email_processor import EmailProcessor, clean_text
+from email2md.html_utils import html_to_text, strip_html_tags
+from email2md.markdown_generator import MarkdownGenerator
+
+# Slowdown relative to the baseline above which a benchmark is reported as a regression
+REGRESSION_THRESHOLD = 1.10
+
+
+def measure(func: Callable[[], object], repeat: int, items: int, size: int) -> Dict[str, float]:
+    """Time ``func`` (best of ``repeat``) and measure its peak Python memory in an extra run."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": best,
+        "items_per_s": items / best,
+        "mb_per_s": size / 1e6 / best,
+        "peak_mb": peak / 1e6,
+    }
+
+
+def measure_end_to_end(input_dir: Path, output_dir: Path, repeat: int, items: int, size: int):
+    """
+    Time a full CLI run in a subprocess and report its peak RSS.
+
+    Every run starts from an empty ``output_dir``, so no run reuses the images, caches or
+    indexes of an earlier one.
+    """
+    command = [
+        sys.executable, "-m", "email2md", "-i", str(input_dir),
+        "-o", str(output_dir / "out.md"), "--no-cache",
+    ]
+    times = []
+    for _ in range(repeat):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        start = time.perf_counter()
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            sys.stderr.write(e.stderr.decode(errors="replace"))
+            raise
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = maxrss if platform.system() == "Darwin" else maxrss * 1024
+    return {
+        "seconds": best,
+        "items_per_s": items / best,
+        "mb_per_s": size / 1e6 / best,
+        "peak_mb": peak / 1e6,
+    }
+
+
+def run_benchmarks(spec: CorpusSpec, repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = Path(tmp) / "corpus"
+        corpus_size = generate_corpus(corpus_dir, spec)
+        paths = sorted(corpus_dir.glob("*.eml"))
+        images_dir = Path(tmp) / "out" / ".images"
+
+        emails = []
+
+        def process():
+            # Start from an empty images folder, so images are really written every time
+            shutil.rmtree(images_dir, ignore_errors=True)
+            emails[:] = EmailProcessor().process_emails(paths, images_dir)[0]
+
+        results["process_email"] = measure(process, repeat, len(paths), corpus_size)
+
+        def render():
+            generator = MarkdownGenerator(images_dir)
+            for email in emails:
+                generator.add_chapter(email)
+            return generator.get_content()
+
+        rendered_size = len(render().encode())
+        results["get_content"] = measure(render, repeat, len(emails), rendered_size)
+
+        html = newsletter_html()
+        html_size = len(html.encode())
+        results["strip_html_tags"] = measure(lambda: strip_html_tags(html), repeat, 1, html_size)
+        results["html_to_text"] = measure(lambda: html_to_text(html), repeat, 1, html_size)
+
+        text = strip_html_tags(html)
+        results["clean_text"] = measure(lambda: clean_text(text), repeat, 1, len(text.encode()))
+
+        results["end_to_end"] = measure_end_to_end(
+            corpus_dir, Path(tmp) / "e2e", repeat, len(paths), corpus_size
+        )
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> int:
+    """Print timings relative to a baseline. Returns the number of regressions."""
+    regressions = 0
+    print(f"\n{'benchmark':20s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        ratio = current["seconds"] / baseline[name]["seconds"]
+        flag = "  REGRESSION" if ratio > REGRESSION_THRESHOLD else ""
+        regressions += bool(flag)
+        print(
+            f"{name:20s} {baseline[name]['seconds'] * 1000:8.1f}ms "
+            f"{current['seconds'] * 1000:8.1f}ms {ratio:6.2f}x{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="Number of messages in the corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument(
+        "--output", type=Path, default=Path(".benchmarks/latest.json"), help="Results file"
+    )
+    parser.add_argument("--compare", type=Path, help="Baseline results file to compare against")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    spec = CorpusSpec(count=args.count, seed=args.seed)
+    results = run_benchmarks(spec, args.repeat)
+
+    print(f"{'benchmark':20s} {'time':>10s} {'items/s':>10s} {'MB/s':>8s} {'peak MB':>8s}")
+    for name, r in results.items():
+        print(
+            f"{name:20s} {r['seconds'] * 1000:8.1f}ms {r['items_per_s']:10.1f} "
+            f"{r['mb_per_s']:8.1f} {r['peak_mb']:8.1f}"
+        )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(
+        json.dumps({"corpus": spec._asdict(), "results": results}, indent=2) + "\n"
+    )
+    print(f"\nResults written to '{args.output}'")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("corpus") != spec._asdict():
+            print("Warning: the baseline was recorded with a different corpus")
+        if compare(results, baseline["results"]):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,13 @@
 """Email to Markdown converter package."""
+
+__all__ = ["aiter_emails", "awrite_markdown", "iter_emails", "write_markdown"]
+
+
+def __getattr__(name):
+    # The streaming API is imported on first use, so the command line doesn't import the email
+    # modules at startup
+    if name in __all__:
+        from . import api
+
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,283 @@
+"""Library API: iterate over the emails of any input and write them as Markdown."""
+
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from .attachments import ImageStore, StoredImage
+from .config import IMAGES_DIR_NAME
+from .dates import day_key
+from .email_processor import DEFAULT_PLAN, EmailProcessor, ExtractionPlan, _process_email_worker
+from .markdown_generator import MarkdownGenerator
+from .prescan import drop_duplicates, prescan
+from .records import EmailRecord, image_ref
+from .sources import EmailSource, MboxIndex, discover_sources
+
+# Emails ``aiter_emails`` parses ahead of its consumer by default
+DEFAULT_CONCURRENCY = 4
+
+
+def _find_emails(
+    source: Union[str, Path],
+    since: Optional[str],
+    until: Optional[str],
+    dedupe: bool,
+    processor: EmailProcessor,
+) -> List[EmailSource]:
+    """Return the emails in ``source`` in the order a command line run processes them."""
+    metrics = processor.stats.metrics
+    # Nothing is written next to the input, mbox files are scanned again every time
+    sources = discover_sources(Path(source), MboxIndex(None))
+    headers = prescan(sources, since=since, until=until, metrics=metrics)
+    if dedupe:
+        headers, duplicates = drop_duplicates(headers, metrics=metrics)
+        processor.stats.duplicate_files.extend(entry.source for entry in duplicates)
+    return [entry.source for entry in headers]
+
+
+def _plan(plan: ExtractionPlan, images_dir: Optional[Path]) -> Tuple[ExtractionPlan, Path]:
+    """Skip the images if there's nowhere to save them."""
+    if images_dir is None:
+        return plan._replace(images=False), Path(IMAGES_DIR_NAME)
+    return plan, images_dir
+
+
+def _failed(source: EmailSource, error: Exception, failed: Optional[List[EmailSource]]) -> None:
+    logging.error(f"Failed to process '{source}': {error}")
+    if failed is not None:
+        failed.append(source)
+
+
+def iter_emails(
+    source: Union[str, Path],
+    images_dir: Optional[Path] = None,
+    plan: ExtractionPlan = DEFAULT_PLAN,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    dedupe: bool = True,
+    processor: Optional[EmailProcessor] = None,
+    failed: Optional[List[EmailSource]] = None,
+) -> Iterator[EmailRecord]:
+    """
+    Yield the emails in ``source`` one at a time, in chronological order.
+
+    ``source`` is anything the command line takes as input: a directory, an mbox file, a
+    Maildir folder or an archive. Only the headers of all emails are read up front, to sort them
+    and drop the ones outside ``since`` to ``until`` (``YYYY-MM-DD``) and copies of earlier
+    ones; every email is then parsed when its record is requested. Images are saved to
+    ``images_dir``, without it they are not extracted. Emails that fail to process are logged,
+    skipped and appended to ``failed``. Statistics are collected in ``processor``.
+    """
+    processor = processor if processor is not None else EmailProcessor()
+    plan, images_dir = _plan(plan, images_dir)
+    for email_source in _find_emails(source, since, until, dedupe, processor):
+        try:
+            record, _, _ = processor._process_email(email_source, images_dir, plan)
+        except Exception as e:
+            _failed(email_source, e, failed)
+            continue
+        yield record
+
+
+def _link_images(store: ImageStore, images: List[StoredImage], images_dir: Path) -> List[str]:
+    return [image_ref(store.link(image), images_dir) for image in images]
+
+
+async def aiter_emails(
+    source: Union[str, Path],
+    images_dir: Optional[Path] = None,
+    plan: ExtractionPlan = DEFAULT_PLAN,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    dedupe: bool = True,
+    processor: Optional[EmailProcessor] = None,
+    failed: Optional[List[EmailSource]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    executor: Optional[Executor] = None,
+) -> AsyncIterator[EmailRecord]:
+    """
+    Like ``iter_emails``, but for asyncio code: the event loop is never blocked.
+
+    Emails are parsed in ``executor``, the loop's default thread pool if None; pass a
+    ``ProcessPoolExecutor`` to parse on several CPUs. At most ``concurrency`` emails are parsed
+    or wait for the consumer at any time, so a slow consumer holds up parsing instead of
+    records piling up in memory. Finding the emails and linking their images happens in the
+    default thread pool. Records come in the same order and with the same image names as from
+    ``iter_emails``. Emails not started yet are cancelled when the iterator is closed early.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, not {concurrency}")
+    loop = asyncio.get_running_loop()
+    processor = processor if processor is not None else EmailProcessor()
+    plan, images_dir = _plan(plan, images_dir)
+    sources = await loop.run_in_executor(
+        None, _find_emails, source, since, until, dedupe, processor
+    )
+
+    # Workers only store the images, they are linked here in order like in a parallel run
+    store = ImageStore(images_dir, processor.stream_threshold)
+    remaining = iter(sources)
+    pending: Deque[Tuple[EmailSource, asyncio.Future]] = deque()
+
+    def submit() -> None:
+        for email_source in remaining:
+            future = loop.run_in_executor(
+                executor, _process_email_worker, email_source, images_dir, plan
+            )
+            pending.append((email_source, future))
+            return
+
+    try:
+        for _ in range(concurrency):
+            submit()
+        while pending:
+            email_source, future = pending.popleft()
+            try:
+                (record, _, _), stats = await future
+            except Exception as e:
+                _failed(email_source, e, failed)
+                submit()
+                continue
+            submit()
+            processor.stats.merge(stats)
+            if record.stored:
+                record.images = await loop.run_in_executor(
+                    None, _link_images, store, record.stored, images_dir
+                )
+                record.stored = ()
+            yield record
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+class _Chapters:
+    """Turns records arriving in chronological order into the chapters of the document."""
+
+    def __init__(
+        self, images_dir: Optional[Path], no_text: bool, no_images: bool, thumbnails: bool
+    ):
+        if images_dir is None:
+            images_dir = Path(IMAGES_DIR_NAME)
+        self.generator = MarkdownGenerator(images_dir, thumbnails=thumbnails)
+        self.header = ''.join(self.generator.content)
+        self.no_text = no_text
+        self.no_images = no_images
+        self.day: Optional[str] = None
+        self.count = 0
+
+    def starts_day(self, record: EmailRecord) -> bool:
+        """Check whether ``record`` completes the current day, by being from a later one."""
+        date_key = day_key(record.date)
+        if self.day is not None and date_key < self.day:
+            raise ValueError(
+                f"Records must be in chronological order, got one from {date_key} after {self.day}"
+            )
+        return self.day is not None and date_key != self.day
+
+    def add(self, record: EmailRecord) -> None:
+        self.generator.add_chapter(record, self.no_text, self.no_images)
+        self.day = day_key(record.date)
+        self.count += 1
+
+    def pop(self) -> str:
+        """Render the current day and forget its records, "" if there's nothing to show."""
+        if self.day is None:
+            return ""
+        chapter = self.generator.pop_chapter(self.day)
+        self.day = None
+        return chapter
+
+
+def write_markdown(
+    records: Iterable[EmailRecord],
+    stream: TextIO,
+    images_dir: Optional[Path] = None,
+    no_text: bool = False,
+    no_images: bool = False,
+    thumbnails: bool = False,
+) -> int:
+    """
+    Write records to a text stream as Markdown, one day at a time.
+
+    Records must come in chronological order, as ``iter_emails`` yields them; a day's chapter
+    is written as soon as a record from a later day arrives, so only the records of one day are
+    kept. The output is the same as that of the command line. Image links are relative to the
+    folder containing ``images_dir``, which is where the Markdown file belongs. Raises
+    ``ValueError`` for a record older than the previous one's day. Returns the number of
+    records written.
+    """
+    chapters = _Chapters(images_dir, no_text, no_images, thumbnails)
+    stream.write(chapters.header)
+    for record in records:
+        if chapters.starts_day(record):
+            stream.write(chapters.pop())
+        chapters.add(record)
+    stream.write(chapters.pop())
+    return chapters.count
+
+
+def _async_writer(stream, encoding: Optional[str]) -> Callable[[str], Awaitable[None]]:
+    """Return a coroutine function that writes text to ``stream`` without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    drain = getattr(stream, "drain", None)
+
+    async def write(text: str) -> None:
+        if not text:
+            return
+        data = text.encode(encoding) if encoding is not None else text
+        if asyncio.iscoroutinefunction(stream.write):
+            await stream.write(data)
+        elif drain is not None:
+            # Like ``asyncio.StreamWriter``, which buffers writes until drained
+            stream.write(data)
+            await drain()
+        else:
+            await loop.run_in_executor(None, stream.write, data)
+
+    return write
+
+
+async def awrite_markdown(
+    records: AsyncIterable[EmailRecord],
+    stream,
+    images_dir: Optional[Path] = None,
+    no_text: bool = False,
+    no_images: bool = False,
+    thumbnails: bool = False,
+    encoding: Optional[str] = None,
+) -> int:
+    """
+    Like ``write_markdown``, but for records from an async iterable such as ``aiter_emails``.
+
+    ``stream`` is a text stream, or with ``encoding`` a binary one such as an
+    ``asyncio.StreamWriter``. Its ``write`` is awaited if it's a coroutine, and its ``drain``
+    after every write if it has one, so a slow reader holds up the records. Plain files are
+    written in the default thread pool, where chapters are rendered as well.
+    """
+    loop = asyncio.get_running_loop()
+    write = _async_writer(stream, encoding)
+    chapters = _Chapters(images_dir, no_text, no_images, thumbnails)
+    await write(chapters.header)
+    async for record in records:
+        if chapters.starts_day(record):
+            await write(await loop.run_in_executor(None, chapters.pop))
+        chapters.add(record)
+    await write(await loop.run_in_executor(None, chapters.pop))
+    return chapters.count
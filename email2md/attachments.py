@@ -0,0 +1,290 @@
+"""Content-addressed storage of image attachments."""
+
+import binascii
+import hashlib
+import json
+import logging
+import os
+import shutil
+from email.message import Message
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, NamedTuple, Optional, Union, cast
+
+from .config import BLOBS_DIR_NAME, STREAM_ATTACHMENT_THRESHOLD, THUMBNAILS_DIR_NAME
+
+if TYPE_CHECKING:
+    from .writer import BackgroundWriter
+
+# Number of base64 characters decoded per step when streaming a payload to disk
+BASE64_CHUNK_SIZE = 1 << 20
+
+# Next to a blob: the thumbnails of its processed versions, and what the image stage did to it
+# (see image_processing)
+THUMBNAIL_BLOB_SUFFIX = ".thumb"
+PROCESSED_BLOB_SUFFIX = ".processed.json"
+
+
+class _HashingWriter:
+    """File wrapper that computes the SHA-256 digest of everything written through it."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self.digest.update(data)
+        self.size += len(data)
+        self._f.write(data)
+
+
+def _write_base64(encoded: str, f: Union[BinaryIO, _HashingWriter]) -> None:
+    """Decode base64 text chunk by chunk into an open binary file."""
+    pending = ""
+    for start in range(0, len(encoded), BASE64_CHUNK_SIZE):
+        chunk = pending + "".join(encoded[start : start + BASE64_CHUNK_SIZE].split())
+        # Only decode complete 4-character groups, carry the rest over to the next chunk
+        usable = len(chunk) - len(chunk) % 4
+        f.write(binascii.a2b_base64(chunk[:usable]))
+        pending = chunk[usable:]
+    if pending:
+        f.write(binascii.a2b_base64(pending + "=" * (-len(pending) % 4)))
+
+
+def _is_streamable(part: Message, stream_threshold: int) -> bool:
+    """Check whether a part is a base64 payload large enough to be decoded straight to disk."""
+    encoded = part.get_payload()
+    encoding = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+    return isinstance(encoded, str) and len(encoded) > stream_threshold and encoding == "base64"
+
+
+def _same_content(path: Path, blob: Path) -> bool:
+    """Check whether an existing file holds the same bytes as a blob."""
+    try:
+        if os.path.samefile(path, blob):
+            return True
+        if path.stat().st_size != blob.stat().st_size:
+            return False
+    except OSError:
+        return False
+    with path.open("rb") as a, blob.open("rb") as b:
+        while True:
+            chunk_a = a.read(1 << 20)
+            if chunk_a != b.read(1 << 20):
+                return False
+            if not chunk_a:
+                return True
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def thumbnail_path(image_path: Path) -> Path:
+    """Return where the thumbnail of a linked image is, if it has one."""
+    return image_path.parent / THUMBNAILS_DIR_NAME / image_path.name
+
+
+class StoredImage(NamedTuple):
+    """An image that was saved as a blob, but not linked into its date folder yet."""
+
+    filename: str
+    digest: str
+    date_key: str
+
+
+class ImageStore:
+    """
+    Content-addressed store for image attachments.
+
+    Every unique image is written once to ``<base_dir>/.blobs/<sha256>`` and hard-linked (or
+    copied, where the file system has no hard links) to ``<base_dir>/<date>/<filename>``, so the
+    Markdown links keep their usual form. Saving an image that is already there is a no-op. If a
+    different image already uses the name, the new one is saved as ``<stem>-<hash><suffix>``.
+    Which image gets which name depends on the order of ``link`` calls, so parallel callers
+    ``store`` concurrently and ``link`` in a fixed order.
+
+    The image stage never changes a blob, it writes smaller versions to
+    ``<sha256><variant>``, ``variant`` being ``ImageOptions.blob_suffix`` of its options. Linking
+    uses the version of ``variant`` where there is one and the original otherwise, updates files
+    that hold another version of the blob, and links the version's thumbnail next to the image
+    if there is one.
+
+    With a ``writer``, blobs decoded in memory are written in the background, and directories
+    are only created once. Blobs must be flushed before they are linked.
+    """
+
+    def __init__(
+        self,
+        base_dir: Path,
+        stream_threshold: int = STREAM_ATTACHMENT_THRESHOLD,
+        writer: Optional["BackgroundWriter"] = None,
+        variant: str = "",
+    ):
+        self.base_dir = base_dir
+        self.blobs_dir = base_dir / BLOBS_DIR_NAME
+        self.stream_threshold = stream_threshold
+        self.writer = writer
+        self.variant = variant
+        # Size of all decoded images and of the ones that were actually written
+        self.bytes_decoded = 0
+        self.bytes_written = 0
+
+    def _temp_path(self, directory: Path) -> Path:
+        return directory / f".tmp-{os.getpid()}-{os.urandom(16).hex()}"
+
+    def _makedirs(self, path: Path) -> None:
+        if self.writer is not None:
+            self.writer.makedirs(path)
+        else:
+            path.mkdir(parents=True, exist_ok=True)
+
+    def _store_blob(self, payload: Union[bytes, Message]) -> Optional[str]:
+        """Make sure the payload exists as a blob. Returns its digest, or None if it's empty."""
+        self._makedirs(self.blobs_dir)
+
+        if isinstance(payload, Message) and _is_streamable(payload, self.stream_threshold):
+            # Large payloads are decoded straight into a temporary file and hashed on the way
+            tmp = self._temp_path(self.blobs_dir)
+            try:
+                with tmp.open("wb") as f:
+                    writer = _HashingWriter(f)
+                    # ``_is_streamable`` made sure the payload is base64 text
+                    _write_base64(cast(str, payload.get_payload()), writer)
+            except binascii.Error as e:
+                # The email package is more forgiving with broken padding, let it have a go
+                tmp.unlink()
+                logging.debug(f"Streaming decode failed, decoding in memory: {e}")
+                return self._store_blob(payload.get_payload(decode=True) or b"")
+            if not writer.size:
+                tmp.unlink()
+                return None
+            self.bytes_decoded += writer.size
+            digest = writer.digest.hexdigest()
+            blob = self.blobs_dir / digest
+            if blob.exists():
+                tmp.unlink()
+            else:
+                os.replace(tmp, blob)
+                self.bytes_written += writer.size
+            return digest
+
+        data = payload.get_payload(decode=True) if isinstance(payload, Message) else payload
+        if not isinstance(data, bytes) or not data:
+            return None
+        self.bytes_decoded += len(data)
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.blobs_dir / digest
+        if self.writer is not None:
+            if self.writer.write_bytes(blob, data):
+                self.bytes_written += len(data)
+        elif not blob.exists():
+            tmp = self._temp_path(self.blobs_dir)
+            tmp.write_bytes(data)
+            os.replace(tmp, blob)
+            self.bytes_written += len(data)
+        return digest
+
+    def _link(self, blob: Path, target: Path) -> bool:
+        """Create ``target`` with the content of ``blob``. Returns False if it already exists."""
+        try:
+            os.link(blob, target)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            pass
+
+        # No hard links on this file system, fall back to a copy
+        if target.exists():
+            return False
+        tmp = self._temp_path(target.parent)
+        shutil.copyfile(blob, tmp)
+        os.replace(tmp, target)
+        return True
+
+    def _replace(self, blob: Path, target: Path) -> None:
+        """Replace an existing ``target`` with the content of ``blob``."""
+        tmp = self._temp_path(target.parent)
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, target)
+
+    def _blob(self, digest: str) -> Path:
+        """Return the version of a blob to link: the one of ``variant`` or the original."""
+        if self.variant:
+            processed = self.blobs_dir / f"{digest}{self.variant}"
+            if processed.exists():
+                return processed
+        return self.blobs_dir / digest
+
+    def _is_other_version(self, path: Path, digest: str) -> bool:
+        """Check whether a file holds the original of a blob or a version of other options."""
+        try:
+            info = json.loads((self.blobs_dir / f"{digest}{PROCESSED_BLOB_SUFFIX}").read_text())
+            sha256 = _sha256(path)
+            return sha256 == digest or sha256 in info["versions"]
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _link_thumbnail(self, digest: str, target: Path) -> None:
+        """Link the thumbnail of a blob's version next to the image linked at ``target``."""
+        if not self.variant:
+            return
+        blob = self.blobs_dir / f"{digest}{self.variant}{THUMBNAIL_BLOB_SUFFIX}"
+        if not blob.exists():
+            return
+        thumbnail = thumbnail_path(target)
+        self._makedirs(thumbnail.parent)
+        if not self._link(blob, thumbnail) and not _same_content(thumbnail, blob):
+            self._replace(blob, thumbnail)
+
+    def store(
+        self, filename: str, payload: Union[bytes, Message], date_key: str
+    ) -> Optional[StoredImage]:
+        """Save an image as a blob only. Returns None if it's empty."""
+        digest = self._store_blob(payload)
+        return StoredImage(filename, digest, date_key) if digest is not None else None
+
+    def link(self, image: StoredImage) -> Path:
+        """Make a stored image available in the folder of its date. Returns its path."""
+        target = self._link_image(image)
+        self._link_thumbnail(image.digest, target)
+        return target
+
+    def _link_image(self, image: StoredImage) -> Path:
+        filename, digest, date_key = image
+        blob = self._blob(digest)
+
+        date_folder = self.base_dir / date_key
+        self._makedirs(date_folder)
+        name = Path(filename)
+        for candidate in (filename, f"{name.stem}-{digest[:8]}{name.suffix}"):
+            target = date_folder / candidate
+            if self._link(blob, target):
+                return target
+            if _same_content(target, blob):
+                logging.debug(f"Image already stored: '{target}'")
+                return target
+            if self._is_other_version(target, digest):
+                logging.debug(f"Updating image to the version of the image options: '{target}'")
+                self._replace(blob, target)
+                return target
+            logging.debug(f"Image name '{candidate}' is taken by a different image")
+
+        # Even the hashed name is taken by something else, use the full digest
+        target = date_folder / f"{name.stem}-{digest}{name.suffix}"
+        if not self._link(blob, target) and not _same_content(target, blob):
+            self._replace(blob, target)
+        return target
+
+    def save(self, filename: str, payload: Union[bytes, Message], date_key: str) -> Optional[Path]:
+        """Save an image into the folder of its date. Returns its path, or None if it's empty."""
+        image = self.store(filename, payload, date_key)
+        return self.link(image) if image is not None else None
@@ -0,0 +1,169 @@
+"""On-disk cache of parsed emails."""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .config import DATE_KEY_FORMAT, IMAGES_DIR_NAME, TIMEZONE
+from .image_processing import DEFAULT_IMAGE_OPTIONS, ImageOptions
+from .records import EmailRecord
+from .sources import EmailSource
+
+# Bump whenever the extraction logic changes in a way that affects cached results
+CACHE_VERSION = 5
+
+
+def file_digest(path: EmailSource) -> str:
+    """Return the SHA-256 hex digest of a file's or mbox message's content."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk cache of extracted email content, keyed by source file content.
+
+    A file is a hit when its size and mtime are unchanged, or when its content hash still
+    matches. The whole cache is invalidated when ``CACHE_VERSION`` or relevant configuration
+    (timezone, date format, images directory, image options) changes, so the images of all
+    emails are processed again with the new ``image_options``.
+    """
+
+    def __init__(
+        self,
+        cache_file: Path,
+        images_base_dir: Path,
+        image_options: Optional[ImageOptions] = None,
+    ):
+        self.cache_file = cache_file
+        self.images_base_dir = images_base_dir
+        self.hits = 0
+        self.misses = 0
+        # Stat and hash of the files that missed, for ``store``
+        self._keys: Dict[str, Tuple[int, int, Optional[str]]] = {}
+        self._conn = sqlite3.connect(str(cache_file))
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        fingerprint = json.dumps(
+            [
+                CACHE_VERSION,
+                str(TIMEZONE),
+                DATE_KEY_FORMAT,
+                IMAGES_DIR_NAME,
+                str(images_base_dir),
+                list(image_options or DEFAULT_IMAGE_OPTIONS),
+            ]
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                logging.info(f"Configuration changed, invalidating cache: '{cache_file}'")
+            self._conn.execute("DROP TABLE IF EXISTS emails")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,)
+            )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS emails ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, "
+            "with_text INTEGER, with_images INTEGER, has_text INTEGER, has_images INTEGER, "
+            "subject TEXT, date TEXT, body TEXT, images TEXT)"
+        )
+        self._conn.commit()
+
+    def lookup(
+        self, email_path: EmailSource, text: bool = True, images: bool = True
+    ) -> Optional[Tuple[EmailRecord, bool, bool]]:
+        """
+        Return the cached result for a file, or None if it is new or has changed.
+
+        The result comes with flags telling whether the email has any text and images. Entries
+        only count as hits if they were extracted with at least the requested parts.
+        """
+        stat = email_path.stat()
+        key = str(email_path)
+        row = self._conn.execute(
+            "SELECT size, mtime_ns, sha256, subject, date, body, images, has_text, has_images "
+            "FROM emails "
+            "WHERE path = ? AND with_text >= ? AND with_images >= ?",
+            (key, text, images),
+        ).fetchone()
+
+        sha256 = None
+        if row is not None and (row[0], row[1]) != (stat.st_size, stat.st_mtime_ns):
+            # Touched or copied files keep their entry as long as the content is the same
+            sha256 = file_digest(email_path)
+            if sha256 == row[2]:
+                self._conn.execute(
+                    "UPDATE emails SET size = ?, mtime_ns = ? WHERE path = ?",
+                    (stat.st_size, stat.st_mtime_ns, key),
+                )
+            else:
+                row = None
+
+        if row is not None:
+            image_refs = [sys.intern(ref) for ref in json.loads(row[6])]
+            if all((self.images_base_dir.parent / ref).exists() for ref in image_refs):
+                self.hits += 1
+                logging.debug(f"Cache hit: '{email_path}'")
+                record = EmailRecord(row[3], datetime.fromisoformat(row[4]), row[5], image_refs)
+                return record, bool(row[7]), bool(row[8])
+
+        self.misses += 1
+        self._keys[key] = (stat.st_size, stat.st_mtime_ns, sha256)
+        return None
+
+    def store(
+        self,
+        email_path: EmailSource,
+        record: EmailRecord,
+        has_text: bool,
+        has_images: bool,
+        text: bool = True,
+        images: bool = True,
+    ) -> None:
+        """Record the extracted content of a file and which parts were extracted."""
+        key = str(email_path)
+        size, mtime_ns, sha256 = self._keys.pop(key, (None, None, None))
+        if size is None:
+            stat = email_path.stat()
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        if sha256 is None:
+            sha256 = file_digest(email_path)
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO emails "
+            "(path, size, mtime_ns, sha256, with_text, with_images, has_text, has_images, "
+            "subject, date, body, images) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                size,
+                mtime_ns,
+                sha256,
+                text,
+                images,
+                has_text,
+                has_images,
+                record.subject,
+                record.date.isoformat(),
+                record.body,
+                json.dumps(record.images),
+            ),
+        )
+
+    def commit(self) -> None:
+        """Write pending changes to disk."""
+        self._conn.commit()
+
+    def close(self) -> None:
+        """Commit pending changes and close the database."""
+        self._conn.commit()
+        self._conn.close()
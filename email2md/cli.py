@@ -1,13 +1,188 @@
 #!/usr/bin/env python3
 
-import sys
 import argparse
+import json
 import logging
+import os
+import sys
+import time
+from contextlib import ExitStack
+from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Set, Tuple
+
+from email2md.config import (
+    CACHE_FILE_NAME,
+    DATE_KEY_FORMAT,
+    DEFAULT_IMAGE_QUALITY,
+    DEFAULT_INPUT_DIR,
+    DEFAULT_OUTPUT_FILE,
+    IMAGES_DIR_NAME,
+    MBOX_INDEX_FILE_NAME,
+    SEARCH_INDEX_FILE_NAME,
+    SPLIT_FORMATS,
+    THUMBNAILS_DIR_NAME,
+)
+
+# The modules doing the work are imported by the commands that use them, so that '--help' and
+# argument errors don't pay for importing the email, multiprocessing and sqlite3 modules
+if TYPE_CHECKING:
+    from email2md.email_processor import EmailProcessor, ExtractionPlan
+    from email2md.image_processing import ImageOptions
+    from email2md.metrics import Metrics
+    from email2md.prescan import EmailHeaders
+    from email2md.records import EmailRecord
+    from email2md.sources import EmailSource
+    from email2md.writer import BackgroundWriter
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser, suppress: bool = False) -> None:
+    """
+    Add the options shared by all commands.
+
+    With ``suppress``, the options get no defaults, so a subcommand parser does not overwrite
+    values already given before the subcommand name.
+    """
+
+    def default(value):
+        return argparse.SUPPRESS if suppress else value
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--all",
+        action="store_true",
+        default=default(False),
+        help="Include both text and images in the Markdown (default)",
+    )
+    group.add_argument(
+        "--no-img",
+        "-ni",
+        action="store_true",
+        default=default(False),
+        help="Exclude attached images from the Markdown",
+    )
+    group.add_argument(
+        "--no-text",
+        "-nt",
+        action="store_true",
+        default=default(False),
+        help="Exclude message text from the Markdown",
+    )
+    parser.add_argument(
+        "--debug", "-d", action="store_true", default=default(False), help="Enable debug output"
+    )
+    parser.add_argument(
+        "--input-dir",
+        "-i",
+        type=str,
+        default=default(str(DEFAULT_INPUT_DIR)),
+        help="Directory containing .eml files, .mbox files or Maildir folders; "
+        "or a single mbox file or Maildir folder",
+    )
+    parser.add_argument(
+        "--output-file",
+        "-o",
+        type=str,
+        default=default(str(DEFAULT_OUTPUT_FILE)),
+        help="Output Markdown file",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=default(1),
+        help="Number of worker processes used to parse emails (0 = one per CPU, default: 1)",
+    )
+    parser.add_argument(
+        "--split",
+        choices=sorted(SPLIT_FORMATS),
+        default=default(None),
+        help="Write one Markdown file per month or year into a folder named like the output "
+        "file, which becomes an index linking to them",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=default(False),
+        help=f"Re-parse all emails instead of reusing results from '{CACHE_FILE_NAME}' "
+        "and rewrite the output instead of updating changed chapters only",
+    )
+    parser.add_argument(
+        "--search-index",
+        action="store_true",
+        default=default(False),
+        help=f"Also keep a full-text search index of the emails in '{SEARCH_INDEX_FILE_NAME}' "
+        "next to the output file, for 'email2md search'",
+    )
+    images = parser.add_argument_group(
+        "image options", "Shrink new images after parsing; needs 'pip install email2md[images]'"
+    )
+    images.add_argument(
+        "--max-image-size",
+        type=_positive,
+        default=default(None),
+        metavar="PIXELS",
+        help="Scale down JPEG, PNG and WebP images whose longer side is larger than this",
+    )
+    images.add_argument(
+        "--image-quality",
+        type=_quality,
+        default=default(None),
+        metavar="1-95",
+        help=f"Re-encode JPEG and WebP images with this quality (default when scaling down: "
+        f"{DEFAULT_IMAGE_QUALITY}); images are only replaced if the result is smaller",
+    )
+    images.add_argument(
+        "--thumbnails",
+        type=_positive,
+        default=default(None),
+        metavar="PIXELS",
+        help=f"Show images as thumbnails of this size in the Markdown, linked to the full "
+        f"images; thumbnails are saved in '{THUMBNAILS_DIR_NAME}' inside the image folders",
+    )
+    images.add_argument(
+        "--image-jobs",
+        type=int,
+        default=default(1),
+        help="Number of worker processes used to shrink images (0 = one per CPU, default: 1)",
+    )
+
+
+def _positive(value: str) -> int:
+    """Validate a positive integer given on the command line."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"invalid value '{value}', expected a positive number")
+    return number
+
 
-from email2md.config import DEFAULT_INPUT_DIR, DEFAULT_OUTPUT_FILE, IMAGES_DIR_NAME
-from email2md.email_processor import EmailProcessor
-from email2md.markdown_generator import MarkdownGenerator
+def _quality(value: str) -> int:
+    """Validate an image quality given on the command line."""
+    number = _positive(value)
+    if number > 95:
+        raise argparse.ArgumentTypeError(f"invalid quality '{value}', expected 1 to 95")
+    return number
+
+
+def _day(value: str) -> str:
+    """Validate a day given on the command line and return it as a day key."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime(DATE_KEY_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid day '{value}', expected YYYY-MM-DD") from None
+
+
+def _shard(value: str) -> Tuple[int, int]:
+    """Validate a shard given on the command line."""
+    from email2md.shards import parse_shard
+
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
 
 
 def parse_args() -> argparse.Namespace:
@@ -20,37 +195,215 @@ Examples:
   email2md --no-img                 # Exclude images from output
   email2md --no-text                # Only include images in output
   email2md -i /path/to/emails       # Process .eml files from specific directory
+  email2md -i /path/to/Inbox        # Process an mbox file or Maildir folder
+  email2md -j 4                     # Parse emails with 4 worker processes
+  email2md --since 2024-01-01       # Only convert emails from 2024 on
+  email2md --split month            # Write one Markdown file per month and an index
+  email2md --max-image-size 2048 --thumbnails 400  # Shrink images, show thumbnails
+  email2md --shard 1/4              # Process a quarter of the input on this machine
+  email2md merge out/*.shard-*.gz   # Write the Markdown from all shard results
+  email2md watch -i /path/to/Inbox  # Keep the output updated while emails arrive
+  email2md --search-index           # Also index the emails for 'email2md search'
+  email2md search "holiday"         # Find emails in the index next to the output
   email2md -d                       # Enable debug output
         """,
     )
-    group = parser.add_mutually_exclusive_group()
-    group.add_argument(
-        "--all", action="store_true", help="Include both text and images in the Markdown (default)"
+    _add_common_arguments(parser)
+    parser.add_argument(
+        "--since",
+        type=_day,
+        metavar="YYYY-MM-DD",
+        help="Only convert emails sent on or after this day",
     )
-    group.add_argument(
-        "--no-img", "-ni", action="store_true", help="Exclude attached images from the Markdown"
+    parser.add_argument(
+        "--until",
+        type=_day,
+        metavar="YYYY-MM-DD",
+        help="Only convert emails sent on or before this day",
     )
-    group.add_argument(
-        "--no-text", "-nt", action="store_true", help="Exclude message text from the Markdown"
+    parser.add_argument(
+        "--shard",
+        type=_shard,
+        metavar="i/N",
+        help="Only process the i-th of N hash-based parts of the input and save the result for "
+        "'email2md merge' instead of writing Markdown",
     )
-    parser.add_argument("--debug", "-d", action="store_true", help="Enable debug output")
     parser.add_argument(
-        "--input-dir",
-        "-i",
+        "--profile",
         type=str,
-        default=str(DEFAULT_INPUT_DIR),
-        help="Directory containing the .eml files",
+        metavar="FILE",
+        help="Write time and bytes in/out per stage and of the slowest files as JSON to FILE "
+        "('-' for stdout)",
     )
     parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="Number of slowest files listed in the profile (default: 10)",
+    )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Keep the Markdown updated while new emails arrive",
+        description="Convert the emails, then watch the input and update the Markdown "
+        "whenever emails are added, changed or removed. Stop with Ctrl+C.",
+    )
+    _add_common_arguments(watch_parser, suppress=True)
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="Seconds between checks of the input for changes (default: 2)",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="Seconds the input must stay unchanged before the output is updated (default: 1)",
+    )
+    merge_parser = subparsers.add_parser(
+        "merge",
+        help="Write the Markdown from the results of 'email2md --shard' runs",
+        description="Combine the files written by 'email2md --shard i/N' runs and write the "
+        "Markdown. The '.images/.blobs' folders of all shard runs must be copied into the "
+        "images folder next to the output file first.",
+    )
+    _add_common_arguments(merge_parser, suppress=True)
+    merge_parser.add_argument(
+        "shard_files", nargs="+", metavar="SHARD_FILE", help="Files written by the shard runs"
+    )
+    search_parser = subparsers.add_parser(
+        "search",
+        help="Search the emails in the index written with '--search-index'",
+        description="Print the chapters with emails matching a query, best matches first, from "
+        "the search index next to the output file: the file and heading of every chapter, then "
+        "its matching emails. The query uses SQLite FTS5 syntax, e.g. 'holiday', "
+        "'\"summer holiday\"', 'beach OR lake', 'subject:birthday' or 'photo*'.",
+    )
+    search_parser.add_argument("query", help="Words to search for")
+    search_parser.add_argument(
         "--output-file",
         "-o",
         type=str,
-        default=str(DEFAULT_OUTPUT_FILE),
-        help="Output Markdown file",
+        default=argparse.SUPPRESS,
+        help="Output Markdown file the index belongs to",
+    )
+    search_parser.add_argument(
+        "--since",
+        type=_day,
+        default=argparse.SUPPRESS,
+        metavar="YYYY-MM-DD",
+        help="Only show emails sent on or after this day",
+    )
+    search_parser.add_argument(
+        "--until",
+        type=_day,
+        default=argparse.SUPPRESS,
+        metavar="YYYY-MM-DD",
+        help="Only show emails sent on or before this day",
+    )
+    search_parser.add_argument(
+        "--limit",
+        type=_positive,
+        default=20,
+        metavar="N",
+        help="Show at most N chapters (default: 20)",
     )
     return parser.parse_args()
 
 
+def _output_targets(
+    args: argparse.Namespace, output_file: Path, images_dir: Path
+) -> List[Tuple[Path, bool, bool]]:
+    """Return the Markdown files to write with their ``no_text`` and ``no_images`` flags."""
+    if args.all:
+        # Generate all three versions in a single pass:
+        # normal (text + images), text only (no images) and images only (no text)
+        txt_only_file = output_file.with_name(f"{output_file.stem}_txt{output_file.suffix}")
+        img_only_file = output_file.with_name(f"{output_file.stem}_img{output_file.suffix}")
+        return [
+            (output_file, False, False),
+            (txt_only_file, False, True),
+            (img_only_file, True, False),
+        ]
+    if not args.no_img:
+        images_dir.mkdir(exist_ok=True)
+    return [(output_file, args.no_text, args.no_img)]
+
+
+def _image_options(args: argparse.Namespace) -> "ImageOptions":
+    """Return the settings of the image stage, exiting if they are used without Pillow."""
+    from email2md.image_processing import ImageOptions, require_pillow
+
+    options = ImageOptions(args.max_image_size, args.image_quality, args.thumbnails)
+    if options.enabled:
+        try:
+            require_pillow()
+        except ImportError as e:
+            logging.error(str(e))
+            sys.exit(1)
+    return options
+
+
+def watch(
+    args: argparse.Namespace,
+    input_dir: Path,
+    output_file: Path,
+    images_dir: Path,
+    writer: "BackgroundWriter",
+):
+    """Run the ``watch`` command until interrupted."""
+    from email2md.cache import ParseCache
+    from email2md.email_processor import ExtractionPlan
+    from email2md.search import SearchIndex
+    from email2md.watch import Watcher
+
+    targets = _output_targets(args, output_file, images_dir)
+    no_text = all(nt for _, nt, _ in targets)
+    no_images = all(ni for _, _, ni in targets)
+    plan = ExtractionPlan(text=not no_text, images=not no_images)
+    image_options = _image_options(args)
+    cache = None
+    if not args.no_cache:
+        cache = ParseCache(
+            output_file.parent / CACHE_FILE_NAME, images_dir, image_options=image_options
+        )
+    search_index = None
+    if args.search_index:
+        search_index = SearchIndex(output_file.parent / SEARCH_INDEX_FILE_NAME)
+        search_index.split = args.split
+    watcher = Watcher(
+        input_dir,
+        images_dir,
+        targets,
+        plan=plan,
+        jobs=args.jobs,
+        cache=cache,
+        interval=args.interval,
+        debounce=args.debounce,
+        split=args.split,
+        image_options=image_options,
+        image_jobs=args.image_jobs,
+        writer=writer,
+        search_index=search_index,
+        since=args.since,
+        until=args.until,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+    finally:
+        if cache is not None:
+            cache.close()
+        if search_index is not None:
+            search_index.close()
+
+
 def main():
     args = parse_args()
     logging.basicConfig(
@@ -60,33 +413,62 @@ def main():
     input_dir = Path(args.input_dir)
     output_file = Path(args.output_file)
 
+    if args.command == "search":
+        search(args, output_file)
+        return
+
     # Ensure output directory exists
     output_file.parent.mkdir(parents=True, exist_ok=True)
 
     # Use IMAGES_DIR_NAME for the images directory
     images_dir = output_file.parent / IMAGES_DIR_NAME
 
-    if not input_dir.exists():
-        logging.error(f"Input directory does not exist: '{input_dir}'")
+    from email2md.writer import BackgroundWriter
+
+    # Images and Markdown files are written in the background, everything is flushed on exit
+    writer = BackgroundWriter()
+    try:
+        run(args, input_dir, output_file, images_dir, writer)
+    finally:
+        # Writes queued after the last flush of the run
+        failed_writes = writer.close()
+    if failed_writes:
+        _report_failed_writes(failed_writes)
         sys.exit(1)
 
-    # Process all emails
-    failed_files = []
-    emails = []
-    processor = EmailProcessor()
 
-    for eml_path in input_dir.glob("*.eml"):
-        try:
-            result = processor.process_email(eml_path, images_dir)
-            emails.append(result)
-        except Exception as e:
-            logging.error(f"Failed to process '{eml_path}': {e}")
-            failed_files.append(eml_path)
+def _report_failed_writes(failed_writes: List[str]) -> None:
+    logging.error(f"Number of files that failed to write: {len(failed_writes)}")
+    for f in failed_writes:
+        logging.error(f"  - '{f}'")
 
-    if not emails:
-        logging.error("No email files were successfully processed")
+
+def run(
+    args: argparse.Namespace,
+    input_dir: Path,
+    output_file: Path,
+    images_dir: Path,
+    writer: "BackgroundWriter",
+):
+    """Run the command given on the command line."""
+    if args.command == "merge":
+        merge(args, output_file, images_dir, writer)
+        return
+
+    from email2md.cache import ParseCache
+    from email2md.email_processor import EmailProcessor, ExtractionPlan
+    from email2md.prescan import drop_duplicates, prescan
+    from email2md.shards import in_shard
+    from email2md.sources import MboxIndex, discover_sources
+
+    if not input_dir.exists():
+        logging.error(f"Input does not exist: '{input_dir}'")
         sys.exit(1)
 
+    if args.command == "watch":
+        watch(args, input_dir, output_file, images_dir, writer)
+        return
+
     # Determine output mode
     no_text = args.no_text
     no_images = args.no_img
@@ -94,60 +476,519 @@ def main():
         no_text = False
         no_images = False
 
+    # Find all emails, mbox files are indexed instead of split into files
+    started = time.perf_counter()
+    mbox_index = MboxIndex(output_file.parent / MBOX_INDEX_FILE_NAME)
+    sources = discover_sources(input_dir, mbox_index)
+    mbox_index.save()
+
+    # Process all emails, extracting only the parts the output will use
+    plan = ExtractionPlan(text=not no_text, images=not no_images)
+    # Shard runs don't link images, their paths are only decided by the merge
+    use_cache = not args.no_cache and args.shard is None
+    image_options = _image_options(args)
+    cache = None
+    if use_cache:
+        cache = ParseCache(
+            output_file.parent / CACHE_FILE_NAME, images_dir, image_options=image_options
+        )
+    processor = EmailProcessor(
+        cache,
+        link_images=args.shard is None,
+        image_options=image_options,
+        image_jobs=args.image_jobs,
+        writer=writer,
+    )
+    metrics = processor.stats.metrics
+    metrics.add("discover", time.perf_counter() - started)
+
+    # Read only the headers first, to order the emails by date and drop the ones out of range
+    headers = prescan(sources, since=args.since, until=args.until, metrics=metrics)
+    # Copies of the same message are dropped before their bodies and images are decoded
+    headers, duplicates = drop_duplicates(headers, metrics=metrics)
+    if args.shard is not None:
+        # All shards see the same headers, so the order and the duplicates are the same in all
+        order = {entry.source: i for i, entry in enumerate(headers)}
+        headers = [h for h in headers if in_shard(h.source, input_dir, *args.shard)]
+        duplicates = [h for h in duplicates if in_shard(h.source, input_dir, *args.shard)]
+    processor.stats.duplicate_files.extend(entry.source for entry in duplicates)
+    if args.no_cache and args.split is None and args.shard is None:
+        render_by_day(args, input_dir, headers, processor, plan, output_file, images_dir, writer)
+        return
+    sources = [entry.source for entry in headers]
+    try:
+        results, failed_files = processor.process_sources(
+            sources, images_dir, jobs=args.jobs, plan=plan
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if args.shard is not None:
+        write_shard(args, input_dir, output_file, processor, sources, order, results, failed_files)
+        return
+
+    emails = [results[source] for source in sources if source in results]
+    if not emails:
+        logging.error("No email files were successfully processed")
+        sys.exit(1)
+    if args.search_index:
+        from email2md.shards import source_key
+
+        update_search_index(
+            output_file,
+            [(source_key(s, input_dir), results[s]) for s in sources if s in results],
+            metrics,
+            args.split,
+        )
+    render(args, emails, processor, failed_files, output_file, images_dir, writer)
+
+
+def write_shard(
+    args: argparse.Namespace,
+    input_dir: Path,
+    output_file: Path,
+    processor: "EmailProcessor",
+    sources: List["EmailSource"],
+    order: Dict["EmailSource", int],
+    results: Dict["EmailSource", "EmailRecord"],
+    failed_files: List["EmailSource"],
+):
+    """Save the results of a ``--shard`` run for ``email2md merge``."""
+    from email2md.shards import (
+        ShardRecord,
+        ShardResult,
+        shard_file_name,
+        source_key,
+        write_shard_file,
+    )
+
+    no_text_files = set(processor.stats.no_text_files)
+    no_images_files = set(processor.stats.no_images_files)
+    records = [
+        ShardRecord(
+            order[source],
+            source_key(source, input_dir),
+            record.subject,
+            record.date,
+            record.body,
+            list(record.stored),
+            source not in no_text_files,
+            source not in no_images_files,
+        )
+        for source, record in ((s, results[s]) for s in sources if s in results)
+    ]
+    index, count = args.shard
+    shard_file = shard_file_name(output_file, index, count)
+    write_shard_file(
+        shard_file,
+        ShardResult(
+            index,
+            count,
+            records,
+            [source_key(source, input_dir) for source in failed_files],
+            [source_key(source, input_dir) for source in processor.stats.duplicate_files],
+        ),
+    )
+    logging.info(f"Wrote {len(records)} emails of shard {index}/{count}: '{shard_file}'")
+    if failed_files:
+        logging.error(f"Failed to process {len(failed_files)} files:")
+        for f in failed_files:
+            logging.error(f"  - '{f}'")
+    # Images of the shard that are missing would only be noticed by the merge
+    if processor.stats.failed_writes:
+        _report_failed_writes(processor.stats.failed_writes)
+        sys.exit(1)
+
+
+def merge(
+    args: argparse.Namespace, output_file: Path, images_dir: Path, writer: "BackgroundWriter"
+):
+    """Run the ``merge`` command: render the output from the files of all shard runs."""
+    from email2md.attachments import ImageStore
+    from email2md.email_processor import EmailProcessor
+    from email2md.image_processing import process_images
+    from email2md.records import EmailRecord, image_ref
+    from email2md.shards import read_shard_files
+
+    try:
+        shards = read_shard_files([Path(f) for f in args.shard_files])
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to read shard files: {e}")
+        sys.exit(1)
+
+    records = sorted((r for shard in shards for r in shard.records), key=lambda r: r.order)
+    if not records:
+        logging.error("No email files were successfully processed")
+        sys.exit(1)
+
+    processor = EmailProcessor()
+    image_options = _image_options(args)
+    if image_options.enabled:
+        # Images the shard runs processed already are skipped
+        process_images(
+            [image for r in records for image in r.images],
+            images_dir,
+            image_options,
+            jobs=args.image_jobs,
+            metrics=processor.stats.metrics,
+        )
+
+    # Shard results name emails by their ``source_key``, the summary reports them under it
+    failed_files: List["EmailSource"] = [Path(f) for shard in shards for f in shard.failed_files]
+
+    # Images are linked in the order of a single run, so they get the same names
+    started = time.perf_counter()
+    store = ImageStore(images_dir, writer=writer, variant=image_options.blob_suffix)
+    merged = []
+    emails = []
+    for r in records:
+        try:
+            images = [image_ref(store.link(image), images_dir) for image in r.images]
+        except OSError as e:
+            logging.error(f"Failed to link the images of '{r.source}': {e}")
+            failed_files.append(Path(r.source))
+            continue
+        merged.append(r)
+        emails.append(EmailRecord(r.subject, r.date, r.body, images))
+    processor.stats.metrics.add("images", time.perf_counter() - started)
+
+    stats = processor.stats
+    stats.no_text_files.extend(Path(r.source) for r in merged if not r.has_text)
+    stats.no_images_files.extend(Path(r.source) for r in merged if not r.has_images)
+    stats.no_content_files.extend(
+        Path(r.source) for r in merged if not r.has_text and not r.has_images
+    )
+    stats.duplicate_files.extend(Path(f) for shard in shards for f in shard.duplicate_files)
+    logging.info(f"Merging {len(records)} emails from {len(shards)} shards")
+    if args.search_index:
+        # The same names as in a single run, so switching between both keeps the index
+        update_search_index(
+            output_file,
+            [(r.source, email) for r, email in zip(merged, emails)],
+            processor.stats.metrics,
+            args.split,
+        )
+    render(args, emails, processor, failed_files, output_file, images_dir, writer)
+
+
+def update_search_index(
+    output_file: Path,
+    entries: List[Tuple[str, "EmailRecord"]],
+    metrics: "Metrics",
+    split: Optional[str],
+) -> None:
+    """Bring the search index next to ``output_file`` up to date with the emails of this run."""
+    search_index = _SearchIndexUpdate(output_file, metrics, split)
+    search_index.update(entries)
+    search_index.close()
+
+
+def search(args: argparse.Namespace, output_file: Path):
+    """Run the ``search`` command: print the chapters with emails matching the query."""
+    import sqlite3
+
+    from email2md.search import SearchIndex
+
+    index_file = output_file.parent / SEARCH_INDEX_FILE_NAME
+    if not index_file.exists():
+        logging.error(
+            f"No search index next to '{output_file}', create it by running with --search-index"
+        )
+        sys.exit(1)
+    index = SearchIndex(index_file)
+    try:
+        chapters = index.search_chapters(
+            args.query, since=args.since, until=args.until, limit=args.limit
+        )
+        split = index.split
+    except sqlite3.OperationalError as e:
+        logging.error(f"Invalid search query '{args.query}': {e}")
+        sys.exit(1)
+    finally:
+        index.close()
+
+    if not chapters:
+        logging.info("No emails found")
+        sys.exit(1)
+    for chapter in chapters:
+        # The file and heading of the chapter, like grep, to find it in an editor
+        path = output_file
+        if split is not None:
+            part = datetime.strptime(chapter.day, DATE_KEY_FORMAT).strftime(SPLIT_FORMATS[split])
+            path = output_file.parent / output_file.stem / f"{part}{output_file.suffix}"
+        print(f"{path}: ## {chapter.subject} -- {chapter.date}")
+        for hit in chapter.hits:
+            print(f"    {hit.date} -- {hit.subject}")
+            if hit.snippet:
+                print(f"        {' '.join(hit.snippet.split())}")
+
+
+def render(
+    args: argparse.Namespace,
+    emails: List["EmailRecord"],
+    processor: "EmailProcessor",
+    failed_files: List["EmailSource"],
+    output_file: Path,
+    images_dir: Path,
+    writer: "BackgroundWriter",
+):
+    """Write the Markdown output and report how the run went."""
+    from email2md.markdown_generator import MarkdownGenerator
+
+    metrics = processor.stats.metrics
+
     # Generate markdown
     try:
-        if args.all:
-            # Generate all three versions
-            # 1. Normal (text + images)
-            markdown_gen = MarkdownGenerator(images_dir, output_file)
-            for email in sorted(emails, key=lambda x: x[1]):
-                markdown_gen.add_chapter(*email, no_text=False, no_images=False)
-            output_file.write_text(markdown_gen.get_content())
-            logging.info(f"Successfully created: '{output_file}'")
-
-            # 2. Text only (no images)
-            txt_only_file = output_file.with_name(f"{output_file.stem}_txt{output_file.suffix}")
-            markdown_gen_txt = MarkdownGenerator(images_dir, txt_only_file)
-            for email in sorted(emails, key=lambda x: x[1]):
-                markdown_gen_txt.add_chapter(*email, no_text=False, no_images=True)
-            txt_only_file.write_text(markdown_gen_txt.get_content())
-            logging.info(f"Successfully created: '{txt_only_file}'")
-
-            # 3. Images only (no text)
-            img_only_file = output_file.with_name(f"{output_file.stem}_img{output_file.suffix}")
-            markdown_gen_img = MarkdownGenerator(images_dir, img_only_file)
-            for email in sorted(emails, key=lambda x: x[1]):
-                markdown_gen_img.add_chapter(*email, no_text=True, no_images=False)
-            img_only_file.write_text(markdown_gen_img.get_content())
-            logging.info(f"Successfully created: '{img_only_file}'")
+        started = time.perf_counter()
+        markdown_gen = MarkdownGenerator(
+            images_dir, output_file, thumbnails=args.thumbnails is not None, writer=writer
+        )
+        for record in sorted(emails, key=lambda x: x.date):
+            markdown_gen.add_chapter(record)
+
+        targets = _output_targets(args, output_file, images_dir)
+        created_files = [path for path, _, _ in targets]
+        if args.split:
+            written_files = markdown_gen.write_split(
+                targets, args.split, jobs=args.jobs, incremental=not args.no_cache
+            )
+        elif args.no_cache:
+            with ExitStack() as stack:
+                markdown_gen.write_variants(
+                    [
+                        (stack.enter_context(writer.stream(path.open("w"), path)), nt, ni)
+                        for path, nt, ni in targets
+                    ]
+                )
+            written_files = created_files
         else:
-            if not no_images:
-                images_dir.mkdir(exist_ok=True)
+            # Only re-render days that changed since the last run
+            markdown_gen.write_incremental(targets)
+            written_files = created_files
+        processor.stats.failed_writes.extend(writer.flush())
 
-            markdown_gen = MarkdownGenerator(images_dir, output_file)
-            for email in sorted(emails, key=lambda x: x[1]):
-                markdown_gen.add_chapter(*email, no_text=no_text, no_images=no_images)
+        metrics.add(
+            "render",
+            time.perf_counter() - started,
+            bytes_out=sum(written_file.stat().st_size for written_file in written_files),
+        )
+        report(args, processor, failed_files, created_files, written_files)
+
+    except Exception as e:
+        logging.error(f"Failed to generate markdown: {e}")
+        sys.exit(1)
 
-            # Write output
-            output_file.write_text(markdown_gen.get_content())
-            logging.info(f"Successfully created: '{output_file}'")
 
-        # Print processing summary
-        processor.print_summary()
+def render_by_day(
+    args: argparse.Namespace,
+    input_dir: Path,
+    headers: List["EmailHeaders"],
+    processor: "EmailProcessor",
+    plan: "ExtractionPlan",
+    output_file: Path,
+    images_dir: Path,
+    writer: "BackgroundWriter",
+):
+    """
+    Parse and write the emails a few days at a time, in the order of the prescan.
 
-        if failed_files:
-            logging.error(f"Failed to process {len(failed_files)} files:")
-            for f in failed_files:
-                logging.error(f"  - '{f}'")
+    Used when the output is written from scratch anyway (``--no-cache`` without ``--split``):
+    only the emails of one batch of days, see ``PARSE_BATCH_SIZE``, are in memory at a time.
+    The output files are written next to their final place and replace them once complete.
+    """
+    from email2md.config import PARSE_BATCH_SIZE
+    from email2md.markdown_generator import MarkdownGenerator
+    from email2md.shards import source_key
 
-        # Exit with error if there were emails with no content
-        if processor.stats.no_content_files:
+    metrics = processor.stats.metrics
+    targets = _output_targets(args, output_file, images_dir)
+    created_files = [path for path, _, _ in targets]
+    temp_files = [path.with_name(f".{path.name}.tmp") for path in created_files]
+    markdown_gen = MarkdownGenerator(
+        images_dir, output_file, thumbnails=args.thumbnails is not None, writer=writer
+    )
+    search_index = None
+    if args.search_index:
+        search_index = _SearchIndexUpdate(output_file, metrics, args.split)
+    failed_files: List["EmailSource"] = []
+    count = 0
+    render_seconds = 0.0
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    try:
+        with ExitStack() as stack:
+            executor = None
+            if jobs > 1:
+                # One pool for all batches
+                from concurrent.futures import ProcessPoolExecutor
+
+                executor = stack.enter_context(ProcessPoolExecutor(jobs))
+            streams = [
+                (stack.enter_context(writer.stream(tmp.open("w"), path)), nt, ni)
+                for tmp, (path, nt, ni) in zip(temp_files, targets)
+            ]
+            for stream, _, _ in streams:
+                stream.writelines(markdown_gen.content)
+
+            for batch in _day_batches(headers, PARSE_BATCH_SIZE):
+                results, failed = processor.process_sources(
+                    batch, images_dir, jobs=jobs, plan=plan, executor=executor
+                )
+                failed_files.extend(failed)
+                records = [results[source] for source in batch if source in results]
+                started = time.perf_counter()
+                for record in records:
+                    markdown_gen.add_chapter(record)
+                markdown_gen.write_days(streams, pop=True)
+                render_seconds += time.perf_counter() - started
+                if search_index is not None:
+                    search_index.update(
+                        [(source_key(s, input_dir), results[s]) for s in batch if s in results]
+                    )
+                for record in records:
+                    processor.bodies.release(record)
+                count += len(records)
+        if search_index is not None:
+            search_index.close()
+        processor.stats.failed_writes.extend(writer.flush())
+
+        if not count:
+            logging.error("No email files were successfully processed")
             sys.exit(1)
+        for tmp, path in zip(temp_files, created_files):
+            os.replace(tmp, path)
+        metrics.add(
+            "render", render_seconds, bytes_out=sum(path.stat().st_size for path in created_files)
+        )
+        report(args, processor, failed_files, created_files, created_files)
 
     except Exception as e:
         logging.error(f"Failed to generate markdown: {e}")
         sys.exit(1)
+    finally:
+        for tmp in temp_files:
+            tmp.unlink(missing_ok=True)
+
+
+def _day_batches(headers: List["EmailHeaders"], batch_size: int) -> Iterator[List["EmailSource"]]:
+    """Split the prescanned emails into batches of whole days of about ``batch_size`` bytes."""
+    from email2md.email_processor import _file_size
 
+    batch: List["EmailSource"] = []
+    size = 0
+    day = None
+    for entry in headers:
+        if entry.day != day and size >= batch_size:
+            yield batch
+            batch, size = [], 0
+        day = entry.day
+        batch.append(entry.source)
+        size += _file_size(entry.source)
+    if batch:
+        yield batch
+
+
+class _SearchIndexUpdate:
+    """
+    Brings the search index next to ``output_file`` up to date with the emails of a run.
+
+    Emails can be given a few at a time; ``close`` removes the ones that weren't given and
+    records the ``--split`` period, to show where the chapters are. Errors are logged and stop
+    the update, the Markdown is written anyway.
+    """
+
+    def __init__(self, output_file: Path, metrics: "Metrics", split: Optional[str]):
+        import sqlite3
+
+        from email2md.search import SearchIndex
+
+        self.index_file = output_file.parent / SEARCH_INDEX_FILE_NAME
+        self.metrics = metrics
+        self.split = split
+        self.seen: Set[str] = set()
+        self.indexed = 0
+        self.index: Optional[SearchIndex] = None
+        started = time.perf_counter()
+        try:
+            self.index = SearchIndex(self.index_file)
+        except sqlite3.Error as e:
+            self._failed(e)
+        metrics.add("search", time.perf_counter() - started)
+
+    def _failed(self, error: Exception) -> None:
+        # E.g. an SQLite library without FTS5
+        logging.error(f"Failed to update the search index '{self.index_file}': {error}")
+        if self.index is not None:
+            self.index.close()
+        self.index = None
+
+    def update(self, entries: List[Tuple[str, "EmailRecord"]]) -> None:
+        """Index the new and changed emails among ``(source, record)`` pairs."""
+        import sqlite3
+
+        if self.index is None:
+            return
+        started = time.perf_counter()
+        self.seen.update(source for source, _ in entries)
+        try:
+            self.indexed += self.index.update(entries, complete=False)[0]
+        except sqlite3.Error as e:
+            self._failed(e)
+        self.metrics.add("search", time.perf_counter() - started)
+
+    def close(self) -> None:
+        """Remove the emails that weren't given and close the index."""
+        import sqlite3
+
+        if self.index is None:
+            return
+        started = time.perf_counter()
+        try:
+            removed = self.index.retain(self.seen)
+            self.index.split = self.split
+        except sqlite3.Error as e:
+            self._failed(e)
+            return
+        self.index.close()
+        self.index = None
+        self.metrics.add("search", time.perf_counter() - started)
+        logging.info(f"Search index: {self.indexed} emails indexed, {removed} removed")
+
+
+def report(
+    args: argparse.Namespace,
+    processor: "EmailProcessor",
+    failed_files: List["EmailSource"],
+    created_files: List[Path],
+    written_files: List[Path],
+):
+    """Report how the run went and exit with an error if anything is missing from the output."""
+    metrics = processor.stats.metrics
+    for created_file in created_files:
+        logging.info(f"Successfully created: '{created_file}'")
+    if args.split:
+        logging.info(f"Split into {len(written_files) - len(created_files)} files")
+
+    # Print processing summary
+    processor.print_summary()
+
+    if args.profile:
+        metrics.log_report(args.profile_top)
+        profile = json.dumps(metrics.to_dict(args.profile_top), indent=2)
+        if args.profile == "-":
+            print(profile)
+        else:
+            Path(args.profile).write_text(profile + "\n")
+
+    if failed_files:
+        logging.error(f"Failed to process {len(failed_files)} files:")
+        for f in failed_files:
+            logging.error(f"  - '{f}'")
+
+    # Exit with error if there were emails with no content or files that weren't written
+    if processor.stats.no_content_files or processor.stats.failed_writes:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,17 @@
-from pathlib import Path
-import pytz
 import os
+from pathlib import Path
+
+# Timezone configuration, from the standard library where available (Python 3.9+)
+TIMEZONE_NAME = "Europe/Berlin"
+try:
+    from zoneinfo import ZoneInfo
+
+    TIMEZONE = ZoneInfo(TIMEZONE_NAME)
+except (ImportError, KeyError):
+    # Python 3.8, or no time zone database (ZoneInfoNotFoundError is a KeyError)
+    import pytz  # type: ignore[import-untyped]
 
-# Timezone configuration
-TIMEZONE = pytz.timezone("Europe/Berlin")
+    TIMEZONE = pytz.timezone(TIMEZONE_NAME)
 
 # Default paths - use current working directory
 DEFAULT_INPUT_DIR = Path(os.getcwd()) / ".."
@@ -12,6 +20,45 @@ DEFAULT_OUTPUT_FILE = DEFAULT_INPUT_DIR / "out" / "Mail-to-Linus.md"
 # Image directory name
 IMAGES_DIR_NAME = ".images"  # Now a constant that can be imported
 
+# Content-addressed image blobs, inside the images directory
+BLOBS_DIR_NAME = ".blobs"
+
+# Thumbnails made by the image options, in a folder inside each date folder of images
+THUMBNAILS_DIR_NAME = ".thumbs"
+
+# JPEG and WebP quality of images and thumbnails written by the image options if none is given
+DEFAULT_IMAGE_QUALITY = 85
+
+# Base64 attachments larger than this (encoded size in bytes) are decoded straight to disk
+STREAM_ATTACHMENT_THRESHOLD = 1 << 20
+
+# Threads writing images and Markdown in the background, and how many writes may wait for them
+# before parsing is held up
+WRITE_THREADS = 2
+WRITE_QUEUE_SIZE = 64
+
+# Characters of email bodies kept in memory, later bodies are moved to a temporary file
+BODY_MEMORY_BUDGET = 256 << 20
+
+# Size of the emails (in bytes of their source) parsed at a time by runs that write the output
+# while parsing, see ``--no-cache``. Days are never split, so a batch may hold one larger day.
+PARSE_BATCH_SIZE = 64 << 20
+
+# Parse cache file, stored next to the output file
+CACHE_FILE_NAME = ".email2md-cache.sqlite"
+
+# Full-text search index of the emails in the output, stored next to the output file
+SEARCH_INDEX_FILE_NAME = ".email2md-search.sqlite"
+
+# Suffix of the index of rendered chapters, stored as a hidden file next to each output file
+CHAPTER_INDEX_SUFFIX = ".chapters.json"
+
+# Index of message offsets in mbox files, stored next to the output file
+MBOX_INDEX_FILE_NAME = ".email2md-mbox-index.json"
+
+# Periods the output can be split into, with the date format naming each part
+SPLIT_FORMATS = {"month": "%Y-%m", "year": "%Y"}
+
 # Date formats
 DATE_FORMAT_FILENAME = "%Y-%m-%d %H:%M"
 DATE_KEY_FORMAT = "%Y-%m-%d"
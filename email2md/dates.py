@@ -0,0 +1,29 @@
+"""Parsing email dates and converting them to the configured timezone."""
+
+import email.utils
+from datetime import date, datetime
+from functools import lru_cache
+
+from .config import DATE_KEY_FORMAT, TIMEZONE
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_date(value: str) -> datetime:
+    """
+    Parse a ``Date`` header and convert it to ``TIMEZONE``.
+
+    The prescan and the full parse read the same headers, and forked worker processes inherit
+    the cache, so every distinct header is converted once. Raises ``TypeError`` or
+    ``ValueError`` like ``email.utils.parsedate_to_datetime``.
+    """
+    return email.utils.parsedate_to_datetime(value).astimezone(TIMEZONE)
+
+
+@lru_cache(maxsize=1 << 12)
+def _format_day(day: date) -> str:
+    return day.strftime(DATE_KEY_FORMAT)
+
+
+def day_key(moment: datetime) -> str:
+    """Return the chapter an email sent at ``moment`` belongs to (``DATE_KEY_FORMAT``)."""
+    return _format_day(moment.date())
@@ -1,20 +1,63 @@
-from pathlib import Path
-from typing import Tuple, List, Dict, NamedTuple
-import email
-from email import policy
-from email.parser import BytesParser
 import logging
+import os
+import time
+from contextlib import nullcontext
 from datetime import datetime
-from collections import defaultdict
+from email import policy
+from email.message import Message
+from email.parser import BytesParser
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from .attachments import ImageStore, StoredImage
+from .cache import ParseCache
+from .config import (
+    DATE_FORMAT_FILENAME,
+    IMAGES_DIR_NAME,
+    STREAM_ATTACHMENT_THRESHOLD,
+)
+from .dates import day_key, parse_date
+from .html_utils import html_to_text
+from .image_processing import DEFAULT_IMAGE_OPTIONS, ImageOptions, process_images
+from .metrics import Metrics
+from .records import BodyStore, EmailRecord, image_ref
+from .sources import ArchiveMember, EmailSource
+from .writer import BackgroundWriter
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
 
-from .config import TIMEZONE, DATE_FORMAT_FILENAME
-from .html_utils import strip_html_tags
 
 class EmailStats(NamedTuple):
     """Statistics about processed emails."""
-    no_text_files: List[Path]
-    no_images_files: List[Path]
-    no_content_files: List[Path]
+
+    no_text_files: List[EmailSource]
+    no_images_files: List[EmailSource]
+    no_content_files: List[EmailSource]
+    duplicate_files: List[EmailSource]
+    # Images and output files that could not be written
+    failed_writes: List[str]
+    metrics: Metrics
+
+    def merge(self, other: "EmailStats") -> None:
+        """Append the file lists and metrics of another stats object to this one."""
+        self.no_text_files.extend(other.no_text_files)
+        self.no_images_files.extend(other.no_images_files)
+        self.no_content_files.extend(other.no_content_files)
+        self.duplicate_files.extend(other.duplicate_files)
+        self.failed_writes.extend(other.failed_writes)
+        self.metrics.merge(other.metrics)
+
+class ExtractionPlan(NamedTuple):
+    """Which parts of an email need to be extracted. Headers are always read."""
+
+    text: bool = True
+    images: bool = True
+
+
+# Extract everything, the default of all ``plan`` parameters
+DEFAULT_PLAN = ExtractionPlan()
+
 
 def clean_text(text: str) -> str:
     """Clean up text by removing extra whitespace and empty lines."""
@@ -28,8 +71,28 @@ def clean_text(text: str) -> str:
 class EmailProcessor:
     """Process email files and extract content."""
 
-    def __init__(self):
-        self.stats = EmailStats([], [], [])
+    def __init__(
+        self,
+        cache: Optional[ParseCache] = None,
+        stream_threshold: int = STREAM_ATTACHMENT_THRESHOLD,
+        link_images: bool = True,
+        image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+        image_jobs: int = 1,
+        bodies: Optional[BodyStore] = None,
+        writer: Optional[BackgroundWriter] = None,
+    ):
+        self.stats = EmailStats([], [], [], [], [], Metrics())
+        self.cache = cache
+        # Share one store between processors whose results are kept together
+        self.bodies = bodies if bodies is not None else BodyStore()
+        self.stream_threshold = stream_threshold
+        # Worker processes only store blobs, the parent links them in input order
+        self.link_images = link_images
+        # Optional image stage, run on new images after parsing, see ``process_images``
+        self.image_options = image_options
+        self.image_jobs = image_jobs
+        # Writes images in the background while the next emails are parsed
+        self.writer = writer
 
     @staticmethod
     def get_text_from_part(part) -> str:
@@ -45,7 +108,7 @@ class EmailProcessor:
                 if content_type == "text/plain":
                     return text
                 elif content_type == "text/html":
-                    return strip_html_tags(text)
+                    return html_to_text(text)
         return ""
 
     @staticmethod
@@ -61,9 +124,10 @@ class EmailProcessor:
                 if text:
                     plain_text.append(clean_text(text))
             elif content_type == "text/html" and not subpart.get('Content-Disposition'):
+                # Converted HTML is already clean
                 text = EmailProcessor.get_text_from_part(subpart)
                 if text:
-                    html_text.append(clean_text(text))
+                    html_text.append(text)
 
         # Prefer plain text over HTML
         if plain_text:
@@ -72,27 +136,100 @@ class EmailProcessor:
             return "\n\n".join(filter(None, html_text))
         return ""
 
-    def process_email(self, email_path: Path, images_base_dir: Path = Path("images")) -> Tuple[str, datetime, str, List[Path]]:
-        """Process a single email file and extract its content. Saves images to dated folder."""
+    @staticmethod
+    def _text_parts(msg) -> Iterator[Message]:
+        """Yield the parts ``_process_email`` extracts the text from, in the same traversal."""
+        if not msg.is_multipart():
+            yield msg
+        elif msg.get_content_type() == "multipart/alternative":
+            yield from msg.iter_parts()
+        else:
+            for part in msg.iter_parts():
+                if part.get_content_type() == "multipart/alternative":
+                    yield from part.iter_parts()
+                else:
+                    yield part
+
+    @staticmethod
+    def has_text_part(msg) -> bool:
+        """
+        Check whether a message has a text part that would be extracted, without decoding it.
+
+        Follows the rules of ``get_text_from_part``: only inline text/plain and text/html parts
+        with a charset count.
+        """
+        return any(
+            part.get_content_type() in ("text/plain", "text/html")
+            and not part.get("Content-Disposition")
+            and part.get_content_charset()
+            and part.get_payload()
+            for part in EmailProcessor._text_parts(msg)
+        )
+
+    @staticmethod
+    def has_image_part(msg) -> bool:
+        """Check whether a message has an image part that would be saved, without decoding it."""
+        return msg.is_multipart() and any(
+            part.get_content_type().startswith("image/")
+            and part.get_filename()
+            and part.get_payload()
+            for part in msg.walk()
+        )
+
+    def process_email(
+        self,
+        email_path: EmailSource,
+        images_base_dir: Path = Path("images"),
+        plan: ExtractionPlan = DEFAULT_PLAN,
+    ) -> EmailRecord:
+        """
+        Process a single email file and extract its content. Saves images to dated folder.
+
+        Parts excluded by ``plan`` are skipped without decoding their payload.
+        """
+        return self._process_email(email_path, images_base_dir, plan)[0]
+
+    def _process_email(
+        self,
+        email_path: EmailSource,
+        images_base_dir: Path,
+        plan: ExtractionPlan,
+        link_images: bool = True,
+    ) -> Tuple[EmailRecord, bool, bool]:
+        """
+        Process a single email file; also report whether it has any text and images.
+
+        Without ``link_images``, images are only stored, see ``store_images``.
+        """
         logging.debug(f"Processing file: '{email_path}'")
+        metrics = self.stats.metrics
+        started = time.perf_counter()
+        # Text and images produced for this email, from the counters of the stages
+        bytes_out = metrics.bytes_out()
 
         with email_path.open("rb") as f:
             msg = BytesParser(policy=policy.default).parse(f)
+            size = f.tell()
 
         # Extract metadata
         subject = msg["subject"]
-        date = email.utils.parsedate_to_datetime(msg["date"]).astimezone(TIMEZONE)
+        # The raw header skips the Date header parsing of the policy, see ``parse_date``
+        date = parse_date(_raw_header(msg, "date"))
+        parsed = time.perf_counter()
+        metrics.add("parse", parsed - started, bytes_in=size)
 
         logging.debug(f"Extracted subject: {subject}")
         logging.debug(f"Extracted date: {date.strftime(DATE_FORMAT_FILENAME)}")
 
         # Extract content
         body = ""
-        images = []
+        images: List[Tuple[str, Union[bytes, Message]]] = []
 
         if msg.is_multipart():
             # Handle text content
-            if msg.get_content_type() == "multipart/alternative":
+            if not plan.text:
+                pass
+            elif msg.get_content_type() == "multipart/alternative":
                 body = EmailProcessor.extract_content_from_multipart(msg)
             else:
                 parts = []
@@ -105,59 +242,317 @@ class EmailProcessor:
                         parts.append(clean_text(text))
                 body = "\n\n".join(parts)
 
-            # Handle images separately
-            for part in msg.walk():
+            # Handle images separately, their payload is only decoded when saving
+            for part in msg.walk() if plan.images else ():
                 if part.get_content_type().startswith("image/"):
-                    if img_data := part.get_payload(decode=True):
+                    if part.get_payload():
                         if img_filename := part.get_filename():
-                            images.append((img_filename, img_data))
+                            images.append((img_filename, part))
                             logging.debug(f"Found image: {img_filename}")
-        else:
+        elif plan.text:
             body = clean_text(EmailProcessor.get_text_from_part(msg))
+        if plan.text:
+            metrics.add("text", time.perf_counter() - parsed, bytes_out=len(body.encode()))
 
         # Save images to dated folder
-        saved_image_paths = []
-        if images:
-            saved_image_paths = self.save_images(images, date, images_base_dir)
+        saved_images: List[str] = []
+        stored_images: List[StoredImage] = []
+        if images and link_images:
+            saved_images = [
+                image_ref(path, images_base_dir)
+                for path in self.save_images(images, date, images_base_dir)
+            ]
+        elif images:
+            stored_images = self.store_images(images, date, images_base_dir)
+        image_count = len(saved_images) + len(stored_images)
 
         # Log a concise summary
-        logging.info(f"""Processed '{email_path.name}':\n    {date.strftime(DATE_FORMAT_FILENAME)} -- {subject}\n     -> {len(saved_image_paths)} images, {len(body)}""")
+        logging.info(f"""Processed '{email_path.name}':\n    {date.strftime(DATE_FORMAT_FILENAME)} -- {subject}\n     -> {image_count} images, {len(body)}""")
+
+        # Skipped parts are only checked for presence so the statistics stay the same
+        has_text = bool(body) if plan.text else EmailProcessor.has_text_part(msg)
+        has_images = bool(image_count) if plan.images else EmailProcessor.has_image_part(msg)
+        self._track_stats(email_path, has_text, has_images)
+        metrics.add_file(
+            str(email_path),
+            time.perf_counter() - started,
+            bytes_in=size,
+            bytes_out=metrics.bytes_out() - bytes_out,
+        )
+
+        record = EmailRecord(subject, date, body, saved_images, stored_images)
+        return record, has_text, has_images
 
-        # Track statistics
-        if not body:
+    def _track_stats(self, email_path: EmailSource, has_text: bool, has_images: bool) -> None:
+        """Record files without text, images or any content."""
+        if not has_text:
             logging.warning(f"No message text found in file: '{email_path}'")
             self.stats.no_text_files.append(email_path)
-        if not saved_image_paths:
+        if not has_images:
             logging.warning(f"No images found in file: '{email_path}'")
             self.stats.no_images_files.append(email_path)
-        if not body and not saved_image_paths:
+        if not has_text and not has_images:
             logging.error(f"No content found in file: '{email_path}'")
             self.stats.no_content_files.append(email_path)
 
-        return subject, date, body, saved_image_paths
+    def process_emails(
+        self,
+        email_paths: List[EmailSource],
+        images_base_dir: Path = Path("images"),
+        jobs: int = 1,
+        plan: ExtractionPlan = DEFAULT_PLAN,
+    ) -> Tuple[List[EmailRecord], List[EmailSource]]:
+        """
+        Process several email files, optionally in a pool of worker processes.
 
-    def save_images(self, images: List[Tuple[str, bytes]], date: datetime, base_dir: Path = None) -> List[Path]:
-        """Save images to a folder named after the sent date (date only, no time). Returns list of saved file paths."""
-        from .config import IMAGES_DIR_NAME, DATE_KEY_FORMAT
+        Results and statistics are returned in the order of ``email_paths`` regardless of
+        ``jobs``, so the generated output is identical to a serial run. Returns the list of
+        processed emails and the list of files that failed to process.
+        """
+        results, failed_files = self.process_sources(email_paths, images_base_dir, jobs, plan)
+        emails = [results[eml_path] for eml_path in email_paths if eml_path in results]
+        return emails, failed_files
+
+    def process_sources(
+        self,
+        email_paths: List[EmailSource],
+        images_base_dir: Path = Path("images"),
+        jobs: int = 1,
+        plan: ExtractionPlan = DEFAULT_PLAN,
+        executor: Optional["Executor"] = None,
+    ) -> Tuple[Dict[EmailSource, EmailRecord], List[EmailSource]]:
+        """
+        Like ``process_emails``, but return the processed emails keyed by their source.
+
+        With ``jobs`` > 1, a process pool is started for the call unless ``executor`` is given,
+        which lets callers processing batches of emails keep their workers between batches.
+        """
+        results = {}
+        failed_files = []
+
+        # Only new or changed files need to be parsed when a cache is available
+        pending = []
+        started = time.perf_counter()
+        for eml_path in email_paths:
+            cached = self.cache.lookup(eml_path, *plan) if self.cache is not None else None
+            if cached is None:
+                pending.append(eml_path)
+            else:
+                self.bodies.keep(cached[0])
+                results[eml_path] = cached
+                self._track_stats(eml_path, *cached[1:])
+        if self.cache is not None:
+            self.stats.metrics.add("cache", time.perf_counter() - started)
+
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        # Emails are read in the order that suits their sources best. Their images are only
+        # stored as blobs at first and linked in input order below, so the output is the same.
+        if jobs == 1 or len(pending) <= 1:
+            for eml_path in sorted(pending, key=_read_order):
+                try:
+                    result = self._process_email(
+                        eml_path, images_base_dir, plan, link_images=False
+                    )
+                except Exception as e:
+                    logging.error(f"Failed to process '{eml_path}': {e}")
+                    failed_files.append(eml_path)
+                    continue
+                self.bodies.keep(result[0])
+                results[eml_path] = result
+            # Keep the failures in input order like the parallel path does
+            failed_files.sort(key=pending.index)
+            if self.writer is not None:
+                # The images must be complete before they are processed or linked
+                started = time.perf_counter()
+                self.stats.failed_writes.extend(self.writer.flush())
+                self.stats.metrics.add("images", time.perf_counter() - started)
+        else:
+            # Imported here, multiprocessing is slow to import and unused by serial runs
+            from concurrent.futures import ProcessPoolExecutor
+
+            with nullcontext(executor) if executor else ProcessPoolExecutor(jobs) as pool:
+                futures = {
+                    eml_path: pool.submit(
+                        _process_email_worker, eml_path, images_base_dir, plan
+                    )
+                    for eml_path in sorted(pending, key=_submit_order)
+                }
+                for eml_path in pending:
+                    try:
+                        result, stats = futures[eml_path].result()
+                    except Exception as e:
+                        logging.error(f"Failed to process '{eml_path}': {e}")
+                        failed_files.append(eml_path)
+                        continue
+                    self.bodies.keep(result[0])
+                    results[eml_path] = result
+                    self.stats.merge(stats)
+
+        if self.image_options.enabled:
+            # Before linking, so the images are linked in their final form
+            new_images = [
+                image
+                for eml_path in pending
+                if eml_path in results
+                for image in results[eml_path][0].stored
+            ]
+            process_images(
+                new_images,
+                images_base_dir,
+                self.image_options,
+                jobs=self.image_jobs,
+                metrics=self.stats.metrics,
+            )
+
+        if self.link_images:
+            started = time.perf_counter()
+            store = ImageStore(
+                images_base_dir,
+                self.stream_threshold,
+                self.writer,
+                variant=self.image_options.blob_suffix,
+            )
+            for eml_path in pending:
+                if eml_path in results:
+                    record = results[eml_path][0]
+                    try:
+                        record.images = [
+                            image_ref(store.link(image), images_base_dir)
+                            for image in record.stored
+                        ]
+                        record.stored = ()
+                    except OSError as e:
+                        # E.g. an image that failed to be written
+                        logging.error(f"Failed to link the images of '{eml_path}': {e}")
+                        failed_files.append(eml_path)
+                        del results[eml_path]
+            failed_files.sort(key=pending.index)
+            self.stats.metrics.add("images", time.perf_counter() - started)
+
+        if self.cache is not None:
+            started = time.perf_counter()
+            # Storing hashes the sources, so read them in the order that suits them best
+            for eml_path in sorted(pending, key=_read_order):
+                if eml_path in results:
+                    self.cache.store(eml_path, *results[eml_path], *plan)
+            self.cache.commit()
+            self.stats.metrics.add("cache", time.perf_counter() - started)
+
+        return {eml_path: result[0] for eml_path, result in results.items()}, failed_files
+
+    def save_images(
+        self,
+        images: List[Tuple[str, Union[bytes, Message]]],
+        date: datetime,
+        base_dir: Optional[Path] = None,
+    ) -> List[Path]:
+        """
+        Save images to a folder named after the sent date (date only, no time).
+
+        Images are given as decoded bytes or as MIME parts, which are decoded one at a time.
+        Identical images are stored once and name collisions get a hash suffix, see
+        ``ImageStore``. Returns list of saved file paths.
+        """
         if base_dir is None:
             base_dir = Path(IMAGES_DIR_NAME)
-        date_folder = base_dir / date.strftime(DATE_KEY_FORMAT)
-        date_folder.mkdir(parents=True, exist_ok=True)
-        saved_files = []
-        for img_filename, img_data in images:
-            img_path = date_folder / img_filename
-            with img_path.open("wb") as img_file:
-                img_file.write(img_data)
-            saved_files.append(img_path)
+        stored = self.store_images(images, date, base_dir)
+        started = time.perf_counter()
+        if self.writer is not None:
+            # The blobs must be complete before they are linked
+            self.stats.failed_writes.extend(self.writer.flush())
+        store = ImageStore(
+            base_dir, self.stream_threshold, self.writer, variant=self.image_options.blob_suffix
+        )
+        saved_files = [store.link(image) for image in stored]
+        self.stats.metrics.add("images", time.perf_counter() - started)
         return saved_files
 
+    def store_images(
+        self,
+        images: List[Tuple[str, Union[bytes, Message]]],
+        date: datetime,
+        base_dir: Optional[Path] = None,
+    ) -> List[StoredImage]:
+        """
+        Like ``save_images``, but only store the blobs and return the ``StoredImage`` entries.
+
+        They are linked into their date folder by ``ImageStore.link``.
+        """
+        if base_dir is None:
+            base_dir = Path(IMAGES_DIR_NAME)
+        started = time.perf_counter()
+        store = ImageStore(base_dir, self.stream_threshold, self.writer)
+        date_key = day_key(date)
+        stored = []
+        for img_filename, payload in images:
+            if image := store.store(img_filename, payload, date_key):
+                stored.append(image)
+        self.stats.metrics.add(
+            "images",
+            time.perf_counter() - started,
+            bytes_in=store.bytes_decoded,
+            bytes_out=store.bytes_written,
+        )
+        return stored
+
     def print_summary(self):
         """Print summary of processed emails."""
         logging.info("Processing Summary:")
         logging.info(f"Number of emails with no message text: {len(self.stats.no_text_files)}")
         logging.info(f"Number of emails with no images: {len(self.stats.no_images_files)}")
+        logging.info(f"Number of skipped duplicate emails: {len(self.stats.duplicate_files)}")
+        if self.cache is not None:
+            logging.info(f"Parse cache hits: {self.cache.hits}, misses: {self.cache.misses}")
+        if self.stats.failed_writes:
+            logging.error(f"Number of files that failed to write: {len(self.stats.failed_writes)}")
+            for f in self.stats.failed_writes:
+                logging.error(f"  - '{f}'")
         if self.stats.no_content_files:
             logging.error(f"Number of emails with no content: {len(self.stats.no_content_files)}")
             logging.error("Files with no content:")
             for f in self.stats.no_content_files:
                 logging.error(f"  - '{f}'")
+
+
+def _raw_header(msg: Message, name: str) -> Optional[str]:
+    """Return the unparsed value of the first header called ``name``, or None."""
+    for key, value in msg.raw_items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _file_size(path: EmailSource) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def _read_order(path: EmailSource) -> Tuple:
+    """Sort key that puts members of compressed archives first, in the order they are stored."""
+    if isinstance(path, ArchiveMember) and path.sequential:
+        return 0, str(path.archive_path), path.position
+    return 1, "", 0
+
+
+def _submit_order(path: EmailSource) -> Tuple:
+    """
+    Like ``_read_order``, but with the largest of the other files first.
+
+    Then every worker reads archives forward, and a few huge mails don't hold up the end of
+    the run.
+    """
+    if isinstance(path, ArchiveMember) and path.sequential:
+        return 0, str(path.archive_path), path.position
+    return 1, "", -_file_size(path)
+
+
+def _process_email_worker(
+    email_path: EmailSource, images_base_dir: Path, plan: ExtractionPlan
+) -> Tuple[Tuple[EmailRecord, bool, bool], EmailStats]:
+    """Process one email in a worker process and return its result with its own stats."""
+    processor = EmailProcessor()
+    result = processor._process_email(email_path, images_base_dir, plan, link_images=False)
+    return result, processor.stats
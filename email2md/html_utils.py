@@ -1,4 +1,33 @@
+import re
+from html import unescape
 from html.parser import HTMLParser
+from typing import List
+
+# Elements whose content is never displayed
+HIDDEN_TAGS = frozenset({"head", "script", "style", "title", "template", "noscript", "svg"})
+
+# Hidden elements whose content is raw text, an unclosed one hides the rest of the document
+RAW_TEXT_TAGS = frozenset({"script", "style"})
+
+# Elements that start a new paragraph (separated by an empty line)
+PARAGRAPH_TAGS = frozenset(
+    {
+        "p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "table", "ul", "ol",
+        "dl", "hr", "figure", "address",
+    }
+)
+
+# Elements that start a new line
+LINE_TAGS = frozenset(
+    {
+        "br", "div", "li", "tr", "dt", "dd", "section", "article", "header", "footer", "nav",
+        "aside", "main", "form", "fieldset", "caption", "figcaption", "tbody", "thead", "tfoot",
+        "center",
+    }
+)
+
+# Table cells, separated by a space
+CELL_TAGS = frozenset({"td", "th"})
 
 
 class HTMLStripper(HTMLParser):
@@ -21,3 +50,107 @@ def strip_html_tags(html: str) -> str:
     stripper = HTMLStripper()
     stripper.feed(html)
     return stripper.get_text()
+
+
+# Comments, doctype/processing instructions, and start or end tags; attributes are skipped
+# as a whole (quoted values may contain ">")
+_TOKEN_RE = re.compile(
+    r"<!--.*?(?:-->|\Z)"
+    r"|<(/?)([a-zA-Z][^\s/>]*)((?:\"[^\"]*\"|'[^']*'|[^'\">])*)>"
+    r"|<[!?][^>]*>",
+    re.DOTALL,
+)
+
+
+class HTMLToText:
+    """
+    Convert HTML to clean plain text in a single pass.
+
+    Hidden elements such as ``<style>`` and ``<script>`` are skipped as a whole, block
+    elements become line breaks or paragraph breaks, whitespace is collapsed (except in
+    ``<pre>``) and entities are decoded. The result has stripped lines and at most one empty
+    line in a row, like the output of ``clean_text``. Unlike ``HTMLParser`` based code, tags
+    are only matched by a regular expression and their attributes are never parsed.
+    """
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self._line: List[str] = []
+        self._pre_depth = 0
+        self._blank_pending = False
+
+    def _flush(self) -> bool:
+        """End the current line. Returns False if it was empty."""
+        text = "".join(self._line)
+        self._line = []
+        text = text.strip() if self._pre_depth else " ".join(text.split())
+        if not text:
+            return False
+        if self._blank_pending and self.lines:
+            self.lines.append("")
+        self.lines.append(text)
+        self._blank_pending = False
+        return True
+
+    def _break(self, tag: str) -> None:
+        if not self._flush() and tag == "br":
+            # An empty line made of consecutive <br> tags
+            self._blank_pending = True
+        if tag in PARAGRAPH_TAGS:
+            self._blank_pending = True
+
+    def _data(self, data: str) -> None:
+        data = unescape(data)
+        if self._pre_depth and "\n" in data:
+            first, *rest = data.split("\n")
+            self._line.append(first)
+            for line in rest:
+                if not self._flush():
+                    self._blank_pending = True
+                self._line.append(line)
+        else:
+            self._line.append(data)
+
+    def convert(self, html: str) -> str:
+        """Convert an HTML document and return its text."""
+        pos = 0
+        search = _TOKEN_RE.search
+        while True:
+            match = search(html, pos)
+            if match is None:
+                self._data(html[pos:])
+                break
+            if match.start() > pos:
+                self._data(html[pos : match.start()])
+            pos = match.end()
+
+            name = match.group(2)
+            if name is None:
+                continue  # Comment, doctype or processing instruction
+            tag = name.lower()
+            closing = match.group(1)
+
+            if tag in HIDDEN_TAGS:
+                if not closing and not match.group(3).endswith("/"):
+                    end = re.compile(rf"</{tag}\s*>", re.IGNORECASE).search(html, pos)
+                    if end is not None:
+                        pos = end.end()
+                    elif tag in RAW_TEXT_TAGS:
+                        break
+            elif tag in PARAGRAPH_TAGS or tag in LINE_TAGS:
+                if tag == "pre" and closing:
+                    self._flush()
+                    self._pre_depth = max(0, self._pre_depth - 1)
+                self._break(tag)
+                if tag == "pre" and not closing:
+                    self._pre_depth += 1
+            elif tag in CELL_TAGS and not closing:
+                self._line.append(" ")
+
+        self._flush()
+        return "\n".join(self.lines)
+
+
+def html_to_text(html: str) -> str:
+    """Convert HTML to clean plain text, see ``HTMLToText``."""
+    return HTMLToText().convert(html)
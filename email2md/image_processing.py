@@ -0,0 +1,198 @@
+"""Optional image stage: scale down, re-encode and make thumbnails (needs Pillow)."""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from .attachments import PROCESSED_BLOB_SUFFIX, THUMBNAIL_BLOB_SUFFIX, StoredImage
+from .config import BLOBS_DIR_NAME, DEFAULT_IMAGE_QUALITY
+from .metrics import Metrics
+
+# Formats the image stage re-encodes, other images are left as they are
+PROCESSED_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+class ImageOptions(NamedTuple):
+    """Settings of the optional image stage, which needs Pillow."""
+
+    # Longest side in pixels, larger images are scaled down
+    max_size: Optional[int] = None
+    # JPEG and WebP quality (1-95) images are re-encoded with
+    quality: Optional[int] = None
+    # Longest side of the thumbnails shown in the Markdown, no thumbnails if None
+    thumbnail_size: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any image processing is requested."""
+        return any(value is not None for value in self)
+
+    @property
+    def blob_suffix(self) -> str:
+        """Suffix of the blobs processed with these options, "" if there's no image stage."""
+        if not self.enabled:
+            return ""
+        return f".{self.max_size or 0}-{self.quality or 0}-{self.thumbnail_size or 0}"
+
+
+# No image stage
+DEFAULT_IMAGE_OPTIONS = ImageOptions()
+
+
+def require_pillow() -> None:
+    """Raise ``ImportError`` with installation instructions if Pillow is missing."""
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "The image options need Pillow, install it with: pip install 'email2md[images]'"
+        ) from None
+
+
+def _encode(image, image_format: str, quality: int, info: Dict) -> bytes:
+    """Save an image to bytes, keeping its color profile and EXIF data."""
+    options = {key: info[key] for key in ("icc_profile", "exif") if info.get(key)}
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = quality
+    else:
+        options["optimize"] = True
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def _shrink(data: bytes, options: ImageOptions) -> Tuple[Optional[bytes], Optional[bytes]]:
+    """Return the re-encoded image and its thumbnail, each None if there's nothing to do."""
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as original:
+        image_format = original.format
+        if image_format not in PROCESSED_FORMATS or getattr(original, "is_animated", False):
+            return None, None
+        # Rotate according to the EXIF orientation, which is lost when scaling down
+        image = ImageOps.exif_transpose(original)
+    quality = options.quality or DEFAULT_IMAGE_QUALITY
+
+    shrunk = None
+    max_size = options.max_size
+    too_large = max_size is not None and max(image.size) > max_size
+    if max_size is not None and too_large:
+        image.thumbnail((max_size, max_size))
+    if too_large or options.quality is not None:
+        shrunk = _encode(image, image_format, quality, image.info)
+
+    thumbnail = None
+    if options.thumbnail_size is not None:
+        small = image.copy()
+        small.thumbnail((options.thumbnail_size, options.thumbnail_size))
+        thumbnail = _encode(small, image_format, quality, image.info)
+    return shrunk, thumbnail
+
+
+def _write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".tmp-{os.getpid()}-{path.name}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def process_blob(
+    blobs_dir: Path, digest: str, options: ImageOptions
+) -> Optional[Tuple[int, int]]:
+    """
+    Scale down, re-encode and make a thumbnail of one blob.
+
+    The blob itself is left as it is, so the original image is there for other options: the
+    result is written to ``<digest><options.blob_suffix>`` if it's smaller, and the thumbnail
+    next to it. The suffixes done and the digests of all processed versions are recorded next to
+    the blob, so ``ImageStore.link`` can update images linked in another version. Returns the
+    size before and after, or None if the blob was already processed with the same options.
+    """
+    from PIL import Image
+
+    blob = blobs_dir / digest
+    suffix = options.blob_suffix
+    info_file = blobs_dir / f"{digest}{PROCESSED_BLOB_SUFFIX}"
+    try:
+        info = json.loads(info_file.read_text())
+    except (OSError, ValueError):
+        info = {}
+    info.setdefault("suffixes", [])
+    info.setdefault("versions", [])
+    if suffix in info["suffixes"]:
+        return None
+
+    data = blob.read_bytes()
+    try:
+        shrunk, thumbnail = _shrink(data, options)
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        logging.debug(f"Not processing image '{blob}': {e}")
+        shrunk = thumbnail = None
+    if shrunk is not None and len(shrunk) < len(data):
+        info["versions"].append(hashlib.sha256(shrunk).hexdigest())
+        _write(blobs_dir / f"{digest}{suffix}", shrunk)
+    else:
+        shrunk = data
+    if thumbnail is not None:
+        _write(blobs_dir / f"{digest}{suffix}{THUMBNAIL_BLOB_SUFFIX}", thumbnail)
+    info["suffixes"].append(suffix)
+    _write(info_file, json.dumps(info).encode())
+    return len(data), len(shrunk)
+
+
+def process_images(
+    images: Iterable[StoredImage],
+    base_dir: Path,
+    options: ImageOptions,
+    jobs: int = 1,
+    metrics: Optional[Metrics] = None,
+) -> None:
+    """
+    Run the image stage on stored images before they are linked, see ``process_blob``.
+
+    Images are processed in up to ``jobs`` worker processes of their own, after parsing is
+    done. Images that were already processed with the same options are skipped.
+    """
+    started = time.perf_counter()
+    blobs_dir = base_dir / BLOBS_DIR_NAME
+    digests = list(dict.fromkeys(image.digest for image in images))
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+
+    results = []
+    if jobs == 1 or len(digests) <= 1:
+        for digest in digests:
+            try:
+                results.append(process_blob(blobs_dir, digest, options))
+            except OSError as e:
+                logging.error(f"Failed to process image '{blobs_dir / digest}': {e}")
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                digest: executor.submit(process_blob, blobs_dir, digest, options)
+                for digest in digests
+            }
+            for digest, future in futures.items():
+                try:
+                    results.append(future.result())
+                except OSError as e:
+                    logging.error(f"Failed to process image '{blobs_dir / digest}': {e}")
+
+    processed = [result for result in results if result is not None]
+    size_before = sum(before for before, _ in processed)
+    size_after = sum(after for _, after in processed)
+    if metrics is not None:
+        metrics.add(
+            "optimize", time.perf_counter() - started, bytes_in=size_before, bytes_out=size_after
+        )
+    if digests:
+        logging.info(
+            f"Processed {len(processed)} images ({len(digests) - len(processed)} already done), "
+            f"saved {(size_before - size_after) / 1e6:.1f} MB"
+        )
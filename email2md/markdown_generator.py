@@ -1,90 +1,553 @@
-from pathlib import Path
-from typing import Dict, List, Tuple
-from datetime import datetime
+import hashlib
+import json
+import locale
 import logging
+import os
+import posixpath
+import shutil
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    BinaryIO,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from .attachments import thumbnail_path
+from .config import (
+    CHAPTER_INDEX_SUFFIX,
+    DATE_FORMAT_FILENAME,
+    DOCUMENT_TITLE,
+    IMAGES_DIR_NAME,
+    SPLIT_FORMATS,
+    THUMBNAILS_DIR_NAME,
+)
+from .dates import day_key
+from .records import EmailRecord
+from .writer import BackgroundStream, BackgroundWriter
+
+# Bump whenever the rendering changes in a way that isn't covered by the chapter digests
+RENDER_VERSION = 1
+
+
+def _replace_text(path: Path, text: str) -> None:
+    """Write a file through a temporary file, so readers never see it half-written."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        tmp.write_text(text)
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class IncrementalOutput:
+    """
+    Update an existing Markdown file, rewriting only chapters that changed.
+
+    A sidecar index stores the digest, byte offset and length of every chapter written to the
+    file. If everything after the unchanged leading chapters needs rendering anyway, the file
+    is truncated and appended to in place. Otherwise it is rebuilt in a temporary file, copying
+    unchanged chapters from the old file instead of rendering them again. The index is only
+    trusted while the file's size and mtime match, so edited files are rewritten completely.
+    With ``atomic``, the file is always rebuilt in a temporary file that replaces it at the end.
+    With ``rebuild``, the previous content is ignored and every chapter is rendered. A file
+    whose chapters are all unchanged is not touched at all. With a ``writer``, the file is
+    written in the background while the next chapters are rendered.
+    """
+
+    def __init__(
+        self,
+        output_file: Path,
+        chapters: List[Tuple[str, str]],
+        atomic: bool = False,
+        rebuild: bool = False,
+        writer: Optional[BackgroundWriter] = None,
+    ):
+        self.output_file = output_file
+        self.index_file = output_file.with_name(f".{output_file.name}{CHAPTER_INDEX_SUFFIX}")
+        self.chapters = chapters
+        self.encoding = locale.getpreferredencoding(False)
+        self._written = []
+
+        old = [] if rebuild else self._load_index()
+        old_positions = {(key, digest): (offset, length) for key, digest, offset, length in old}
+        self.prefix = 0
+        while (
+            self.prefix < min(len(old), len(chapters))
+            and tuple(old[self.prefix][:2]) == chapters[self.prefix]
+        ):
+            self.prefix += 1
+        self._reuse = [
+            old_positions.get(chapter) if i >= self.prefix else None
+            for i, chapter in enumerate(chapters)
+        ]
+        cut = old[self.prefix][2] if self.prefix < len(old) else sum(old[-1][2:]) if old else 0
+        self._written = [list(chapter) for chapter in old[: self.prefix]]
+
+        self.unchanged = bool(old) and self.prefix == len(old) == len(chapters)
+        self._old: Optional[BinaryIO]
+        self._tmp: Optional[Path]
+        # None if the file is unchanged
+        self._out: Optional[Union[BinaryIO, BackgroundStream]]
+        if self.unchanged:
+            self._old = self._tmp = self._out = None
+        elif not atomic and all(position is None for position in self._reuse):
+            # Only the end changed: drop the outdated chapters and append the new ones
+            self._old = None
+            self._tmp = None
+            self._out = output_file.open("r+b" if old else "wb")
+            self._out.truncate(cut)
+            self._out.seek(cut)
+        else:
+            self._old = output_file.open("rb") if old else None
+            self._tmp = output_file.with_name(f".{output_file.name}.tmp")
+            self._out = self._tmp.open("wb")
+            if old:
+                shutil.copyfileobj(_Range(self._old, 0, cut), self._out)
+        # Where the next chapter starts, without asking a file that is written in the background
+        self._offset = cut
+        if self._out is not None and writer is not None:
+            self._out = writer.stream(self._out, output_file)
+
+    def _load_index(self) -> List[List]:
+        """Return the chapters of the existing file, or [] if the index can't be trusted."""
+        try:
+            index = json.loads(self.index_file.read_text())
+            stat = self.output_file.stat()
+        except (OSError, ValueError):
+            return []
+        if index.get("version") != RENDER_VERSION or index.get("file") != [
+            stat.st_size,
+            stat.st_mtime_ns,
+        ]:
+            return []
+        return index["chapters"]
+
+    def needs_render(self, i: int) -> bool:
+        """Check whether chapter ``i`` has to be rendered."""
+        return i >= self.prefix and self._reuse[i] is None
+
+    def write(self, i: int, chunk: Optional[str]) -> None:
+        """Write chapter ``i``: rendered ``chunk`` if it needs rendering, else it's reused."""
+        if i < self.prefix or self._out is None:
+            return
+        offset = self._offset
+        position = self._reuse[i]
+        if position is not None:
+            old_offset, length = position
+            shutil.copyfileobj(_Range(self._old, old_offset, length), self._out)
+        elif chunk is not None:
+            data = chunk.encode(self.encoding)
+            self._out.write(data)
+            length = len(data)
+        else:
+            raise ValueError(f"Chapter {i} of '{self.output_file}' needs to be rendered")
+        self._offset += length
+        self._written.append([*self.chapters[i], offset, length])
+
+    def close(self) -> None:
+        """Finish the file and save the index."""
+        if self._out is None:
+            logging.debug(f"No changes in '{self.output_file}'")
+            return
+        self._out.close()
+        if self._old is not None:
+            self._old.close()
+        if self._tmp is not None:
+            os.replace(self._tmp, self.output_file)
+        stat = self.output_file.stat()
+        self.index_file.write_text(
+            json.dumps(
+                {
+                    "version": RENDER_VERSION,
+                    "file": [stat.st_size, stat.st_mtime_ns],
+                    "chapters": self._written,
+                }
+            )
+        )
+        rendered = sum(self.needs_render(i) for i in range(len(self.chapters)))
+        logging.debug(
+            f"Rendered {rendered} of {len(self.chapters)} chapters of '{self.output_file}'"
+        )
 
-from .config import DOCUMENT_TITLE, DATE_FORMAT_FILENAME, DATE_KEY_FORMAT, IMAGES_DIR_NAME
+    def abort(self) -> None:
+        """Give up on the update. The index is removed, so the next run rewrites the file."""
+        if self._out is None:
+            return
+        self._out.close()
+        if self._old is not None:
+            self._old.close()
+        if self._tmp is not None:
+            self._tmp.unlink()
+        self.index_file.unlink(missing_ok=True)
+
+
+class _Range:
+    """Readable view of a byte range of a file, for ``shutil.copyfileobj``."""
+
+    def __init__(self, f, offset: int, length: int):
+        self._f = f
+        self._remaining = length
+        f.seek(offset)
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
 
 
 class MarkdownGenerator:
     """Generate Markdown content from processed emails."""
 
-    def __init__(self, images_dir: Path, markdown_file: Path = None):
+    def __init__(
+        self,
+        images_dir: Path,
+        markdown_file: Optional[Path] = None,
+        thumbnails: bool = False,
+        writer: Optional[BackgroundWriter] = None,
+    ):
         self.images_dir = images_dir
+        # Show images that have a thumbnail as the thumbnail, linked to the full image
+        self.thumbnails = thumbnails
         self.images_rel_path = IMAGES_DIR_NAME
         self.content = [f"# {DOCUMENT_TITLE}\n\n"]
-        self.daily_content = defaultdict(list)
+        self.daily_content: DefaultDict[str, List[EmailRecord]] = defaultdict(list)
         self.markdown_file = markdown_file
+        # Writes the Markdown files in the background, see ``IncrementalOutput``
+        self.writer = writer
+        self._digests: Dict[Tuple[str, bool, bool], str] = {}
 
     def add_chapter(
-        self,
-        subject: str,
-        date: datetime,
-        body: str,
-        images: List[Path],
-        no_text: bool = False,
-        no_images: bool = False,
+        self, record: EmailRecord, no_text: bool = False, no_images: bool = False
     ) -> None:
         """Collect content for a chapter, organized by date."""
-        date_key = date.strftime(DATE_KEY_FORMAT)
-        self.daily_content[date_key].append({
-            'subject': subject,
-            'date': date,
-            'body': body if not no_text else "",
-            'images': images if not no_images else []
-        })
-
-    def _process_images(self, images: List[Path]) -> List[str]:
-        """Return markdown references for images using IMAGES_DIR_NAME and DATE_KEY_FORMAT from config."""
-        from .config import IMAGES_DIR_NAME
+        if no_text or no_images:
+            record = record.without(text=no_text, images=no_images)
+        date_key = day_key(record.date)
+        self.daily_content[date_key].append(record)
+        self._forget_digests(date_key)
+
+    def remove_chapter(self, record: EmailRecord) -> None:
+        """Remove a record previously added with ``add_chapter`` without flags."""
+        date_key = day_key(record.date)
+        entries = self.daily_content[date_key]
+        del entries[next(i for i, entry in enumerate(entries) if entry is record)]
+        if not entries:
+            del self.daily_content[date_key]
+        self._forget_digests(date_key)
+
+    def _forget_digests(self, date_key: str) -> None:
+        for flags in ((False, False), (False, True), (True, False), (True, True)):
+            self._digests.pop((date_key, *flags), None)
+
+    def _process_images(self, images: List[str], prefix: str = "") -> List[str]:
+        """
+        Return markdown references for images given as ``image_ref`` paths.
+
+        ``prefix`` is the path from the Markdown file to the folder of the main output file, for
+        files written to a subfolder.
+        """
         image_refs = []
-        for img_path in images:
-            parts = img_path.parts
-            try:
-                idx = parts.index(IMAGES_DIR_NAME)
-                rel_path = Path(*parts[idx:])
-            except ValueError:
-                # fallback: use full relative path from markdown file parent
-                if self.markdown_file:
-                    rel_path = img_path.relative_to(self.markdown_file.parent)
-                else:
-                    rel_path = img_path.relative_to(self.images_dir.parent)
-            image_refs.append(f"![{img_path.name}]({rel_path.as_posix()})\n\n")
+        for ref in images:
+            link = posixpath.join(prefix, ref) if prefix else ref
+            head, name = posixpath.split(link)
+            if self.thumbnails and thumbnail_path(self.images_dir.parent / ref).exists():
+                thumbnail = posixpath.join(head, THUMBNAILS_DIR_NAME, name)
+                image_refs.append(f"[![{name}]({thumbnail})]({link})\n\n")
+            else:
+                image_refs.append(f"![{name}]({link})\n\n")
         return image_refs
 
+    def _day_entries(self, date_key: str) -> List[EmailRecord]:
+        """Return the entries of one day in chronological order."""
+        day_entries = sorted(self.daily_content[date_key], key=lambda x: x.date)
+
+        if len(day_entries) > 1:
+            subjects = [e.subject for e in day_entries]
+            times = [e.date.strftime("%H:%M") for e in day_entries]
+            logging.info(f"Combining {len(day_entries)} emails from {date_key}:")
+            for subj, time in zip(subjects, times):
+                logging.info(f"  - {time}: '{subj}'")
+
+        return day_entries
+
+    def _chapter_fragments(
+        self, day_entries: List[EmailRecord], prefix: str = ""
+    ) -> Tuple[str, str]:
+        """Render the text and the image part of a day's chapter, in chronological order."""
+        text = ''.join(f"{entry.body}\n\n" for entry in day_entries if entry.body_length)
+        images = ''.join(
+            ref
+            for entry in day_entries
+            if entry.images
+            for ref in self._process_images(entry.images, prefix)
+        )
+        return text, images
+
+    @staticmethod
+    def _assemble_chapter(
+        day_entries: List[EmailRecord], text: str, images: str, no_text: bool = False
+    ) -> str:
+        """Put a chapter together from its fragments, or return "" if there's nothing to show."""
+        if not text and not images:
+            return ""
+
+        # Use the subject from the entry with the most text content
+        if no_text:
+            main_entry = day_entries[0]
+        else:
+            main_entry = max(day_entries, key=lambda x: x.body_length)
+
+        # Add all text content first, then all images
+        heading = f"## {main_entry.subject} -- {main_entry.date.strftime(DATE_FORMAT_FILENAME)}\n\n"
+        return heading + text + images
+
+    def _render_chapter(self, date_key: str) -> str:
+        """Render the chapter for one day, or an empty string if there's nothing to show."""
+        day_entries = self._day_entries(date_key)
+        return self._assemble_chapter(day_entries, *self._chapter_fragments(day_entries))
+
+    def pop_chapter(self, date_key: str) -> str:
+        """Render the chapter for one day and remove its entries, for writing days one by one."""
+        chapter = self._render_chapter(date_key)
+        del self.daily_content[date_key]
+        self._forget_digests(date_key)
+        return chapter
+
+    def iter_content(self) -> Iterator[str]:
+        """Yield the markdown document piece by piece: the title, then one chapter per day."""
+        yield from self.content
+        for date_key in sorted(self.daily_content.keys()):
+            chapter = self._render_chapter(date_key)
+            if chapter:
+                yield chapter
+
+    def write_variants(
+        self, targets: List[Tuple[Union[TextIO, BackgroundStream], bool, bool]]
+    ) -> None:
+        """
+        Write several variants of the document in a single pass over the days.
+
+        Each target is a ``(stream, no_text, no_images)`` tuple. Chapters are rendered once and
+        the text and image fragments are shared between all variants. Entries should be added
+        with both text and images for this to produce the same output as separate generators.
+        """
+        for stream, _, _ in targets:
+            stream.writelines(self.content)
+        self.write_days(targets)
+
+    def write_days(
+        self,
+        targets: Sequence[Tuple[Union[TextIO, BackgroundStream], bool, bool]],
+        pop: bool = False,
+    ) -> None:
+        """
+        Write the chapters of all days collected so far to each target, like ``write_variants``.
+
+        Only the chapters are written, not the title. With ``pop``, the entries of the days are
+        removed afterwards, so a document can be written a few days at a time.
+        """
+        for date_key in sorted(self.daily_content.keys()):
+            day_entries = self._day_entries(date_key)
+            text, images = self._chapter_fragments(day_entries)
+            for stream, no_text, no_images in targets:
+                stream.write(
+                    self._assemble_chapter(
+                        day_entries,
+                        "" if no_text else text,
+                        "" if no_images else images,
+                        no_text=no_text,
+                    )
+                )
+            if pop:
+                del self.daily_content[date_key]
+                self._forget_digests(date_key)
+
+    def write(self, stream: TextIO) -> None:
+        """Write the markdown document to a text stream one chapter at a time."""
+        for chunk in self.iter_content():
+            stream.write(chunk)
+
+    def _day_digest(self, date_key: str, no_text: bool = False, no_images: bool = False) -> str:
+        """Return a digest of everything that goes into the chapter of one day."""
+        key = (date_key, no_text, no_images)
+        if key in self._digests:
+            return self._digests[key]
+        digest = hashlib.sha256(f"{no_text}|{no_images}".encode())
+        for entry in sorted(self.daily_content[date_key], key=lambda x: x.date):
+            images: List[Union[str, bool]] = list(entry.images)
+            if self.thumbnails:
+                # Thumbnails can appear later, e.g. when the image options are first used
+                images += [
+                    thumbnail_path(self.images_dir.parent / ref).exists() for ref in entry.images
+                ]
+            digest.update(
+                json.dumps([entry.subject, entry.date.isoformat(), entry.body, images]).encode()
+            )
+        self._digests[key] = digest.hexdigest()
+        return self._digests[key]
+
+    def write_incremental(
+        self, targets: List[Tuple[Path, bool, bool]], atomic: bool = False
+    ) -> None:
+        """
+        Update Markdown files, re-rendering only days whose entries changed.
+
+        Each target is a ``(path, no_text, no_images)`` tuple like in ``write_variants``. The
+        previous content of each file is reused where possible, see ``IncrementalOutput``.
+        With ``atomic``, files are never modified in place but replaced once complete.
+        """
+        header = ''.join(self.content)
+        self._write_chapters(
+            targets, [header] * len(targets), sorted(self.daily_content.keys()), atomic=atomic
+        )
+
+    def _write_chapters(
+        self,
+        targets: List[Tuple[Path, bool, bool]],
+        headers: List[str],
+        date_keys: List[str],
+        prefix: str = "",
+        atomic: bool = False,
+        rebuild: bool = False,
+    ) -> None:
+        """Write its header and the chapters of ``date_keys`` to each target incrementally."""
+        # Chapters rendered with other settings can't be reused, even if their emails are the same
+        settings = json.dumps([RENDER_VERSION, DATE_FORMAT_FILENAME, IMAGES_DIR_NAME, prefix])
+        outputs = []
+        for (path, no_text, no_images), header in zip(targets, headers):
+            header_digest = hashlib.sha256(f"{settings}|{header}".encode()).hexdigest()
+            chapters = [("", header_digest)] + [
+                (
+                    date_key,
+                    hashlib.sha256(
+                        f"{settings}|{self._day_digest(date_key, no_text, no_images)}".encode()
+                    ).hexdigest(),
+                )
+                for date_key in date_keys
+            ]
+            outputs.append(
+                (
+                    IncrementalOutput(path, chapters, atomic, rebuild, self.writer),
+                    no_text,
+                    no_images,
+                )
+            )
+
+        try:
+            for (output, _, _), header in zip(outputs, headers):
+                output.write(0, header)
+
+            for i, date_key in enumerate(date_keys, start=1):
+                if not any(output.needs_render(i) for output, _, _ in outputs):
+                    for output, _, _ in outputs:
+                        output.write(i, None)
+                    continue
+
+                day_entries = self._day_entries(date_key)
+                text, images = self._chapter_fragments(day_entries, prefix)
+                for output, no_text, no_images in outputs:
+                    chapter = None
+                    if output.needs_render(i):
+                        chapter = self._assemble_chapter(
+                            day_entries,
+                            "" if no_text else text,
+                            "" if no_images else images,
+                            no_text=no_text,
+                        )
+                    output.write(i, chapter)
+        except BaseException:
+            for output, _, _ in outputs:
+                output.abort()
+            raise
+        for output, _, _ in outputs:
+            output.close()
+
+    def write_split(
+        self,
+        targets: List[Tuple[Path, bool, bool]],
+        period: str,
+        jobs: int = 1,
+        incremental: bool = True,
+        atomic: bool = False,
+    ) -> List[Path]:
+        """
+        Write one Markdown file per month or year, and an index linking to them.
+
+        ``period`` is a key of ``SPLIT_FORMATS``. For a target ``out/Mails.md``, the parts are
+        written to ``out/Mails/<period>.md`` and ``out/Mails.md`` becomes the index. Parts are
+        written independently in up to ``jobs`` threads, and like in ``write_incremental``
+        only changed chapters are rendered; parts without changes aren't touched at all.
+        Without ``incremental``, every part is rendered again. Returns all written files.
+        """
+        date_format = SPLIT_FORMATS[period]
+        parts: Dict[str, List[str]] = defaultdict(list)
+        for date_key in sorted(self.daily_content.keys()):
+            parts[self.daily_content[date_key][0].date.strftime(date_format)].append(date_key)
+
+        def write_part(part: str) -> None:
+            part_targets = [
+                (path.parent / path.stem / f"{part}{path.suffix}", no_text, no_images)
+                for path, no_text, no_images in targets
+            ]
+            headers = [
+                f"# {DOCUMENT_TITLE} - {part}\n\n[Index]({posixpath.join('..', path.name)})\n\n"
+                for path, _, _ in targets
+            ]
+            self._write_chapters(
+                part_targets,
+                headers,
+                parts[part],
+                prefix="..",
+                atomic=atomic,
+                rebuild=not incremental,
+            )
+
+        for path, _, _ in targets:
+            (path.parent / path.stem).mkdir(parents=True, exist_ok=True)
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # Consume the results so errors in any part are raised here
+            list(executor.map(write_part, parts))
+
+        written = []
+        for path, _, _ in targets:
+            part_dir = path.parent / path.stem
+            part_files = [part_dir / f"{part}{path.suffix}" for part in parts]
+            self._remove_stale_parts(part_dir, path.suffix, part_files)
+            index = f"# {DOCUMENT_TITLE}\n\n" + ''.join(
+                f"- [{part}]({path.stem}/{part}{path.suffix}) "
+                f"({sum(len(self.daily_content[k]) for k in parts[part])} emails)\n"
+                for part in parts
+            )
+            if not path.exists() or path.read_text() != index:
+                _replace_text(path, index)
+            written += [path] + part_files
+        return written
+
+    @staticmethod
+    def _remove_stale_parts(part_dir: Path, suffix: str, part_files: List[Path]) -> None:
+        """Delete parts written by an earlier run that have no emails anymore."""
+        for stale in set(part_dir.glob(f"*{suffix}")) - set(part_files):
+            index_file = stale.with_name(f".{stale.name}{CHAPTER_INDEX_SUFFIX}")
+            # Only files with a chapter index were written by us
+            if index_file.exists():
+                logging.info(f"Removing part without emails: '{stale}'")
+                stale.unlink()
+                index_file.unlink()
+
     def get_content(self) -> str:
         """Generate the complete markdown content."""
-        for date_key in sorted(self.daily_content.keys()):
-            day_entries = sorted(self.daily_content[date_key], key=lambda x: x['date'])
-
-            if len(day_entries) > 1:
-                subjects = [e['subject'] for e in day_entries]
-                times = [e['date'].strftime("%H:%M") for e in day_entries]
-                logging.info(f"Combining {len(day_entries)} emails from {date_key}:")
-                for subj, time in zip(subjects, times):
-                    logging.info(f"  - {time}: '{subj}'")
-
-            # Use the subject from the entry with the most text content
-            main_entry = max(day_entries, key=lambda x: len(x['body']) if x['body'] else 0)
-            date_str = main_entry['date'].strftime(DATE_FORMAT_FILENAME)
-
-            # Only add chapter if there's content to show
-            has_content = any(e['body'] for e in day_entries) or any(e['images'] for e in day_entries)
-            if not has_content:
-                continue
-
-            # Only show date (not time) in chapter heading
-            self.content.append(f"## {main_entry['subject']} -- {main_entry['date'].strftime(DATE_FORMAT_FILENAME)}\n\n")
-
-            # Add all text content first, in chronological order
-            for entry in day_entries:
-                if entry['body']:
-                    self.content.append(f"{entry['body']}\n\n")
-
-            # Then add all images, in chronological order
-            for entry in day_entries:
-                if entry['images']:
-                    self.content.extend(self._process_images(entry['images']))
-
-        return ''.join(self.content)
+        return ''.join(self.iter_content())
@@ -0,0 +1,114 @@
+"""Per-stage timings and throughput of a run."""
+
+import logging
+from typing import Dict, List, Tuple
+
+
+class StageMetrics:
+    """Cumulative wall time and data volume of one processing stage."""
+
+    __slots__ = ("seconds", "calls", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return the counters as a JSON-serializable dict."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FileMetrics:
+    """Wall time and data volume of processing one email."""
+
+    __slots__ = ("seconds", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class Metrics:
+    """
+    Per-stage and per-file timings and data volume of a run.
+
+    Stages are recorded with ``add`` using plain ``time.perf_counter`` differences, which is
+    cheap enough to leave on all the time. Metrics of worker processes are combined with
+    ``merge``.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageMetrics] = {}
+        self.files: Dict[str, FileMetrics] = {}
+
+    def add(self, stage: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Add one call of a stage."""
+        metrics = self.stages.get(stage)
+        if metrics is None:
+            metrics = self.stages[stage] = StageMetrics()
+        metrics.seconds += seconds
+        metrics.calls += 1
+        metrics.bytes_in += bytes_in
+        metrics.bytes_out += bytes_out
+
+    def add_file(self, source: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Record the total processing time, input size and output size of one email."""
+        metrics = self.files.get(source)
+        if metrics is None:
+            metrics = self.files[source] = FileMetrics()
+        metrics.seconds += seconds
+        metrics.bytes_in += bytes_in
+        metrics.bytes_out += bytes_out
+
+    def bytes_out(self) -> int:
+        """Return the output size of all stages so far."""
+        return sum(metrics.bytes_out for metrics in self.stages.values())
+
+    def merge(self, other: "Metrics") -> None:
+        """Add the metrics of another run, e.g. of a worker process."""
+        for stage, metrics in other.stages.items():
+            mine = self.stages.get(stage)
+            if mine is None:
+                mine = self.stages[stage] = StageMetrics()
+            mine.seconds += metrics.seconds
+            mine.calls += metrics.calls
+            mine.bytes_in += metrics.bytes_in
+            mine.bytes_out += metrics.bytes_out
+        for source, file_metrics in other.files.items():
+            self.add_file(
+                source, file_metrics.seconds, file_metrics.bytes_in, file_metrics.bytes_out
+            )
+
+    def slowest_files(self, top: int = 10) -> List[Tuple[str, FileMetrics]]:
+        """Return the ``top`` files that took longest to process, slowest first."""
+        return sorted(self.files.items(), key=lambda x: x[1].seconds, reverse=True)[:top]
+
+    def to_dict(self, top: int = 10) -> Dict:
+        """Return the metrics as a JSON-serializable dict."""
+        return {
+            "stages": {stage: m.to_dict() for stage, m in self.stages.items()},
+            "files": len(self.files),
+            "slowest_files": [
+                {"file": source, **{name: getattr(m, name) for name in m.__slots__}}
+                for source, m in self.slowest_files(top)
+            ],
+        }
+
+    def log_report(self, top: int = 10) -> None:
+        """Log the time and data volume per stage and of the slowest files."""
+        logging.info("Profile:")
+        for stage, m in sorted(self.stages.items(), key=lambda x: x[1].seconds, reverse=True):
+            logging.info(
+                f"  {stage:10s} {m.seconds:8.3f}s  {m.calls:7d} calls  "
+                f"{m.bytes_in / 1e6:9.1f} MB in  {m.bytes_out / 1e6:9.1f} MB out"
+            )
+        if self.files:
+            logging.info(f"Slowest {min(top, len(self.files))} files:")
+            for source, f in self.slowest_files(top):
+                logging.info(
+                    f"  {f.seconds:8.3f}s  {f.bytes_in / 1e3:9.1f} kB in  "
+                    f"{f.bytes_out / 1e3:9.1f} kB out  '{source}'"
+                )
@@ -0,0 +1,152 @@
+"""Read only the headers of emails to order them and drop duplicates."""
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from typing import Dict, List, NamedTuple, Optional, Tuple, cast
+
+from .dates import day_key, parse_date
+from .metrics import Metrics
+from .sources import EmailSource, read_header_block
+
+
+class EmailHeaders(NamedTuple):
+    """The headers of an email needed to place it in the output, read without its body."""
+
+    source: EmailSource
+    subject: Optional[str]
+    date: Optional[datetime]
+    message_id: Optional[str]
+    # The chapter the email belongs to, None if it has no valid date
+    day: Optional[str]
+
+
+def read_headers(source: EmailSource) -> EmailHeaders:
+    """Parse the ``Date``, ``Subject`` and ``Message-ID`` headers of an email."""
+    # The compat32 policy keeps headers as plain strings, which is much cheaper to parse
+    msg = BytesHeaderParser().parsebytes(read_header_block(source))
+    try:
+        date = parse_date(msg["date"])
+    except (TypeError, ValueError):
+        date = None
+    subject = msg["subject"]
+    if subject is not None:
+        try:
+            subject = str(make_header(decode_header(subject)))
+        except (LookupError, HeaderParseError, UnicodeDecodeError):
+            # Unknown or broken charset, the full parse copes with it anyway
+            subject = str(subject)
+    message_id = msg["message-id"]
+    return EmailHeaders(
+        source,
+        subject,
+        date,
+        str(message_id).strip() if message_id else None,
+        day_key(date) if date is not None else None,
+    )
+
+
+def prescan(
+    sources: List[EmailSource],
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> List[EmailHeaders]:
+    """
+    Read the headers of all emails and return them in chronological order.
+
+    Emails outside the inclusive day range ``since`` to ``until`` (``YYYY-MM-DD``) are
+    dropped before any body is read. Emails without a valid date are kept at the end, so the
+    full parse can report them as failed. The sort is stable, emails from the same moment keep
+    their order in ``sources``.
+    """
+    started = time.perf_counter()
+    dated: List[EmailHeaders] = []
+    undated: List[EmailHeaders] = []
+    skipped = 0
+    for source in sources:
+        try:
+            headers = read_headers(source)
+        except OSError as e:
+            logging.error(f"Failed to read headers of '{source}': {e}")
+            headers = EmailHeaders(source, None, None, None, None)
+        day = headers.day
+        if day is None:
+            undated.append(headers)
+        elif (since is not None and day < since) or (until is not None and day > until):
+            skipped += 1
+        else:
+            dated.append(headers)
+    dated.sort(key=lambda headers: cast(datetime, headers.date))
+
+    if skipped:
+        logging.info(f"Skipped {skipped} emails outside of the requested date range")
+    logging.debug(f"Prescan found {len(dated)} emails on {len({h.day for h in dated})} days")
+    if metrics is not None:
+        metrics.add("prescan", time.perf_counter() - started)
+    return dated + undated
+
+
+def body_digest(source: EmailSource) -> str:
+    """
+    Return a hash of an email's body and attachments that ignores line endings.
+
+    Trailing whitespace is dropped from every line, so copies that were saved with different
+    line endings still get the same digest.
+    """
+    digest = hashlib.sha256()
+    with source.open("rb") as f:
+        for line in f:
+            if not line.strip(b"\r\n"):
+                break
+        for line in f:
+            digest.update(line.rstrip())
+            digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def drop_duplicates(
+    headers: List[EmailHeaders],
+    metrics: Optional[Metrics] = None,
+    seen: Optional[Dict[Tuple, EmailSource]] = None,
+) -> Tuple[List[EmailHeaders], List[EmailHeaders]]:
+    """
+    Split emails into the first copy of every message and the duplicates of earlier ones.
+
+    Emails are the same message if they have the same ``Message-ID``. Emails without one are
+    compared by date, subject and ``body_digest``; only those are read beyond their headers.
+    ``seen`` maps the keys of emails kept before, e.g. by an earlier update, to their source;
+    the unique emails are added to it. Returns the unique emails and the duplicates, both in the
+    order of ``headers``.
+    """
+    started = time.perf_counter()
+    if seen is None:
+        seen = {}
+    unique: List[EmailHeaders] = []
+    duplicates: List[EmailHeaders] = []
+    for entry in headers:
+        if entry.message_id is not None:
+            key: Tuple = ("id", entry.message_id)
+        elif entry.date is not None:
+            try:
+                key = ("body", entry.date, entry.subject, body_digest(entry.source))
+            except OSError:
+                unique.append(entry)
+                continue
+        else:
+            # Without a date the email fails to process anyway, let the full parse report it
+            unique.append(entry)
+            continue
+        if key in seen:
+            logging.info(f"Skipping duplicate of '{seen[key]}': '{entry.source}'")
+            duplicates.append(entry)
+        else:
+            seen[key] = entry.source
+            unique.append(entry)
+    if metrics is not None:
+        metrics.add("dedupe", time.perf_counter() - started)
+    return unique, duplicates
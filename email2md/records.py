@@ -0,0 +1,140 @@
+"""Compact records of processed emails, with bodies spilled to disk past a budget."""
+
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Sequence, Tuple, Union, cast
+
+from .attachments import StoredImage
+from .config import BODY_MEMORY_BUDGET
+
+
+def image_ref(path: Path, images_dir: Path) -> str:
+    """
+    Return the path of a linked image relative to the folder containing ``images_dir``.
+
+    That's also the link from a Markdown file next to ``images_dir``. The string is interned,
+    so an image shared by many emails is only kept in memory once.
+    """
+    return sys.intern(Path(os.path.relpath(path, images_dir.parent)).as_posix())
+
+
+class EmailRecord:
+    """
+    What the Markdown needs of a processed email.
+
+    ``images`` holds the ``image_ref`` paths of the linked images, and ``stored`` the
+    ``StoredImage`` entries of images that are not linked yet. The body is either kept in memory
+    or in a ``BodyStore``, from which it's read again whenever ``body`` is accessed.
+    """
+
+    __slots__ = ("subject", "date", "images", "stored", "_body", "_store")
+
+    def __init__(
+        self,
+        subject: str,
+        date: datetime,
+        body: str,
+        images: List[str],
+        stored: Sequence[StoredImage] = (),
+    ):
+        self.subject = subject
+        self.date = date
+        self.images = images
+        # Empty for most records, the shared () keeps them small
+        self.stored = stored
+        self._body: Union[str, Tuple[int, int, int]] = body
+        self._store: Optional["BodyStore"] = None
+
+    @property
+    def body(self) -> str:
+        """The body text, read back from the ``BodyStore`` if it was moved there."""
+        if isinstance(self._body, str):
+            return self._body
+        offset, size, _ = self._body
+        # Bodies are only moved to a store by ``BodyStore.keep``, which sets ``_store``
+        return cast("BodyStore", self._store).read(offset, size)
+
+    @property
+    def body_length(self) -> int:
+        """Length of the body in characters, without reading a stored body."""
+        return len(self._body) if isinstance(self._body, str) else self._body[2]
+
+    def without(self, text: bool = False, images: bool = False) -> "EmailRecord":
+        """Return a copy without the body and/or the images."""
+        return EmailRecord(
+            self.subject,
+            self.date,
+            "" if text else self.body,
+            [] if images else self.images,
+            () if images else self.stored,
+        )
+
+    def __getstate__(self):
+        """Pickle the body itself, a worker process has no access to the ``BodyStore``."""
+        return self.subject, self.date, self.body, self.images, self.stored
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class BodyStore:
+    """
+    Keeps email bodies in memory up to a budget, and the ones after that in a temporary file.
+
+    Only headers and image paths of records then stay in memory, however many emails a run has.
+    Stored bodies are never removed from the file; it is deleted when the store is closed or
+    the process exits.
+    """
+
+    def __init__(self, budget: int = BODY_MEMORY_BUDGET):
+        self.budget = budget
+        # Characters of the bodies kept in memory
+        self.resident = 0
+        self.spilled = 0
+        self._file: Optional[BinaryIO] = None
+        self._lock = threading.Lock()
+
+    def keep(self, record: EmailRecord) -> None:
+        """Take charge of a record's body, moving it to the file once the budget is used up."""
+        body = record._body
+        if not isinstance(body, str):
+            return
+        if self.resident + len(body) <= self.budget:
+            self.resident += len(body)
+            return
+        data = body.encode("utf-8", "surrogatepass")
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix="email2md-bodies-")
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(data)
+        record._body = (offset, len(data), len(body))
+        record._store = self
+        self.spilled += 1
+
+    def release(self, record: EmailRecord) -> None:
+        """Give back the budget of a record kept in memory, once it isn't needed anymore."""
+        body = record._body
+        if isinstance(body, str):
+            self.resident -= len(body)
+
+    def read(self, offset: int, size: int) -> str:
+        """Read a body written by ``keep``."""
+        # Split output is rendered in threads, which share the file position
+        with self._lock:
+            if self._file is None:
+                raise ValueError("The body store is closed")
+            self._file.seek(offset)
+            data = self._file.read(size)
+        return data.decode("utf-8", "surrogatepass")
+
+    def close(self) -> None:
+        """Delete the file. Records with bodies in it can't be rendered anymore."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,266 @@
+"""Optional full-text search index of the output."""
+
+import hashlib
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .config import DATE_FORMAT_FILENAME, DATE_KEY_FORMAT, IMAGES_DIR_NAME, TIMEZONE
+from .dates import day_key
+
+if TYPE_CHECKING:
+    from .records import EmailRecord
+
+# Bump whenever the layout of the index or what is indexed changes
+SEARCH_INDEX_VERSION = 2
+
+# Number of words around the matches shown for every hit
+SNIPPET_WORDS = 12
+
+
+class SearchHit(NamedTuple):
+    """An email matching a search."""
+
+    # The chapter the email belongs to
+    day: str
+    date: str
+    subject: str
+    # Part of the body, subject or images with the matches marked as **bold**
+    snippet: str
+
+
+class SearchChapter(NamedTuple):
+    """A chapter of the output with emails matching a search."""
+
+    day: str
+    # Subject and date of the chapter heading, from the email of the day with the most text
+    subject: str
+    date: str
+    # The matching emails of the day, best matches first
+    hits: List[SearchHit]
+
+
+class SearchIndex:
+    """
+    Full-text index of the emails in the output, in an SQLite FTS5 table.
+
+    Subject, date, body and image paths of every email are indexed under the name of its source,
+    with a digest of that content, so an update only indexes emails that are new or changed.
+    Body length and time of every email are kept as well, to tell the headings of the chapters.
+    Needs an SQLite library with FTS5, which most Python builds have.
+    """
+
+    def __init__(self, index_file: Path):
+        self.index_file = index_file
+        self._conn = sqlite3.connect(str(index_file))
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        fingerprint = json.dumps(
+            [SEARCH_INDEX_VERSION, str(TIMEZONE), DATE_KEY_FORMAT, IMAGES_DIR_NAME]
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                logging.info(f"Configuration changed, rebuilding search index: '{index_file}'")
+            self._conn.execute("DROP TABLE IF EXISTS emails")
+            self._conn.execute("DROP TABLE IF EXISTS emails_text")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,)
+            )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS emails "
+            "(id INTEGER PRIMARY KEY, source TEXT UNIQUE, digest TEXT, day TEXT, "
+            "length INTEGER, timestamp REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS emails_day ON emails (day)")
+        # Umlauts and accents match their plain letters
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS emails_text USING fts5("
+            "subject, date, body, images, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _digest(record: "EmailRecord") -> str:
+        return hashlib.sha256(
+            json.dumps(
+                [record.subject, record.date.isoformat(), record.body, list(record.images)]
+            ).encode()
+        ).hexdigest()
+
+    def update(
+        self, entries: Iterable[Tuple[str, "EmailRecord"]], complete: bool = True
+    ) -> Tuple[int, int]:
+        """
+        Index the emails that are new or changed, given as ``(source, record)`` pairs.
+
+        With ``complete``, the entries are all emails of the output, and emails indexed before
+        that aren't among them are removed. Returns how many emails were indexed and removed.
+        """
+        known = dict(self._conn.execute("SELECT source, digest FROM emails"))
+        seen = set()
+        indexed = 0
+        with self._conn:
+            for source, record in entries:
+                seen.add(source)
+                digest = self._digest(record)
+                if known.get(source) == digest:
+                    continue
+                if source in known:
+                    self._delete(source)
+                cursor = self._conn.execute(
+                    "INSERT INTO emails (source, digest, day, length, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        source,
+                        digest,
+                        day_key(record.date),
+                        record.body_length,
+                        record.date.timestamp(),
+                    ),
+                )
+                self._conn.execute(
+                    "INSERT INTO emails_text (rowid, subject, date, body, images) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        cursor.lastrowid,
+                        record.subject,
+                        record.date.strftime(DATE_FORMAT_FILENAME),
+                        record.body,
+                        " ".join(record.images),
+                    ),
+                )
+                indexed += 1
+            removed = [source for source in known if source not in seen] if complete else []
+            for source in removed:
+                self._delete(source)
+        return indexed, len(removed)
+
+    def remove(self, sources: Iterable[str]) -> None:
+        """Remove emails from the index."""
+        with self._conn:
+            for source in sources:
+                self._delete(source)
+
+    def retain(self, sources: Set[str]) -> int:
+        """Remove every email that isn't among ``sources``. Returns how many were removed."""
+        known = [source for (source,) in self._conn.execute("SELECT source FROM emails")]
+        removed = [source for source in known if source not in sources]
+        self.remove(removed)
+        return len(removed)
+
+    def _delete(self, source: str) -> None:
+        self._conn.execute(
+            "DELETE FROM emails_text WHERE rowid = (SELECT id FROM emails WHERE source = ?)",
+            (source,),
+        )
+        self._conn.execute("DELETE FROM emails WHERE source = ?", (source,))
+
+    @property
+    def split(self) -> Optional[str]:
+        """The ``--split`` period of the output, None if it's a single file."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'split'").fetchone()
+        return row[0] if row is not None else None
+
+    @split.setter
+    def split(self, period: Optional[str]) -> None:
+        with self._conn:
+            if period is None:
+                self._conn.execute("DELETE FROM meta WHERE key = 'split'")
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('split', ?)", (period,)
+                )
+
+    @staticmethod
+    def _conditions(
+        query: str, since: Optional[str], until: Optional[str]
+    ) -> Tuple[str, List[str]]:
+        conditions = ["emails_text MATCH ?"]
+        parameters = [query]
+        if since is not None:
+            conditions.append("emails.day >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("emails.day <= ?")
+            parameters.append(until)
+        return " AND ".join(conditions), parameters
+
+    def search(
+        self,
+        query: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 20,
+        days: Optional[Sequence[str]] = None,
+    ) -> List[SearchHit]:
+        """
+        Return the emails matching an FTS5 query, best matches first.
+
+        ``since`` and ``until`` limit the results to an inclusive range of days
+        (``YYYY-MM-DD``), ``days`` to the given days; a negative ``limit`` returns all matches.
+        Raises ``sqlite3.OperationalError`` for an invalid query.
+        """
+        where, parameters = self._conditions(query, since, until)
+        if days is not None:
+            where += f" AND emails.day IN ({', '.join('?' * len(days))})"
+            parameters.extend(days)
+        rows = self._conn.execute(
+            "SELECT emails.day, emails_text.date, emails_text.subject, "
+            "snippet(emails_text, 2, '**', '**', '...', ?), "
+            "snippet(emails_text, 0, '**', '**', '...', ?), "
+            "snippet(emails_text, 3, '**', '**', '...', ?) "
+            "FROM emails_text JOIN emails ON emails.id = emails_text.rowid "
+            f"WHERE {where} ORDER BY rank LIMIT ?",
+            (*[SNIPPET_WORDS] * 3, *parameters, limit),
+        ).fetchall()
+        hits = []
+        for day, date, subject, *snippets in rows:
+            # Show the body around the matches, or the subject or images if only they match
+            snippet = next((s for s in snippets if s and "**" in s), snippets[0] or "")
+            hits.append(SearchHit(day, date, subject or "", snippet))
+        return hits
+
+    def search_chapters(
+        self,
+        query: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 20,
+    ) -> List[SearchChapter]:
+        """
+        Return the chapters with emails matching an FTS5 query, best matches first.
+
+        Like ``search``, but the emails are grouped by the day they appear under in the output,
+        and ``limit`` counts chapters. The heading is that of the Markdown: the subject and date
+        of the email with the longest body, the earliest of them on a tie.
+        """
+        where, parameters = self._conditions(query, since, until)
+        days = [
+            day
+            for (day,) in self._conn.execute(
+                "SELECT emails.day FROM emails_text JOIN emails ON emails.id = emails_text.rowid "
+                f"WHERE {where} GROUP BY emails.day ORDER BY MIN(rank) LIMIT ?",
+                (*parameters, limit),
+            )
+        ]
+        hits: Dict[str, List[SearchHit]] = {day: [] for day in days}
+        for hit in self.search(query, since, until, limit=-1, days=days):
+            hits[hit.day].append(hit)
+        chapters = []
+        for day in days:
+            subject, date = self._conn.execute(
+                "SELECT emails_text.subject, emails_text.date "
+                "FROM emails JOIN emails_text ON emails.id = emails_text.rowid "
+                "WHERE emails.day = ? ORDER BY emails.length DESC, emails.timestamp LIMIT 1",
+                (day,),
+            ).fetchone()
+            chapters.append(SearchChapter(day, subject or "", date, hits[day]))
+        return chapters
+
+    def close(self) -> None:
+        """Commit pending changes and close the database."""
+        self._conn.commit()
+        self._conn.close()
@@ -0,0 +1,139 @@
+"""Splitting a run across machines and merging the results."""
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+from .attachments import StoredImage
+from .sources import ArchiveMember, EmailSource, MboxMessage
+
+# Bump whenever the layout of shard files changes
+SHARD_FILE_VERSION = 1
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a shard given as ``i/N`` with ``1 <= i <= N``."""
+    try:
+        index, count = (int(number) for number in value.split("/"))
+    except ValueError:
+        raise ValueError(f"invalid shard '{value}', expected i/N, e.g. 1/4") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"invalid shard '{value}', i must be between 1 and N")
+    return index, count
+
+
+def source_key(source: EmailSource, input_path: Path) -> str:
+    """Return a name for an email that is the same on every machine with a copy of the input."""
+    if isinstance(source, MboxMessage):
+        return f"{Path(os.path.relpath(source.mbox_path, input_path)).as_posix()}:{source.offset}"
+    if isinstance(source, ArchiveMember):
+        archive = Path(os.path.relpath(source.archive_path, input_path)).as_posix()
+        return f"{archive}:{source.member}"
+    return Path(os.path.relpath(source, input_path)).as_posix()
+
+
+def in_shard(source: EmailSource, input_path: Path, index: int, count: int) -> bool:
+    """Check whether an email belongs to shard ``index`` of ``count``, by a hash of its name."""
+    digest = hashlib.sha256(source_key(source, input_path).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count == index - 1
+
+
+def shard_file_name(output_file: Path, index: int, count: int) -> Path:
+    """Return where a shard run next to ``output_file`` writes its results."""
+    return output_file.with_name(f"{output_file.stem}.shard-{index}-of-{count}.jsonl.gz")
+
+
+class ShardRecord(NamedTuple):
+    """An email processed by a shard run, with its position in the complete run."""
+
+    order: int
+    source: str
+    subject: str
+    date: datetime
+    body: str
+    images: List[StoredImage]
+    has_text: bool
+    has_images: bool
+
+
+class ShardResult(NamedTuple):
+    """Everything a shard run found out about its part of the input."""
+
+    shard_index: int
+    shard_count: int
+    records: List[ShardRecord]
+    failed_files: List[str]
+    duplicate_files: List[str]
+
+
+def write_shard_file(path: Path, result: ShardResult) -> None:
+    """Write a shard result as gzipped JSON lines: a header line, then one line per email."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        header = {
+            "version": SHARD_FILE_VERSION,
+            "shard": [result.shard_index, result.shard_count],
+            "failed": result.failed_files,
+            "duplicates": result.duplicate_files,
+        }
+        f.write(json.dumps(header) + "\n")
+        for record in result.records:
+            f.write(
+                json.dumps(
+                    [
+                        record.order,
+                        record.source,
+                        record.subject,
+                        record.date.isoformat(),
+                        record.body,
+                        [list(image) for image in record.images],
+                        record.has_text,
+                        record.has_images,
+                    ]
+                )
+                + "\n"
+            )
+    os.replace(tmp, path)
+
+
+def read_shard_file(path: Path) -> ShardResult:
+    """Read a file written by ``write_shard_file``."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != SHARD_FILE_VERSION:
+            raise ValueError(f"'{path}' was written by an incompatible version of email2md")
+        records = []
+        for line in f:
+            order, source, subject, date, body, images, has_text, has_images = json.loads(line)
+            records.append(
+                ShardRecord(
+                    order,
+                    source,
+                    subject,
+                    datetime.fromisoformat(date),
+                    body,
+                    [StoredImage(*image) for image in images],
+                    has_text,
+                    has_images,
+                )
+            )
+    index, count = header["shard"]
+    return ShardResult(index, count, records, header["failed"], header["duplicates"])
+
+
+def read_shard_files(paths: List[Path]) -> List[ShardResult]:
+    """Read the results of all shards of a run, checking that none is missing or repeated."""
+    results = [read_shard_file(path) for path in paths]
+    counts = {result.shard_count for result in results}
+    if len(counts) != 1:
+        raise ValueError(f"Shard files belong to runs with different shard counts: {counts}")
+    count = counts.pop()
+    indices = sorted(result.shard_index for result in results)
+    if indices != list(range(1, count + 1)):
+        missing = sorted(set(range(1, count + 1)) - set(indices))
+        raise ValueError(f"Expected shards 1 to {count} once each, missing: {missing or 'none'}")
+    return results
@@ -0,0 +1,386 @@
+"""Finding emails in directories, mbox files, Maildir folders and archives."""
+
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, BinaryIO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+# tarfile and zipfile are only imported once an archive is read, to keep startup fast
+if TYPE_CHECKING:
+    import tarfile
+    import zipfile
+
+# Number of bytes before the end of the indexed region used to detect rewritten mbox files
+TAIL_CHECK_SIZE = 4096
+
+# Archives whose .eml members are read without extracting them
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+Archive = Union["zipfile.ZipFile", "tarfile.TarFile"]
+
+# Open memory maps and archives of the current thread, see ``_map_file`` and ``_open_archive``
+_local = threading.local()
+
+
+def _map_file(path: Path, generation: int, min_size: int) -> mmap.mmap:
+    """
+    Return a read-only memory map of a file, shared by all messages read in the same thread.
+
+    The file is mapped again if it was rewritten or has grown past the current mapping. Every
+    thread has maps of its own, so a map is never closed while another thread reads from it.
+    """
+    open_maps: Optional[Dict[Path, Tuple[int, mmap.mmap]]] = getattr(_local, "maps", None)
+    if open_maps is None:
+        open_maps = _local.maps = {}
+    if path in open_maps:
+        mapped_generation, mapped = open_maps[path]
+        if mapped_generation == generation and len(mapped) >= min_size:
+            return mapped
+        mapped.close()
+    with path.open("rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    open_maps[path] = (generation, mapped)
+    return mapped
+
+
+def is_archive(path: Path) -> bool:
+    """Check whether a file is a zip or tar archive, by its name."""
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _open_archive(path: Path) -> Archive:
+    """
+    Return an open archive, shared by all its members read in the same thread.
+
+    Reading a tar member seeks the shared file handle, so every thread has handles of its own.
+    Archives are opened again in worker processes, since a forked process shares the position
+    of the parent's file handles, and if the archive file changed.
+    """
+    open_archives: Optional[Dict[Path, Tuple[Tuple[int, int, int], Archive]]]
+    open_archives = getattr(_local, "archives", None)
+    if open_archives is None:
+        open_archives = _local.archives = {}
+    stat = path.stat()
+    key = (os.getpid(), stat.st_size, stat.st_mtime_ns)
+    if path in open_archives:
+        opened_key, archive = open_archives[path]
+        if opened_key == key:
+            return archive
+        if opened_key[0] == key[0]:
+            archive.close()
+    if path.name.lower().endswith(".zip"):
+        import zipfile
+
+        archive = zipfile.ZipFile(path)
+    else:
+        import tarfile
+
+        archive = tarfile.open(path, "r:*")
+    open_archives[path] = (key, archive)
+    return archive
+
+
+class SourceStat(NamedTuple):
+    """The subset of ``os.stat_result`` used to detect changed messages."""
+
+    st_size: int
+    st_mtime_ns: int
+
+
+class MboxMessage(NamedTuple):
+    """
+    A single message inside an mbox file.
+
+    Behaves like the ``Path`` of an .eml file where the pipeline needs it: it has a ``name``,
+    can be opened for reading and has a ``stat()``. The message bytes are read from a memory
+    map of the mbox file, no copy of the message is written to disk.
+    """
+
+    mbox_path: Path
+    offset: int
+    length: int
+    generation: int
+
+    @property
+    def name(self) -> str:
+        """Short name used in logs, like ``Path.name``."""
+        return f"{self.mbox_path.name}:{self.offset}"
+
+    def __str__(self) -> str:
+        """Return the mbox path and offset, as shown in logs and summaries."""
+        return f"{self.mbox_path}:{self.offset}"
+
+    def open(self, mode: str = "rb") -> BinaryIO:
+        """Open the message for reading. Only binary mode is supported."""
+        if mode != "rb":
+            raise ValueError(f"Messages in mbox files can only be opened with 'rb', not '{mode}'")
+        mapped = _map_file(self.mbox_path, self.generation, self.offset + self.length)
+        return io.BytesIO(mapped[self.offset : self.offset + self.length])
+
+    def stat(self) -> SourceStat:
+        """Return size and change marker, the generation of the mbox index."""
+        return SourceStat(self.length, self.generation)
+
+    def read_header_block(self) -> bytes:
+        """Return the header lines of the message without copying its body."""
+        end = self.offset + self.length
+        mapped = _map_file(self.mbox_path, self.generation, end)
+        # The blank line ends with either LF or CRLF, whichever comes first
+        found = [mapped.find(blank, self.offset, end) for blank in (b"\n\n", b"\n\r\n")]
+        found = [pos for pos in found if pos != -1]
+        if found:
+            end = min(found) + 1
+        return mapped[self.offset : end]
+
+
+class ArchiveMember(NamedTuple):
+    """
+    An .eml file inside a zip or tar archive.
+
+    Behaves like the ``Path`` of an .eml file, like ``MboxMessage``. Opening it streams the
+    member out of the archive without extracting it. ``position`` is the index of the member in
+    a zip file or the offset of its header in a tar file, ``change_key`` the CRC-32 of a zip
+    member or the mtime of a tar member.
+    """
+
+    archive_path: Path
+    member: str
+    position: int
+    size: int
+    change_key: int
+
+    @property
+    def name(self) -> str:
+        """Short name used in logs, like ``Path.name``."""
+        return f"{self.archive_path.name}:{self.member}"
+
+    def __str__(self) -> str:
+        """Return the archive path and member name, as shown in logs and summaries."""
+        return f"{self.archive_path}:{self.member}"
+
+    @property
+    def sequential(self) -> bool:
+        """Whether the archive is compressed as a whole, so members are best read in order."""
+        return not self.archive_path.name.lower().endswith((".zip", ".tar"))
+
+    def open(self, mode: str = "rb") -> IO[bytes]:
+        """Open the member for reading. Only binary mode is supported."""
+        if mode != "rb":
+            raise ValueError(f"Archive members can only be opened with 'rb', not '{mode}'")
+        import tarfile
+        import zipfile
+
+        archive = _open_archive(self.archive_path)
+        if isinstance(archive, zipfile.ZipFile):
+            return archive.open(self.member)
+        # Read the member's header again instead of scanning the whole archive for it
+        archive.fileobj.seek(self.position)
+        member = archive.extractfile(tarfile.TarInfo.fromtarfile(archive))
+        if member is None:
+            raise OSError(f"Not a regular file: '{self}'")
+        return member
+
+    def stat(self) -> SourceStat:
+        """Return size and change marker of the member, as stored in the archive."""
+        return SourceStat(self.size, self.change_key)
+
+
+EmailSource = Union[Path, MboxMessage, ArchiveMember]
+
+
+def read_header_block(source: EmailSource) -> bytes:
+    """Return the header lines of an email, stopping at the blank line before the body."""
+    if isinstance(source, MboxMessage):
+        return source.read_header_block()
+    lines = []
+    with source.open("rb") as f:
+        for line in f:
+            lines.append(line)
+            if not line.strip(b"\r\n"):
+                break
+    return b"".join(lines)
+
+
+def _scan_mbox(mapped: mmap.mmap, start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Find the messages between ``start`` and ``end``, which must be at a "From " line.
+
+    Returns ``(offset, length)`` pairs of the messages without their "From " separator line.
+    """
+    messages = []
+    pos = start
+    while pos < end:
+        body_start = mapped.find(b"\n", pos, end) + 1 or end
+        next_from = mapped.find(b"\nFrom ", body_start - 1, end)
+        message_end = next_from + 1 if next_from != -1 else end
+        messages.append((body_start, message_end - body_start))
+        pos = message_end
+    return messages
+
+
+class MboxIndex:
+    """
+    Persistent index of message offsets in mbox files.
+
+    The index remembers how far each mbox file was scanned. On later runs only bytes appended
+    since then are scanned, unless the file was rewritten, which is detected by comparing a
+    digest of the bytes right before the previous end of the scan. Without ``index_file``, the
+    index is only kept in memory.
+    """
+
+    def __init__(self, index_file: Optional[Path]):
+        self.index_file = index_file
+        self._entries = {}
+        if index_file is not None and index_file.exists():
+            try:
+                self._entries = json.loads(index_file.read_text())
+            except ValueError:
+                logging.warning(f"Ignoring unreadable mbox index: '{index_file}'")
+
+    @staticmethod
+    def _tail_digest(mapped: mmap.mmap, end: int) -> str:
+        return hashlib.sha256(mapped[max(0, end - TAIL_CHECK_SIZE) : end]).hexdigest()
+
+    def messages(self, mbox_path: Path) -> List[MboxMessage]:
+        """Return the messages of an mbox file, scanning only what changed since the last run."""
+        key = str(mbox_path)
+        size = mbox_path.stat().st_size
+        entry = self._entries.get(key)
+        if size == 0:
+            self._entries.pop(key, None)
+            return []
+
+        with mbox_path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if (
+                entry is not None
+                and entry["size"] <= size
+                and entry["tail"] == self._tail_digest(mm, entry["size"])
+            ):
+                if entry["size"] == size:
+                    offsets = entry["offsets"]
+                else:
+                    # The last message may have grown, so scan again from its "From " line
+                    offsets = entry["offsets"][:-1]
+                    start = entry["resume"]
+                    logging.debug(f"Scanning {size - entry['size']} new bytes of '{mbox_path}'")
+                    offsets += _scan_mbox(mm, start, size)
+                generation = entry["generation"]
+            else:
+                if mm[:5] != b"From ":
+                    logging.warning(f"Not an mbox file, ignoring: '{mbox_path}'")
+                    return []
+                logging.debug(f"Scanning mbox file: '{mbox_path}'")
+                offsets = _scan_mbox(mm, 0, size)
+                generation = entry["generation"] + 1 if entry is not None else 0
+
+            # Remember where the "From " line of the last message starts for the next scan
+            resume = mm.rfind(b"\nFrom ", 0, offsets[-1][0]) + 1 if offsets else 0
+            self._entries[key] = {
+                "size": size,
+                "tail": self._tail_digest(mm, size),
+                "generation": generation,
+                "resume": resume,
+                "offsets": [list(o) for o in offsets],
+            }
+
+        return [MboxMessage(mbox_path, offset, length, generation) for offset, length in offsets]
+
+    def save(self) -> None:
+        """Write the index to disk."""
+        if self.index_file is None:
+            return
+        self.index_file.write_text(json.dumps(self._entries))
+
+
+def is_maildir(path: Path) -> bool:
+    """Check whether a directory is a Maildir folder."""
+    return (path / "cur").is_dir() and (path / "new").is_dir()
+
+
+def maildir_messages(maildir: Path) -> List[Path]:
+    """Return the message files of a Maildir folder, delivered ones first."""
+    return sorted(p for sub in ("cur", "new") for p in (maildir / sub).iterdir() if p.is_file())
+
+
+def archive_members(archive_path: Path) -> List[ArchiveMember]:
+    """Return the .eml files in a zip or tar archive, in the order they are stored."""
+    import tarfile
+    import zipfile
+
+    try:
+        archive = _open_archive(archive_path)
+        if isinstance(archive, zipfile.ZipFile):
+            return [
+                ArchiveMember(archive_path, info.filename, i, info.file_size, info.CRC)
+                for i, info in enumerate(archive.infolist())
+                if not info.is_dir() and info.filename.lower().endswith(".eml")
+            ]
+        return [
+            ArchiveMember(archive_path, info.name, info.offset, info.size, int(info.mtime))
+            for info in archive
+            if info.isfile() and info.name.lower().endswith(".eml")
+        ]
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        logging.warning(f"Not a readable archive, ignoring: '{archive_path}': {e}")
+        return []
+
+
+def discover_sources(input_path: Path, mbox_index: MboxIndex) -> List[EmailSource]:
+    """
+    Find all emails to process.
+
+    ``input_path`` may be an mbox file, a zip or tar archive, a Maildir folder or a directory
+    containing .eml files, .mbox files, archives and Maildir folders.
+    """
+    if input_path.is_file():
+        if is_archive(input_path):
+            return list(archive_members(input_path))
+        return list(mbox_index.messages(input_path))
+    if is_maildir(input_path):
+        return list(maildir_messages(input_path))
+
+    sources: List[EmailSource] = sorted(input_path.glob("*.eml"))
+    for mbox_path in sorted(input_path.glob("*.mbox")):
+        if mbox_path.is_file():
+            sources.extend(mbox_index.messages(mbox_path))
+    for archive_path in sorted(input_path.iterdir()):
+        if archive_path.is_file() and is_archive(archive_path):
+            sources.extend(archive_members(archive_path))
+    for child in sorted(input_path.iterdir()):
+        if child.is_dir() and is_maildir(child):
+            sources.extend(maildir_messages(child))
+    return sources
+
+
+def _scan_dir(path: Path, stats: Dict[str, Tuple[int, int]], suffixes: Tuple[str, ...]) -> None:
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and (not suffixes or entry.name.endswith(suffixes)):
+                stat = entry.stat()
+                stats[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            elif suffixes and entry.is_dir() and is_maildir(Path(entry.path)):
+                for sub in ("cur", "new"):
+                    _scan_dir(Path(entry.path) / sub, stats, ())
+
+
+def snapshot_sources(input_path: Path) -> Dict[str, Tuple[int, int]]:
+    """
+    Return size and mtime of every file ``discover_sources`` would look at.
+
+    Only uses ``os.scandir`` and stat calls, so it is cheap enough to poll for changes.
+    """
+    stats: Dict[str, Tuple[int, int]] = {}
+    if input_path.is_file():
+        stat = input_path.stat()
+        stats[str(input_path)] = (stat.st_size, stat.st_mtime_ns)
+    elif is_maildir(input_path):
+        for sub in ("cur", "new"):
+            _scan_dir(input_path / sub, stats, ())
+    else:
+        _scan_dir(input_path, stats, (".eml", ".mbox", *ARCHIVE_SUFFIXES))
+    return stats
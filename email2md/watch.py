@@ -0,0 +1,224 @@
+"""Keeping the output up to date while new emails arrive."""
+
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .cache import ParseCache
+from .config import MBOX_INDEX_FILE_NAME
+from .email_processor import DEFAULT_PLAN, EmailProcessor, ExtractionPlan
+from .image_processing import DEFAULT_IMAGE_OPTIONS, ImageOptions
+from .markdown_generator import MarkdownGenerator
+from .prescan import drop_duplicates, prescan
+from .records import BodyStore, EmailRecord
+from .search import SearchIndex
+from .shards import source_key
+from .sources import EmailSource, MboxIndex, discover_sources, snapshot_sources
+from .writer import BackgroundWriter
+
+
+class Watcher:
+    """
+    Keep the Markdown output up to date while new emails arrive.
+
+    Parsed emails and the day groups of the ``MarkdownGenerator`` stay in memory between
+    updates, so only new or changed emails are processed. The input is polled with cheap
+    ``os.scandir`` stat comparisons; an update starts once the input has been quiet for
+    ``debounce`` seconds, and output files are replaced atomically. Like a normal run, only
+    emails sent on the days from ``since`` to ``until`` are included, see ``prescan``.
+    """
+
+    def __init__(
+        self,
+        input_path: Path,
+        images_dir: Path,
+        targets: List[Tuple[Path, bool, bool]],
+        plan: ExtractionPlan = DEFAULT_PLAN,
+        jobs: int = 1,
+        cache: Optional[ParseCache] = None,
+        interval: float = 2.0,
+        debounce: float = 1.0,
+        split: Optional[str] = None,
+        image_options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+        image_jobs: int = 1,
+        writer: Optional[BackgroundWriter] = None,
+        search_index: Optional[SearchIndex] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ):
+        self.input_path = input_path
+        self.images_dir = images_dir
+        self.targets = targets
+        self.plan = plan
+        self.jobs = jobs
+        self.cache = cache
+        self.interval = interval
+        self.debounce = debounce
+        self.split = split
+        self.image_options = image_options
+        self.image_jobs = image_jobs
+        self.writer = writer
+        self.search_index = search_index
+        self.since = since
+        self.until = until
+        # Whether the search index was brought up to date with all emails once
+        self.indexed = False
+
+        output_file = targets[0][0]
+        self.mbox_index = MboxIndex(output_file.parent / MBOX_INDEX_FILE_NAME)
+        self.markdown_gen = MarkdownGenerator(
+            images_dir,
+            output_file,
+            thumbnails=image_options.thumbnail_size is not None,
+            writer=writer,
+        )
+        self.emails: Dict[EmailSource, EmailRecord] = {}
+        self.bodies = BodyStore()
+        self.failed: Dict[EmailSource, Optional[Tuple[int, int]]] = {}
+        # Size and mtime of .eml and Maildir files when they were processed
+        self.seen: Dict[EmailSource, Optional[Tuple[int, int]]] = {}
+        # Copies of other emails with their size and mtime, and the keys of the emails they
+        # were compared to, see ``drop_duplicates``
+        self.duplicates: Dict[EmailSource, Optional[Tuple[int, int]]] = {}
+        self.dedupe_keys: Dict[Tuple, EmailSource] = {}
+        # Emails sent outside of the date range with their size and mtime
+        self.out_of_range: Dict[EmailSource, Optional[Tuple[int, int]]] = {}
+        # The state of the input the last update worked from
+        self.snapshot: Dict[str, Tuple[int, int]] = {}
+
+    def update(self) -> bool:
+        """Process new and changed emails and rewrite the output. Returns False if idle."""
+        snapshot = self.snapshot = snapshot_sources(self.input_path)
+        sources = discover_sources(self.input_path, self.mbox_index)
+        self.mbox_index.save()
+
+        def changed(source: EmailSource, seen: Dict) -> bool:
+            # mbox messages get a new identity when they change, files are compared by stat
+            return isinstance(source, Path) and snapshot.get(str(source)) != seen.get(source)
+
+        current = set(sources)
+        stale = [s for s in self.emails if s not in current or changed(s, self.seen)]
+        for source in stale:
+            self.markdown_gen.remove_chapter(self.emails.pop(source))
+            self.seen.pop(source, None)
+        self.failed = {s: stat for s, stat in self.failed.items() if s in current}
+        self.out_of_range = {s: stat for s, stat in self.out_of_range.items() if s in current}
+        # Once an email is gone or changed, a copy of it may be the first one now
+        self.duplicates = {
+            s: stat for s, stat in self.duplicates.items() if s in current and not stale
+        }
+        new = [
+            s
+            for s in sources
+            if s not in self.emails
+            and (s not in self.failed or changed(s, self.failed))
+            and (s not in self.duplicates or changed(s, self.duplicates))
+            and (s not in self.out_of_range or changed(s, self.out_of_range))
+        ]
+        if not stale and not new:
+            return False
+
+        processor = EmailProcessor(
+            self.cache,
+            image_options=self.image_options,
+            image_jobs=self.image_jobs,
+            bodies=self.bodies,
+            writer=self.writer,
+        )
+        # New emails are compared to each other and to the emails already in the output
+        reprocessed = set(new)
+        self.dedupe_keys = {
+            key: s for key, s in self.dedupe_keys.items() if s in current and s not in reprocessed
+        }
+        scanned = prescan(
+            new, since=self.since, until=self.until, metrics=processor.stats.metrics
+        )
+        in_range = {entry.source for entry in scanned}
+        for source in new:
+            if source not in in_range:
+                stat = snapshot.get(str(source)) if isinstance(source, Path) else None
+                self.out_of_range[source] = stat
+                self.failed.pop(source, None)
+        headers, duplicates = drop_duplicates(
+            scanned, metrics=processor.stats.metrics, seen=self.dedupe_keys
+        )
+        for entry in duplicates:
+            source = entry.source
+            stat = snapshot.get(str(source)) if isinstance(source, Path) else None
+            self.duplicates[source] = stat
+            self.failed.pop(source, None)
+        processor.stats.duplicate_files.extend(entry.source for entry in duplicates)
+        new = [entry.source for entry in headers]
+        emails, failed_files = processor.process_sources(
+            new, self.images_dir, jobs=self.jobs, plan=self.plan
+        )
+        for source in new:
+            stat = snapshot.get(str(source)) if isinstance(source, Path) else None
+            if source in emails:
+                self.emails[source] = emails[source]
+                self.seen[source] = stat
+                self.failed.pop(source, None)
+                self.markdown_gen.add_chapter(emails[source])
+            else:
+                self.failed[source] = stat
+
+        if self.emails and self.split:
+            self.markdown_gen.write_split(self.targets, self.split, jobs=self.jobs, atomic=True)
+        elif self.emails:
+            self.markdown_gen.write_incremental(self.targets, atomic=True)
+        if self.writer is not None:
+            processor.stats.failed_writes.extend(self.writer.flush())
+        if self.search_index is not None:
+            self._update_search_index(self.search_index, emails, stale)
+        removed = len([s for s in stale if s not in emails])
+        logging.info(
+            f"Updated output: {len(emails)} new or changed, {removed} removed, "
+            f"{len(failed_files)} failed, {len(duplicates)} duplicates skipped, "
+            f"{len(self.emails)} emails in total"
+        )
+        if processor.stats.failed_writes:
+            logging.error(f"Failed to write {len(processor.stats.failed_writes)} files")
+        return True
+
+    def _update_search_index(
+        self,
+        search_index: SearchIndex,
+        emails: Dict[EmailSource, EmailRecord],
+        stale: List[EmailSource],
+    ) -> None:
+        """Index new and changed emails, and remove the ones that are gone."""
+        if self.indexed:
+            search_index.update(
+                [(source_key(s, self.input_path), record) for s, record in emails.items()],
+                complete=False,
+            )
+            search_index.remove(
+                source_key(s, self.input_path) for s in stale if s not in emails
+            )
+        else:
+            # Also removes emails that were deleted while nobody was watching
+            search_index.update(
+                [(source_key(s, self.input_path), record) for s, record in self.emails.items()]
+            )
+            self.indexed = True
+
+    def run(self) -> None:
+        """Update the output now and then whenever the input changes, until interrupted."""
+        self.update()
+        # Compared to the snapshot the update worked from, emails that arrived while it ran
+        # start the next update
+        last_snapshot = self.snapshot
+        changed_at = None
+        logging.info(f"Watching '{self.input_path}' for changes, press Ctrl+C to stop")
+        while True:
+            time.sleep(self.interval)
+            snapshot = snapshot_sources(self.input_path)
+            if snapshot != last_snapshot:
+                # Wait until a burst of arrivals is over
+                last_snapshot = snapshot
+                changed_at = time.monotonic()
+            elif changed_at is not None and time.monotonic() - changed_at >= self.debounce:
+                changed_at = None
+                self.update()
+                last_snapshot = self.snapshot
@@ -0,0 +1,171 @@
+"""Writing files in background threads."""
+
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Iterable, List, Optional, Set, Union
+
+from .config import WRITE_QUEUE_SIZE, WRITE_THREADS
+
+
+class BackgroundWriter:
+    """
+    Writes files in a few background threads, so writing overlaps with parsing.
+
+    At most ``queue_size`` writes wait at a time; queueing another one blocks until a write is
+    done, so memory use stays bounded when the disk is slower than parsing. Directories are
+    created once per writer. Failed writes are logged and returned by the next ``flush``. Used as
+    a context manager, the writer is closed on exit and raises ``OSError`` if files failed to
+    write since the last ``flush``.
+    """
+
+    def __init__(self, threads: int = WRITE_THREADS, queue_size: int = WRITE_QUEUE_SIZE):
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="email2md-writer")
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._pending: Set[Future] = set()
+        self._failures: List[str] = []
+        self._dirs: Set[Path] = set()
+        # Files queued by ``write_bytes``, which are skipped when queued again
+        self._files: Set[Path] = set()
+
+    def submit(self, target: Union[Path, str], fn: Callable, *args) -> None:
+        """Run ``fn(*args)`` in the background. If it fails, ``target`` is reported."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda done: self._done(done, target))
+
+    def _done(self, future: Future, target: Union[Path, str]) -> None:
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Failed to write '{target}': {error}")
+        with self._lock:
+            self._pending.discard(future)
+            if error is not None:
+                self._failures.append(str(target))
+
+    def makedirs(self, path: Path) -> None:
+        """Create a directory and its parents, unless this writer did so already."""
+        if path in self._dirs:
+            return
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._dirs.add(path)
+
+    def write_bytes(self, path: Path, data: bytes) -> bool:
+        """
+        Queue writing ``data`` to a new file at ``path``, which appears once complete.
+
+        Returns False without writing anything if the file exists or was queued before.
+        """
+        if path in self._files or path.exists():
+            return False
+        self._files.add(path)
+        self.submit(path, self._write_file, path, data)
+        return True
+
+    def _write_file(self, path: Path, data: bytes) -> None:
+        self.makedirs(path.parent)
+        tmp = path.with_name(f".tmp-{os.getpid()}-{os.urandom(16).hex()}")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def stream(self, f, name: Union[Path, str]) -> "BackgroundStream":
+        """Wrap an open file so that writes to it happen in the background."""
+        return BackgroundStream(self, f, name)
+
+    def flush(self) -> List[str]:
+        """Wait for all queued writes. Returns the files that failed since the last flush."""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            for future in pending:
+                # Errors were already recorded by ``_done``
+                future.exception()
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def close(self) -> List[str]:
+        """Flush and stop the threads. Returns the files that failed since the last flush."""
+        failures = self.flush()
+        self._executor.shutdown()
+        return failures
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Close the writer, see the class docstring."""
+        failures = self.close()
+        if failures and exc_type is None:
+            raise OSError(f"Failed to write {len(failures)} files: {', '.join(failures)}")
+
+
+class BackgroundStream:
+    """
+    File wrapper whose writes are queued on a ``BackgroundWriter``, keeping their order.
+
+    ``close`` writes what is still queued and raises the first error of a background write, so a
+    file is never silently left incomplete.
+    """
+
+    def __init__(self, writer: BackgroundWriter, f, name: Union[Path, str]):
+        self._writer = writer
+        self._f = f
+        self._name = name
+        self._chunks: Deque = deque()
+        # Held while writing, so queued chunks are written one after another in order
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+
+    def write(self, data) -> int:
+        """Queue ``data`` to be written after everything queued before."""
+        self._chunks.append(data)
+        self._writer.submit(self._name, self._drain)
+        return len(data)
+
+    def writelines(self, lines: Iterable) -> None:
+        """Queue the lines to be written, like ``write``."""
+        for line in lines:
+            self.write(line)
+
+    def _drain(self) -> None:
+        with self._lock:
+            try:
+                while self._chunks:
+                    self._f.write(self._chunks.popleft())
+            except BaseException as e:
+                self._error = self._error or e
+                raise
+
+    def close(self) -> None:
+        """Write what is still queued and close the file."""
+        try:
+            self._drain()
+        finally:
+            self._f.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> "BackgroundStream":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
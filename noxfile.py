@@ -1,6 +1,7 @@
-import nox
 import os
 
+import nox
+
 # Force nox to use UV and set Python version preference
 nox.options.default_venv_backend = "uv"
 os.environ["UV_PYTHON_VERSION"] = "3.11"
@@ -49,6 +50,20 @@ def coverage(session):
     session.run("pytest", "--cov")
 
 
+@nox.session(venv_backend="uv")
+def bench(session):
+    """Run the benchmarks, e.g. `nox -s bench -- --compare baseline.json`."""
+    install_with_uv(session, ".")
+    session.run("python", "benchmarks/run.py", *session.posargs)
+
+
+@nox.session(venv_backend="uv")
+def bench_startup(session):
+    """Check the startup time of `email2md --help` and of a run on 10 messages."""
+    install_with_uv(session, ".")
+    session.run("python", "benchmarks/bench_startup.py", *session.posargs)
+
+
 @nox.session(venv_backend="uv")
 def build(session):
     """Build package distributions."""
@@ -1,12 +1,16 @@
-from setuptools import setup, find_packages
+from setuptools import find_packages, setup
 
 setup(
     name="email2md",
     version="0.1",
     packages=find_packages(),
     install_requires=[
-        "pytz",
+        "pytz; python_version < '3.9'",
+        "tzdata; sys_platform == 'win32'",
     ],
+    extras_require={
+        "images": ["Pillow>=9.1"],
+    },
     entry_points={
         "console_scripts": [
             "email2md=email2md.cli:main",
@@ -0,0 +1,56 @@
+"""Shared fixtures: small email collections written to a temporary directory."""
+
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import pytest
+
+
+def make_email(
+    subject: str,
+    date: Optional[datetime],
+    body: str = "",
+    images: Tuple[Tuple[str, bytes], ...] = (),
+    message_id: Optional[str] = None,
+) -> bytes:
+    """Return the bytes of an email with a text body and image attachments."""
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    if date is not None:
+        msg["Date"] = format_datetime(date)
+    if message_id is not None:
+        msg["Message-ID"] = message_id
+    msg.set_content(body or "\n")
+    for name, data in images:
+        msg.add_attachment(data, maintype="image", subtype="jpeg", filename=name)
+    return bytes(msg)
+
+
+@pytest.fixture
+def corpus(tmp_path: Path) -> Path:
+    """Write 30 emails over 12 days, with shared and colliding image names, and return the dir."""
+    # Emails are written in an order unrelated to their dates, some share a day and some have
+    # images with the same name but different content
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    start = datetime(2024, 1, 1, 8, tzinfo=timezone.utc)
+    for i in range(30):
+        date = start + timedelta(hours=(i * 37) % 280)
+        images: List[Tuple[str, bytes]] = []
+        if i % 3 == 0:
+            images.append(("photo.jpg", f"photo {i % 4}".encode() * 50))
+        if i % 5 == 0:
+            images.append(("shared.jpg", b"the same image" * 50))
+        (input_dir / f"m{i:02d}.eml").write_bytes(
+            make_email(
+                f"Subject {i}",
+                date,
+                f"Body of email {i}\nwith a second line",
+                tuple(images),
+                message_id=f"<{i}@example.com>",
+            )
+        )
+    return input_dir
@@ -0,0 +1,82 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from email2md import aiter_emails, awrite_markdown, cli, iter_emails, write_markdown
+from email2md.config import IMAGES_DIR_NAME
+
+
+def _cli_output(monkeypatch, corpus: Path, out_dir: Path) -> str:
+    output = out_dir / "out.md"
+    monkeypatch.setattr(sys, "argv", ["email2md", "-i", str(corpus), "-o", str(output), "--all"])
+    cli.main()
+    return output.read_text(encoding="utf-8")
+
+
+async def _async_markdown(
+    corpus: Path, images_dir: Path, executor: Optional[ThreadPoolExecutor]
+) -> str:
+    stream = io.StringIO()
+    emails = aiter_emails(corpus, images_dir, concurrency=3, executor=executor)
+    assert await awrite_markdown(emails, stream, images_dir) == 30
+    return stream.getvalue()
+
+
+def test_written_markdown_matches_command_line(monkeypatch, corpus: Path, tmp_path: Path):
+    expected = _cli_output(monkeypatch, corpus, tmp_path / "cli")
+    images_dir = tmp_path / "api" / IMAGES_DIR_NAME
+    stream = io.StringIO()
+    assert write_markdown(iter_emails(corpus, images_dir), stream, images_dir) == 30
+    assert stream.getvalue() == expected
+    cli_images = sorted(p.name for p in (tmp_path / "cli" / IMAGES_DIR_NAME).rglob("*.jpg"))
+    assert sorted(p.name for p in images_dir.rglob("*.jpg")) == cli_images
+
+
+@pytest.mark.parametrize("threads", [0, 4])
+def test_async_api_matches_sync_api(corpus: Path, tmp_path: Path, threads: int):
+    images_dir = tmp_path / "sync" / IMAGES_DIR_NAME
+    stream = io.StringIO()
+    write_markdown(iter_emails(corpus, images_dir), stream, images_dir)
+
+    async_dir = tmp_path / "async" / IMAGES_DIR_NAME
+    if threads:
+        with ThreadPoolExecutor(threads) as executor:
+            markdown = asyncio.run(_async_markdown(corpus, async_dir, executor))
+    else:
+        markdown = asyncio.run(_async_markdown(corpus, async_dir, None))
+    assert markdown == stream.getvalue()
+    assert sorted(p.relative_to(async_dir) for p in async_dir.rglob("*.jpg")) == sorted(
+        p.relative_to(images_dir) for p in images_dir.rglob("*.jpg")
+    )
+
+
+def test_iterating_without_images_dir_skips_images(corpus: Path):
+    records = list(iter_emails(corpus, since="2024-01-03", until="2024-01-05"))
+    assert records and all(not record.images for record in records)
+    assert all("2024-01-03" <= f"{record.date:%Y-%m-%d}" <= "2024-01-05" for record in records)
+    assert [r.date for r in records] == sorted(r.date for r in records)
+
+
+def test_records_out_of_order_are_rejected(corpus: Path):
+    records = list(iter_emails(corpus))
+    with pytest.raises(ValueError, match="chronological order"):
+        write_markdown(reversed(records), io.StringIO())
+
+
+def test_closing_async_iterator_early_cancels_pending_emails(corpus: Path):
+    async def first_two() -> int:
+        emails = aiter_emails(corpus, concurrency=4)
+        count = 0
+        async for _ in emails:
+            count += 1
+            if count == 2:
+                break
+        await emails.aclose()
+        return count
+
+    assert asyncio.run(first_two()) == 2
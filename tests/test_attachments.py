@@ -0,0 +1,58 @@
+import base64
+from email.message import EmailMessage
+from pathlib import Path
+
+import pytest
+
+from email2md import attachments
+from email2md.attachments import ImageStore
+
+
+def _image_part(data: bytes) -> EmailMessage:
+    msg = EmailMessage()
+    msg.set_content("text")
+    msg.add_attachment(data, maintype="image", subtype="jpeg", filename="a.jpg")
+    return next(part for part in msg.iter_attachments())
+
+
+@pytest.mark.parametrize("chunk_size", [5, 76, 1 << 20])
+def test_streamed_decode_matches_in_memory_decode(tmp_path: Path, monkeypatch, chunk_size: int):
+    monkeypatch.setattr(attachments, "BASE64_CHUNK_SIZE", chunk_size)
+    data = bytes(range(256)) * 40 + b"odd"
+    part = _image_part(data)
+    streamed = ImageStore(tmp_path / "streamed", stream_threshold=0).save("a.jpg", part, "2024")
+    in_memory = ImageStore(tmp_path / "memory").save("a.jpg", part, "2024")
+    assert streamed is not None and in_memory is not None
+    assert streamed.read_bytes() == in_memory.read_bytes() == data
+
+
+def test_streamed_decode_falls_back_for_broken_padding(tmp_path: Path):
+    part = _image_part(b"x")
+    # Missing padding among invalid characters, which only the email package tolerates
+    part.set_payload(base64.b64encode(b"image data").decode().rstrip("=") + "!!\n")
+    path = ImageStore(tmp_path, stream_threshold=0).save("a.jpg", part, "2024")
+    assert path is not None and path.read_bytes() == b"image data"
+
+
+def test_identical_images_are_stored_once(tmp_path: Path):
+    store = ImageStore(tmp_path)
+    first = store.save("a.jpg", b"same image", "2024-01-02")
+    assert store.save("a.jpg", b"same image", "2024-01-02") == first
+    other_day = store.save("b.jpg", b"same image", "2024-01-03")
+    assert first is not None and other_day is not None
+    assert first.samefile(other_day)
+    assert len(list(store.blobs_dir.iterdir())) == 1
+    assert store.bytes_written == len(b"same image")
+
+
+def test_name_collisions_get_a_hash_suffix(tmp_path: Path):
+    store = ImageStore(tmp_path)
+    first = store.save("a.jpg", b"first image", "2024-01-02")
+    second = store.save("a.jpg", b"second image", "2024-01-02")
+    assert first == tmp_path / "2024-01-02" / "a.jpg"
+    assert second is not None and second.parent == first.parent
+    assert second.name.startswith("a-") and second.suffix == ".jpg"
+    # Saving again finds both images under the names they got first
+    assert store.save("a.jpg", b"second image", "2024-01-02") == second
+    assert store.save("a.jpg", b"first image", "2024-01-02") == first
+    assert (first.read_bytes(), second.read_bytes()) == (b"first image", b"second image")
@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from email2md.cache import ParseCache
+from email2md.email_processor import EmailProcessor
+from email2md.image_processing import ImageOptions
+
+
+def _convert(corpus: Path, tmp_path: Path, image_options: Optional[ImageOptions] = None):
+    images_dir = tmp_path / "out" / ".images"
+    cache = ParseCache(tmp_path / "cache.sqlite", images_dir, image_options=image_options)
+    try:
+        processor = EmailProcessor(cache, image_options=image_options or ImageOptions())
+        results, failed = processor.process_sources(sorted(corpus.iterdir()), images_dir)
+    finally:
+        cache.close()
+    assert not failed
+    return results, cache
+
+
+def test_unchanged_emails_are_taken_from_the_cache(corpus: Path, tmp_path: Path):
+    first, cache = _convert(corpus, tmp_path)
+    assert (cache.hits, cache.misses) == (0, 30)
+
+    (corpus / "m03.eml").write_bytes((corpus / "m03.eml").read_bytes() + b"\nmore text\n")
+    second, cache = _convert(corpus, tmp_path)
+    assert (cache.hits, cache.misses) == (29, 1)
+    for source, record in first.items():
+        assert second[source].images == record.images
+        assert second[source].subject == record.subject
+
+
+def test_changed_image_options_invalidate_the_cache(corpus: Path, tmp_path: Path):
+    pytest.importorskip("PIL")
+    _convert(corpus, tmp_path)
+    _, cache = _convert(corpus, tmp_path, ImageOptions(max_size=1000))
+    assert (cache.hits, cache.misses) == (0, 30)
+    _, cache = _convert(corpus, tmp_path, ImageOptions(max_size=1000))
+    assert (cache.hits, cache.misses) == (30, 0)
@@ -0,0 +1,150 @@
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from conftest import make_email
+
+from email2md import cli, config, markdown_generator
+from email2md.config import IMAGES_DIR_NAME
+from email2md.email_processor import EmailProcessor
+from email2md.records import BodyStore
+from email2md.search import SearchIndex
+
+
+def _run(monkeypatch, *args: str) -> None:
+    monkeypatch.setattr(sys, "argv", ["email2md", *args])
+    cli.main()
+
+
+def _outputs(out_dir: Path) -> Dict[str, bytes]:
+    """Return the Markdown files and linked images, without caches, indexes and blobs."""
+    files = {p.name: p.read_bytes() for p in out_dir.glob("*.md")}
+    for path in (out_dir / IMAGES_DIR_NAME).rglob("*"):
+        relative = path.relative_to(out_dir)
+        if path.is_file() and ".blobs" not in relative.parts:
+            files[str(relative)] = path.read_bytes()
+    return files
+
+
+def _convert(monkeypatch, corpus: Path, out_dir: Path, *args: str) -> Dict[str, bytes]:
+    _run(monkeypatch, "-i", str(corpus), "-o", str(out_dir / "out.md"), "--all", *args)
+    return _outputs(out_dir)
+
+
+def test_parallel_output_matches_serial(monkeypatch, corpus: Path, tmp_path: Path):
+    serial = _convert(monkeypatch, corpus, tmp_path / "serial")
+    assert len(serial) > 3
+    assert _convert(monkeypatch, corpus, tmp_path / "parallel", "-j", "3") == serial
+
+
+def test_incremental_output_matches_full_render(monkeypatch, corpus: Path, tmp_path: Path):
+    out_dir = tmp_path / "out"
+    _convert(monkeypatch, corpus, out_dir)
+
+    # An email in the middle, one after the last, a removed one and a changed one
+    for name, day in (("mid.eml", 3), ("late.eml", 30)):
+        date = datetime(2024, 1, day, 10, tzinfo=timezone.utc)
+        (corpus / name).write_bytes(make_email(name, date, f"Body of {name}"))
+    (corpus / "m05.eml").unlink()
+    (corpus / "m08.eml").write_bytes((corpus / "m08.eml").read_bytes() + b"\nmore text\n")
+
+    incremental = _convert(monkeypatch, corpus, out_dir)
+    full = _convert(monkeypatch, corpus, tmp_path / "full", "--no-cache")
+    assert b"Body of mid.eml" in incremental["out.md"]
+    # Images of removed emails are left in place, so only the Markdown has to match
+    markdown = ("out.md", "out_txt.md", "out_img.md")
+    assert [incremental[name] for name in markdown] == [full[name] for name in markdown]
+    assert set(full) <= set(incremental)
+
+
+def test_changed_render_settings_rerender_all_chapters(monkeypatch, corpus: Path, tmp_path: Path):
+    _convert(monkeypatch, corpus, tmp_path / "out")
+    monkeypatch.setattr(markdown_generator, "DATE_FORMAT_FILENAME", "%d.%m.%Y")
+    updated = _convert(monkeypatch, corpus, tmp_path / "out")
+    assert b"2024-01-01 " not in updated["out.md"]
+    assert updated == _convert(monkeypatch, corpus, tmp_path / "full", "--no-cache")
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_output_without_cache_is_parsed_one_day_at_a_time(
+    monkeypatch, corpus: Path, tmp_path: Path, jobs: str
+):
+    single = _convert(monkeypatch, corpus, tmp_path / "single")
+    batches = []
+    process_sources = EmailProcessor.process_sources
+
+    def spy(self, sources, *args, **kwargs):
+        results, failed = process_sources(self, sources, *args, **kwargs)
+        batches.append({record.date.date() for record in results.values()})
+        return results, failed
+
+    # Every day is larger than the batch size, so each batch is a single day
+    monkeypatch.setattr(config, "PARSE_BATCH_SIZE", 1)
+    monkeypatch.setattr(EmailProcessor, "process_sources", spy)
+    batched = _convert(monkeypatch, corpus, tmp_path / "batched", "--no-cache", "-j", jobs)
+    assert batched == single
+    assert len(batches) == 12 and all(len(days) == 1 for days in batches)
+
+
+def test_search_index_is_updated_one_day_at_a_time(monkeypatch, corpus: Path, tmp_path: Path):
+    out_dir = tmp_path / "out"
+    _convert(monkeypatch, corpus, out_dir, "--search-index")
+    (corpus / "m05.eml").unlink()
+    monkeypatch.setattr(config, "PARSE_BATCH_SIZE", 1)
+    _convert(monkeypatch, corpus, out_dir, "--search-index", "--no-cache")
+
+    index = SearchIndex(out_dir / config.SEARCH_INDEX_FILE_NAME)
+    try:
+        assert [hit.subject for hit in index.search('"Subject 5"')] == []
+        assert [hit.subject for hit in index.search('"Subject 6"')] == ["Subject 6"]
+    finally:
+        index.close()
+
+
+@pytest.mark.parametrize("args", [[], ["-j", "2", "--split", "month"]])
+def test_spilled_bodies_give_the_same_output(monkeypatch, corpus: Path, tmp_path: Path, args):
+    in_memory = _convert(monkeypatch, corpus, tmp_path / "memory", *args)
+    # No memory budget at all, every body is written to the file and read back
+    monkeypatch.setattr(BodyStore.__init__, "__defaults__", (0,))
+    spilled = _convert(monkeypatch, corpus, tmp_path / "spilled", *args)
+    assert spilled == in_memory
+
+def test_merged_shards_match_single_run(monkeypatch, corpus: Path, tmp_path: Path):
+    single = _convert(monkeypatch, corpus, tmp_path / "single")
+    output = tmp_path / "sharded" / "out.md"
+    for i in (1, 2, 3):
+        _run(monkeypatch, "-i", str(corpus), "-o", str(output), "--all", "--shard", f"{i}/3")
+    assert not list(output.parent.glob("*.md"))
+
+    shard_files = sorted(str(p) for p in output.parent.glob("out.shard-*"))
+    assert len(shard_files) == 3
+    _run(monkeypatch, "-o", str(output), "--all", "merge", *shard_files)
+    assert _outputs(output.parent) == single
+
+
+def test_split_output_matches_single_file(monkeypatch, corpus: Path, tmp_path: Path):
+    single = _convert(monkeypatch, corpus, tmp_path / "single")
+    split = _convert(monkeypatch, corpus, tmp_path / "split", "--split", "month")
+    parts = sorted((tmp_path / "split" / "out").glob("*.md"))
+    assert parts
+    assert b"".join(p.read_bytes() for p in parts).count(b"Body of email") == 30
+    assert {k: v for k, v in split.items() if not k.endswith(".md")} == {
+        k: v for k, v in single.items() if not k.endswith(".md")
+    }
+
+
+@pytest.mark.parametrize("split", [[], ["--split", "month"]])
+def test_search_prints_chapters(monkeypatch, capsys, corpus: Path, tmp_path: Path, split):
+    output = tmp_path / "out" / "out.md"
+    _convert(monkeypatch, corpus, output.parent, "--search-index", *split)
+    capsys.readouterr()
+    _run(monkeypatch, "-o", str(output), "search", '"email 5"')
+
+    lines = capsys.readouterr().out.splitlines()
+    path = output.parent / "out" / "2024-01.md" if split else output
+    assert lines[0].startswith(f"{path}: ## ")
+    # The heading is the one in the Markdown, followed by the matching email
+    assert lines[0][len(f"{path}: ") :] in path.read_text(encoding="utf-8").splitlines()
+    assert lines[1].endswith(" -- Subject 5")
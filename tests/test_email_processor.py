@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from conftest import make_email
+
+from email2md.email_processor import EmailProcessor, ExtractionPlan
+
+DATE = "Date: Tue, 02 Jan 2024 10:00:00 +0000\n"
+
+# Text only inside a nested multipart, which isn't extracted
+NESTED_TEXT = (
+    DATE + "Subject: nested\nMIME-Version: 1.0\n"
+    'Content-Type: multipart/mixed; boundary="outer"\n\n'
+    "--outer\n"
+    'Content-Type: multipart/related; boundary="inner"\n\n'
+    "--inner\n"
+    "Content-Type: text/plain; charset=utf-8\n\n"
+    "hidden text\n"
+    "--inner--\n"
+    "--outer--\n"
+).encode()
+
+# A text part without charset, which isn't decoded
+NO_CHARSET = (
+    DATE + "Subject: no charset\nMIME-Version: 1.0\n"
+    'Content-Type: multipart/mixed; boundary="b"\n\n'
+    "--b\n"
+    "Content-Type: text/plain\n\n"
+    "text without charset\n"
+    "--b--\n"
+).encode()
+
+# A message that is a single image, which isn't saved
+SINGLE_IMAGE = (
+    DATE + "Subject: image\nMIME-Version: 1.0\n"
+    'Content-Type: image/jpeg; name="a.jpg"\n'
+    'Content-Disposition: attachment; filename="a.jpg"\n'
+    "Content-Transfer-Encoding: base64\n\n"
+    "aW1hZ2U=\n"
+).encode()
+
+WITH_IMAGE = make_email(
+    "with image",
+    datetime(2024, 1, 2, 10, tzinfo=timezone.utc),
+    "Some text",
+    (("photo.jpg", b"image data"),),
+)
+
+
+@pytest.mark.parametrize("plan", [ExtractionPlan(text=False), ExtractionPlan(images=False)])
+@pytest.mark.parametrize("data", [NESTED_TEXT, NO_CHARSET, SINGLE_IMAGE, WITH_IMAGE])
+def test_skipped_parts_give_the_same_statistics(tmp_path: Path, plan, data: bytes):
+    path = tmp_path / "mail.eml"
+    path.write_bytes(data)
+    full = EmailProcessor()
+    full.process_email(path, tmp_path / "full")
+    skipped = EmailProcessor()
+    skipped.process_email(path, tmp_path / "skipped", plan)
+    assert skipped.stats.no_text_files == full.stats.no_text_files
+    assert skipped.stats.no_images_files == full.stats.no_images_files
+    assert skipped.stats.no_content_files == full.stats.no_content_files
+
+
+def test_plan_skips_text_or_images(tmp_path: Path):
+    path = tmp_path / "mail.eml"
+    path.write_bytes(WITH_IMAGE)
+    processor = EmailProcessor()
+    record = processor.process_email(path, tmp_path / "images", ExtractionPlan(text=False))
+    assert (record.body, record.images) == ("", ["images/2024-01-02/photo.jpg"])
+    record = processor.process_email(path, tmp_path / "images", ExtractionPlan(images=False))
+    assert (record.body, record.images) == ("Some text", [])
@@ -0,0 +1,25 @@
+import pytest
+
+from email2md.html_utils import html_to_text
+
+
+@pytest.mark.parametrize(
+    "html, text",
+    [
+        ("<p>Hello <b>world</b></p><p>Second</p>", "Hello world\n\nSecond"),
+        ("<div>one</div><div>two</div>", "one\ntwo"),
+        ("line<br>break<br><br>after empty line", "line\nbreak\n\nafter empty line"),
+        ("<head><title>T</title><style>p {}</style></head><p>Body</p>", "Body"),
+        ("<script>if (a < b) { x = '</p>' }</script>Text", "Text"),
+        ("<p>Fish &amp; chips &lt;3&gt;</p>", "Fish & chips <3>"),
+        ("<p>  many    spaces\n and\tlines </p>", "many spaces and lines"),
+        ("<pre>keep   spaces\n\nand lines</pre>", "keep   spaces\n\nand lines"),
+        ('<a href="x>y" title=\'a>b\'>link</a>', "link"),
+        ("<table><tr><td>a</td><td>b</td></tr><tr><td>c</td></tr></table>", "a b\nc"),
+        ("<!-- <p>comment</p> --><!DOCTYPE html>Visible", "Visible"),
+        ("Text<style>never closed", "Text"),
+        ("<P>Upper</P><DIV>case</DIV>", "Upper\n\ncase"),
+    ],
+)
+def test_html_to_text(html: str, text: str):
+    assert html_to_text(html) == text
@@ -0,0 +1,62 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from email2md.attachments import ImageStore, thumbnail_path
+from email2md.image_processing import ImageOptions, process_images
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _jpeg(size: int) -> bytes:
+    buffer = BytesIO()
+    # Noise doesn't compress, so a smaller version is always smaller in bytes
+    Image.effect_noise((size, size), 64).convert("RGB").save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def _size(path: Path) -> int:
+    with Image.open(path) as image:
+        return max(image.size)
+
+
+def _link(tmp_path: Path, data: bytes, options: ImageOptions) -> Path:
+    """Store, process and link an image like a run with ``options`` does."""
+    image = ImageStore(tmp_path).store("photo.jpg", data, "2024-01-02")
+    assert image is not None
+    process_images([image], tmp_path, options)
+    return ImageStore(tmp_path, variant=options.blob_suffix).link(image)
+
+
+def test_processing_keeps_the_original(tmp_path: Path):
+    data = _jpeg(400)
+    options = ImageOptions(max_size=100, thumbnail_size=20)
+    linked = _link(tmp_path, data, options)
+    assert _size(linked) == 100 and _size(thumbnail_path(linked)) == 20
+    assert [p.read_bytes() for p in (tmp_path / ".blobs").glob("*") if p.name.isalnum()] == [data]
+
+    # Other options link their own version, no options the original
+    assert _size(_link(tmp_path, data, ImageOptions(max_size=200))) == 200
+    assert _link(tmp_path, data, ImageOptions()).read_bytes() == data
+    assert _size(_link(tmp_path, data, options)) == 100
+
+
+def test_processed_images_are_skipped(tmp_path: Path, caplog):
+    data = _jpeg(200)
+    options = ImageOptions(max_size=50)
+    _link(tmp_path, data, options)
+    caplog.set_level("INFO")
+    _link(tmp_path, data, options)
+    assert "Processed 0 images (1 already done)" in caplog.text
+
+
+def test_larger_results_and_other_files_are_not_used(tmp_path: Path):
+    # Re-encoding at a higher quality makes the image larger
+    buffer = BytesIO()
+    Image.effect_noise((100, 100), 64).convert("RGB").save(buffer, format="JPEG", quality=30)
+    data = buffer.getvalue()
+    assert _link(tmp_path, data, ImageOptions(quality=95)).read_bytes() == data
+    assert _link(tmp_path / "other", b"not an image", ImageOptions(max_size=10)).read_bytes() == (
+        b"not an image"
+    )
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+from conftest import make_email
+
+from email2md.email_processor import EmailProcessor
+from email2md.metrics import Metrics
+
+
+def test_merge_adds_stages_and_files():
+    metrics = Metrics()
+    metrics.add("parse", 1.0, bytes_in=100)
+    metrics.add_file("a.eml", 1.0, bytes_in=100, bytes_out=10)
+    other = Metrics()
+    other.add("parse", 0.5, bytes_in=50)
+    other.add("text", 0.25, bytes_out=20)
+    other.add_file("b.eml", 2.0, bytes_in=50, bytes_out=20)
+    metrics.merge(other)
+
+    report = metrics.to_dict(top=1)
+    assert report["stages"]["parse"] == {
+        "seconds": 1.5, "calls": 2, "bytes_in": 150, "bytes_out": 0
+    }
+    assert report["stages"]["text"]["bytes_out"] == 20
+    assert report["files"] == 2
+    assert report["slowest_files"] == [
+        {"file": "b.eml", "seconds": 2.0, "bytes_in": 50, "bytes_out": 20}
+    ]
+
+
+def test_files_record_their_input_and_output_size(tmp_path: Path):
+    date = datetime(2024, 1, 2, 10, tzinfo=timezone.utc)
+    path = tmp_path / "mail.eml"
+    path.write_bytes(make_email("Hello", date, "Some text", (("a.jpg", b"image data"),)))
+    processor = EmailProcessor()
+    processor.process_email(path, tmp_path / "images")
+
+    (source, file_metrics), = processor.stats.metrics.slowest_files()
+    assert source == str(path)
+    assert file_metrics.bytes_in == path.stat().st_size
+    assert file_metrics.bytes_out == len("Some text") + len(b"image data")
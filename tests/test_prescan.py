@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+from conftest import make_email
+
+from email2md.prescan import prescan, read_headers
+
+
+def test_read_headers_decodes_encoded_subject(tmp_path):
+    path = tmp_path / "m.eml"
+    path.write_bytes(make_email("Grüße aus Köln", datetime(2024, 1, 2, tzinfo=timezone.utc)))
+    assert read_headers(path).subject == "Grüße aus Köln"
+
+
+def test_unknown_subject_charset_keeps_raw_subject(tmp_path):
+    path = tmp_path / "m.eml"
+    path.write_bytes(
+        b"Subject: =?x-unknown?Q?Hallo?=\r\n"
+        b"Date: Tue, 02 Jan 2024 10:00:00 +0000\r\n"
+        b"\r\n"
+        b"Body\r\n"
+    )
+    headers = read_headers(path)
+    assert headers.subject == "=?x-unknown?Q?Hallo?="
+    assert headers.day == "2024-01-02"
+
+
+def test_broken_subject_does_not_abort_prescan(tmp_path):
+    broken = tmp_path / "broken.eml"
+    broken.write_bytes(
+        b"Subject: =?utf-8?B?////?=\r\nDate: Wed, 03 Jan 2024 10:00:00 +0000\r\n\r\nBody\r\n"
+    )
+    fine = tmp_path / "fine.eml"
+    fine.write_bytes(make_email("Fine", datetime(2024, 1, 2, tzinfo=timezone.utc)))
+    assert [h.source for h in prescan([broken, fine])] == [fine, broken]
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+
+from email2md.records import BodyStore, EmailRecord
+
+
+def _record(body: str) -> EmailRecord:
+    return EmailRecord("Subject", datetime(2024, 1, 2, tzinfo=timezone.utc), body, [])
+
+
+def test_bodies_past_the_budget_are_spilled_and_read_back():
+    store = BodyStore(budget=10)
+    bodies = ["short", "still fits", "Grüße \ud800 with a lone surrogate", "x" * 1000]
+    records = [_record(body) for body in bodies]
+    try:
+        for record in records:
+            store.keep(record)
+        assert store.resident == 5 and store.spilled == 3
+        assert [r.body for r in records] == bodies
+        assert [r.body_length for r in records] == [len(b) for b in bodies]
+        # The budget of released bodies is used for the next ones
+        store.release(records[0])
+        fits = _record("fits")
+        store.keep(fits)
+        assert isinstance(fits._body, str) and store.spilled == 3
+    finally:
+        store.close()
+
+
+def test_spilled_bodies_can_be_read_from_many_threads():
+    store = BodyStore(budget=0)
+    bodies = [f"body {i} " * i for i in range(1, 200)]
+    records = [_record(body) for body in bodies]
+    try:
+        for record in records:
+            store.keep(record)
+        with ThreadPoolExecutor(8) as executor:
+            assert list(executor.map(lambda r: r.body, records)) == bodies
+    finally:
+        store.close()
+    with pytest.raises(ValueError, match="closed"):
+        assert records[0].body
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from email2md.records import EmailRecord
+from email2md.search import SearchIndex
+
+
+def _record(subject: str, day: int, body: str, hour: int = 10) -> EmailRecord:
+    return EmailRecord(subject, datetime(2024, 1, day, hour, tzinfo=timezone.utc), body, [])
+
+
+@pytest.fixture
+def index(tmp_path: Path):
+    index = SearchIndex(tmp_path / "search.sqlite")
+    yield index
+    index.close()
+
+
+def _subjects(index: SearchIndex, query: str, **kwargs) -> list:
+    return sorted(hit.subject for hit in index.search(query, **kwargs))
+
+
+def test_update_indexes_only_new_and_changed_emails(index: SearchIndex):
+    entries = [("a.eml", _record("Holiday", 1, "beach")), ("b.eml", _record("Work", 2, "lake"))]
+    assert index.update(entries) == (2, 0)
+    assert index.update(entries) == (0, 0)
+
+    entries[1] = ("b.eml", _record("Work", 2, "beach and lake"))
+    assert index.update(entries) == (1, 0)
+    assert _subjects(index, "beach") == ["Holiday", "Work"]
+    assert _subjects(index, "beach", since="2024-01-02") == ["Work"]
+
+
+def test_complete_update_removes_missing_emails(index: SearchIndex):
+    index.update([("a.eml", _record("Holiday", 1, "beach")), ("b.eml", _record("Work", 2, "x"))])
+    assert index.update([("a.eml", _record("Holiday", 1, "beach"))]) == (0, 1)
+    assert _subjects(index, "Work") == []
+
+    index.update([("c.eml", _record("Trip", 3, "beach"))], complete=False)
+    assert _subjects(index, "beach") == ["Holiday", "Trip"]
+    index.remove(["a.eml"])
+    assert _subjects(index, "beach") == ["Trip"]
+
+
+def test_hits_are_grouped_by_chapter(index: SearchIndex):
+    index.update(
+        [
+            ("a.eml", _record("Morning", 1, "beach", hour=8)),
+            ("b.eml", _record("Longest", 1, "a long day at the lake", hour=12)),
+            ("c.eml", _record("Evening", 1, "beach beach beach", hour=20)),
+            ("d.eml", _record("Next day", 2, "no match here")),
+            ("e.eml", _record("Trip", 3, "beach")),
+        ]
+    )
+    chapters = index.search_chapters("beach")
+    assert [chapter.day for chapter in chapters] == ["2024-01-01", "2024-01-03"]
+    # The heading is that of the Markdown, from the email with the longest body
+    assert [(c.subject, c.date) for c in chapters] == [
+        ("Longest", "2024-01-01 12:00"),
+        ("Trip", "2024-01-03 10:00"),
+    ]
+    assert [hit.subject for hit in chapters[0].hits] == ["Evening", "Morning"]
+    assert [c.day for c in index.search_chapters("beach", limit=1)] == ["2024-01-01"]
+    assert index.search_chapters("beach", since="2024-01-02")[0].hits[0].subject == "Trip"
+
+
+def test_split_period_is_kept(index: SearchIndex):
+    assert index.split is None
+    index.split = "month"
+    reopened = SearchIndex(index.index_file)
+    try:
+        assert reopened.split == "month"
+        reopened.split = None
+        assert reopened.split is None
+    finally:
+        reopened.close()
@@ -0,0 +1,122 @@
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from email2md.sources import ArchiveMember, MboxIndex, discover_sources
+
+
+def _emails(count: int) -> Dict[str, bytes]:
+    return {
+        f"mail/{i:03d}.eml": f"Subject: {i}\n\n".encode() + f"Body {i}\n".encode() * (i * 50 + 1)
+        for i in range(count)
+    }
+
+
+def _write_archive(path: Path, emails: Dict[str, bytes]) -> None:
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path, "w") as archive:
+            for name, data in emails.items():
+                archive.writestr(name, data)
+        return
+    with tarfile.open(path, "w:gz" if path.name.endswith(".gz") else "w") as archive:
+        for name, data in emails.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, BytesIO(data))
+
+
+def _read(member: ArchiveMember) -> bytes:
+    with member.open("rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", ["mails.tar", "mails.tar.gz", "mails.zip"])
+def test_archive_members_read_their_own_content(tmp_path: Path, name: str):
+    emails = _emails(20)
+    _write_archive(tmp_path / name, emails)
+    members = discover_sources(tmp_path / name, MboxIndex(None))
+    assert [m.member for m in members] == list(emails)
+    # Out of order, so every read has to find its member again
+    for member in reversed(members):
+        assert _read(member) == emails[member.member]
+
+
+@pytest.mark.parametrize("name", ["mails.tar", "mails.zip"])
+def test_archive_members_can_be_read_from_many_threads(tmp_path: Path, name: str):
+    emails = _emails(121)
+    _write_archive(tmp_path / name, emails)
+    members = discover_sources(tmp_path / name, MboxIndex(None))
+    with ThreadPoolExecutor(8) as executor:
+        for _ in range(3):
+            contents = list(executor.map(_read, members))
+            assert contents == list(emails.values())
+
+
+def _mbox_message(i: int) -> bytes:
+    separator = "From sender@example.com Mon Jan  1 00:00:00 2024\n"
+    return f"{separator}Subject: {i}\n\nBody {i}\n\n".encode()
+
+
+def test_mbox_index_scans_appended_messages(tmp_path: Path):
+    mbox = tmp_path / "Inbox.mbox"
+    mbox.write_bytes(b"".join(_mbox_message(i) for i in range(3)))
+    index = MboxIndex(tmp_path / "index.json")
+    first = index.messages(mbox)
+    assert len(first) == 3
+    index.save()
+
+    with mbox.open("ab") as f:
+        f.write(_mbox_message(3))
+    index = MboxIndex(tmp_path / "index.json")
+    second = index.messages(mbox)
+    assert second[:2] == first[:2]
+    assert len(second) == 4 and second[-1].generation == first[-1].generation
+    with second[-1].open("rb") as f:
+        assert f.read() == b"Subject: 3\n\nBody 3\n\n"
+    assert [index.messages(mbox) for _ in range(2)] == [second, second]
+
+
+def test_mbox_index_rescans_rewritten_files(tmp_path: Path):
+    mbox = tmp_path / "Inbox.mbox"
+    mbox.write_bytes(b"".join(_mbox_message(i) for i in range(3)))
+    index = MboxIndex(None)
+    first = index.messages(mbox)
+
+    # The first message was deleted by the mail client
+    mbox.write_bytes(b"".join(_mbox_message(i) for i in range(1, 4)))
+    second = index.messages(mbox)
+    assert len(second) == 3
+    assert second[0].generation == first[0].generation + 1
+    with second[0].open("rb") as f:
+        assert b"Subject: 1" in f.read()
+
+
+def test_eml_files_are_discovered_in_name_order(tmp_path: Path):
+    names = ["b.eml", "c.eml", "a.eml", "10.eml", "2.eml"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"Subject: x\n\nbody\n")
+    sources = discover_sources(tmp_path, MboxIndex(None))
+    assert [p.name for p in sources] == sorted(names)
+
+
+def test_mbox_messages_can_be_read_from_many_threads(tmp_path: Path):
+    mbox = tmp_path / "Inbox.mbox"
+    mbox.write_bytes(b"".join(_mbox_message(i) for i in range(50)))
+    index = MboxIndex(None)
+    first = index.messages(mbox)
+    # Messages of the grown file need a larger map, so threads replace their maps while reading
+    with mbox.open("ab") as f:
+        f.write(b"".join(_mbox_message(i) for i in range(50, 100)))
+    messages = [m for pair in zip(first, index.messages(mbox)[50:]) for m in pair]
+
+    with ThreadPoolExecutor(8) as executor:
+        for _ in range(3):
+            contents = list(executor.map(_read, messages))
+            assert [c.split(b"\n")[0] for c in contents] == [
+                f"Subject: {i}".encode() for pair in zip(range(50), range(50, 100)) for i in pair
+            ]
@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+from conftest import make_email
+
+from email2md.watch import Watcher
+
+
+def _watcher(input_dir: Path, tmp_path: Path) -> Watcher:
+    output = tmp_path / "out" / "Mails.md"
+    output.parent.mkdir()
+    return Watcher(input_dir, output.parent / ".images", [(output, False, False)])
+
+
+def test_update_skips_copies_of_known_emails(corpus: Path, tmp_path: Path):
+    watcher = _watcher(corpus, tmp_path)
+    assert watcher.update()
+    output = (tmp_path / "out" / "Mails.md").read_text()
+
+    (corpus / "copy.eml").write_bytes((corpus / "m07.eml").read_bytes())
+    assert watcher.update()
+    assert (tmp_path / "out" / "Mails.md").read_text() == output
+    assert corpus / "copy.eml" not in watcher.emails
+    assert corpus / "copy.eml" in watcher.duplicates
+    # A skipped copy isn't read again until something changes
+    assert not watcher.update()
+
+
+def test_copy_takes_over_when_original_is_removed(corpus: Path, tmp_path: Path):
+    watcher = _watcher(corpus, tmp_path)
+    watcher.update()
+    output = (tmp_path / "out" / "Mails.md").read_text()
+    (corpus / "copy.eml").write_bytes((corpus / "m07.eml").read_bytes())
+    watcher.update()
+
+    (corpus / "m07.eml").unlink()
+    assert watcher.update()
+    assert corpus / "copy.eml" in watcher.emails
+    assert (tmp_path / "out" / "Mails.md").read_text() == output
+
+
+def test_duplicates_within_one_update_are_rendered_once(tmp_path: Path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    watcher = _watcher(input_dir, tmp_path)
+    email = make_email(
+        "Hello", datetime(2024, 1, 2, 10, tzinfo=timezone.utc), "Body", message_id="<1@example.com>"
+    )
+    for name in ("a.eml", "b.eml"):
+        (input_dir / name).write_bytes(email)
+    watcher.update()
+    assert len(watcher.emails) == 1
+    assert (tmp_path / "out" / "Mails.md").read_text().count("Body") == 1
+
+
+def test_update_only_includes_emails_in_the_date_range(corpus: Path, tmp_path: Path):
+    output = tmp_path / "out" / "Mails.md"
+    output.parent.mkdir()
+    watcher = Watcher(
+        corpus, output.parent / ".images", [(output, False, False)], since="2024-01-05"
+    )
+    assert watcher.update()
+    assert watcher.emails
+    days = {record.date.strftime("%Y-%m-%d") for record in watcher.emails.values()}
+    assert min(days) >= "2024-01-05"
+    assert len(watcher.emails) + len(watcher.out_of_range) == 30
+    # Skipped emails aren't read again until they change
+    assert not watcher.update()
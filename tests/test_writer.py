@@ -0,0 +1,45 @@
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from email2md.email_processor import EmailProcessor
+from email2md.writer import BackgroundWriter
+
+
+def test_failed_writes_are_returned_by_flush(tmp_path: Path):
+    (tmp_path / "file").write_text("not a directory")
+    writer = BackgroundWriter()
+    try:
+        assert writer.write_bytes(tmp_path / "ok" / "a", b"a")
+        assert writer.write_bytes(tmp_path / "file" / "b", b"b")
+        assert writer.flush() == [str(tmp_path / "file" / "b")]
+        assert (tmp_path / "ok" / "a").read_bytes() == b"a"
+        assert writer.flush() == []
+    finally:
+        writer.close()
+
+
+def test_failed_writes_raise_on_exit(tmp_path: Path):
+    (tmp_path / "file").write_text("not a directory")
+    with pytest.raises(OSError, match="Failed to write 1 files"):
+        with BackgroundWriter() as writer:
+            writer.write_bytes(tmp_path / "file" / "b", b"b")
+
+
+def test_save_images_links_blobs_written_in_the_background(tmp_path: Path, monkeypatch):
+    write_file = BackgroundWriter._write_file
+
+    def slow_write_file(self, path: Path, data: bytes) -> None:
+        time.sleep(0.1)
+        write_file(self, path, data)
+
+    monkeypatch.setattr(BackgroundWriter, "_write_file", slow_write_file)
+    images = [("a.jpg", b"image a"), ("b.jpg", b"image b")]
+    date = datetime(2024, 1, 2, 10, tzinfo=timezone.utc)
+    with BackgroundWriter() as writer:
+        processor = EmailProcessor(writer=writer)
+        saved = processor.save_images(images, date, tmp_path / ".images")
+    assert [path.read_bytes() for path in saved] == [b"image a", b"image b"]
+    assert not processor.stats.failed_writes